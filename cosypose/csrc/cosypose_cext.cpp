@@ -1,7 +1,10 @@
 #include <pybind11/pybind11.h>
 #include <pybind11/stl.h>
 #include <pybind11/numpy.h>
+#include <algorithm>
+#include <numeric>
 #include <random>
+#include <thread>
 #include <tuple>
 #include <unordered_map>
 
@@ -104,6 +107,173 @@ py::tuple make_ransac_infos(
   return outputs;
 }
 
+struct BucketKey {
+  int label, view;
+  bool operator==(const BucketKey& other) const {
+    return label == other.label && view == other.view;
+  }
+};
+
+struct BucketKeyHash {
+  std::size_t operator()(const BucketKey& key) const {
+    return std::hash<long long>()(
+        (static_cast<long long>(key.label) << 32) ^
+        static_cast<unsigned int>(key.view));
+  }
+};
+
+struct ViewPairMatches {
+  int view1, view2;
+  Matches matches;
+  long long seed_offset, n_seeds;
+  long long mtc_offset;
+};
+
+py::tuple make_ransac_infos_bucketed(
+    const py::array_t<int, py::array::c_style | py::array::forcecast> view_ids,
+    const py::array_t<int, py::array::c_style | py::array::forcecast> label_ids,
+    int n_ransac_iter = 100,
+    int seed = 0,
+    int n_threads = 1) {
+  // Same outputs as make_ransac_infos, labels are given as integer ids.
+  // Candidates are first grouped by (label, view) so that only candidates
+  // with the same label are compared.
+  auto view_ids_ = view_ids.unchecked<1>();
+  auto label_ids_ = label_ids.unchecked<1>();
+  int n_cand = view_ids_.shape(0);
+  if (label_ids_.shape(0) != n_cand) {
+    throw std::invalid_argument("view_ids and label_ids must have the same size.");
+  }
+
+  std::vector<ViewPairMatches> view_pairs;
+  long long n_seeds_total = 0, n_mtc_total = 0;
+  {
+    py::gil_scoped_release release;
+    std::unordered_map<BucketKey, std::vector<int>, BucketKeyHash> buckets;
+    std::unordered_map<int, std::vector<int>> view_to_cands;
+    std::vector<int> views;
+    for (int n = 0; n < n_cand; n++) {
+      BucketKey key({label_ids_(n), view_ids_(n)});
+      buckets[key].push_back(n);
+      if (view_to_cands.count(view_ids_(n)) == 0) {
+        views.push_back(view_ids_(n));
+      }
+      view_to_cands[view_ids_(n)].push_back(n);
+    }
+    std::sort(views.begin(), views.end());
+
+    // Tentative matches, ordered as in make_ransac_infos.
+    for (int v1 : views) {
+      for (int v2 : views) {
+        if (v1 == v2)
+          continue;
+        ViewPairMatches view_pair;
+        view_pair.view1 = v1;
+        view_pair.view2 = v2;
+        for (int n : view_to_cands[v1]) {
+          const auto& bucket = buckets.find(BucketKey({label_ids_(n), v2}));
+          if (bucket == buckets.end())
+            continue;
+          for (int m : bucket->second) {
+            view_pair.matches.push_back(Match({n, m}));
+          }
+        }
+        long long n_tm = view_pair.matches.size();
+        if (n_tm == 0)
+          continue;
+        view_pair.n_seeds = std::min<long long>(n_ransac_iter, n_tm * (n_tm - 1));
+        view_pair.seed_offset = n_seeds_total;
+        view_pair.mtc_offset = n_mtc_total;
+        n_seeds_total += view_pair.n_seeds;
+        n_mtc_total += view_pair.n_seeds * n_tm;
+        view_pairs.push_back(std::move(view_pair));
+      }
+    }
+  }
+
+  py::array_t<int> seed_view1(n_seeds_total), seed_view2(n_seeds_total);
+  py::array_t<int> seed_match1_cand1(n_seeds_total), seed_match1_cand2(n_seeds_total);
+  py::array_t<int> seed_match2_cand1(n_seeds_total), seed_match2_cand2(n_seeds_total);
+  py::array_t<int> mtc_hypothesis_id(n_mtc_total), mtc_cand1(n_mtc_total), mtc_cand2(n_mtc_total);
+  int* s_view1 = seed_view1.mutable_data();
+  int* s_view2 = seed_view2.mutable_data();
+  int* s_m1c1 = seed_match1_cand1.mutable_data();
+  int* s_m1c2 = seed_match1_cand2.mutable_data();
+  int* s_m2c1 = seed_match2_cand1.mutable_data();
+  int* s_m2c2 = seed_match2_cand2.mutable_data();
+  int* m_hyp = mtc_hypothesis_id.mutable_data();
+  int* m_c1 = mtc_cand1.mutable_data();
+  int* m_c2 = mtc_cand2.mutable_data();
+
+  // Ransac seeds, view pairs are independent and write to disjoint ranges.
+  auto fill_view_pair = [&](const ViewPairMatches& view_pair) {
+    const Matches& tentative_matches = view_pair.matches;
+    int n_tentative_matches = tentative_matches.size();
+    auto perm1 = random_permutation(n_tentative_matches, seed);
+    auto perm2 = random_permutation(n_tentative_matches, seed + 1);
+    long long s = view_pair.seed_offset;
+    long long t = view_pair.mtc_offset;
+    long long s_end = view_pair.seed_offset + view_pair.n_seeds;
+    for (int m1_id : perm1) {
+      if (s >= s_end)
+        break;
+      for (int m2_id : perm2) {
+        if (s >= s_end)
+          break;
+        if (m1_id != m2_id) {
+          s_view1[s] = view_pair.view1;
+          s_view2[s] = view_pair.view2;
+          s_m1c1[s] = tentative_matches[m1_id].c1;
+          s_m1c2[s] = tentative_matches[m1_id].c2;
+          s_m2c1[s] = tentative_matches[m2_id].c1;
+          s_m2c2[s] = tentative_matches[m2_id].c2;
+          for (int i = 0; i < n_tentative_matches; i++) {
+            m_hyp[t] = s;
+            m_c1[t] = tentative_matches[i].c1;
+            m_c2[t] = tentative_matches[i].c2;
+            t++;
+          }
+          s++;
+        }
+      }
+    }
+  };
+
+  {
+    py::gil_scoped_release release;
+    int n_workers = std::max(1, std::min<int>(n_threads, view_pairs.size()));
+    if (n_workers == 1) {
+      for (const auto& view_pair : view_pairs) {
+        fill_view_pair(view_pair);
+      }
+    } else {
+      std::vector<std::thread> workers;
+      for (int w = 0; w < n_workers; w++) {
+        workers.emplace_back([&, w]() {
+          for (size_t i = w; i < view_pairs.size(); i += n_workers) {
+            fill_view_pair(view_pairs[i]);
+          }
+        });
+      }
+      for (auto& worker : workers) {
+        worker.join();
+      }
+    }
+  }
+
+  py::dict seeds, mtc;
+  seeds["view1"] = seed_view1;
+  seeds["view2"] = seed_view2;
+  seeds["match1_cand1"] = seed_match1_cand1;
+  seeds["match1_cand2"] = seed_match1_cand2;
+  seeds["match2_cand1"] = seed_match2_cand1;
+  seeds["match2_cand2"] = seed_match2_cand2;
+  mtc["hypothesis_id"] = mtc_hypothesis_id;
+  mtc["cand1"] = mtc_cand1;
+  mtc["cand2"] = mtc_cand2;
+  return py::make_tuple(seeds, mtc);
+}
+
 py::dict find_ransac_inliers(
     const py::array_t<int> seeds_view1,
     const py::array_t<int> seeds_view2,
@@ -263,6 +433,14 @@ py::dict find_ransac_inliers(
 
 PYBIND11_MODULE(cosypose_cext, m) {
   m.def("make_ransac_infos", &cosypose::make_ransac_infos);
+  m.def(
+      "make_ransac_infos_bucketed",
+      &cosypose::make_ransac_infos_bucketed,
+      py::arg("view_ids"),
+      py::arg("label_ids"),
+      py::arg("n_ransac_iter") = 100,
+      py::arg("seed") = 0,
+      py::arg("n_threads") = 1);
   m.def("find_ransac_inliers", &cosypose::find_ransac_inliers);
   m.def("scatter_argmin", &cosypose::scatter_argmin);
   m.def("expand_ids_for_symmetry", &cosypose::expand_ids_for_symmetry);
@@ -1,15 +1,22 @@
+import os
 import numpy as np
 import PIL
 import torch
 import random
+from pathlib import Path
+from tqdm import tqdm
 from PIL import ImageEnhance, ImageFilter
 from torchvision.datasets import ImageFolder
 import torch.nn.functional as F
 from copy import deepcopy
 
 from cosypose.lib3d.camera_geometry import get_K_crop_resize
+from cosypose.utils.distributed import get_rank, get_world_size
+from cosypose.utils.logging import get_logger
 from .utils import make_detections_from_segmentation, crop_to_aspect_ratio
 
+logger = get_logger(__name__)
+
 
 def to_pil(im):
     if isinstance(im, PIL.Image.Image):
@@ -126,13 +133,104 @@ class BackgroundAugmentation:
 
 
 class VOCBackgroundAugmentation(BackgroundAugmentation):
-    def __init__(self, voc_root, p=0.3):
+    def __init__(self, voc_root, p=0.3, bank_resolution=None):
         image_dataset = ImageFolder(voc_root)
         super().__init__(image_dataset=image_dataset, p=p)
+        self.bank = None
+        if bank_resolution is not None:
+            h, w = min(bank_resolution), max(bank_resolution)
+            bank_path = Path(voc_root).parent / f'{Path(voc_root).name}_backgrounds_{w}x{h}.npy'
+            # The bank is written once, by the first process.
+            if get_rank() == 0 and not bank_path.exists():
+                make_background_bank(self, bank_path, resolution=(h, w))
+            if get_world_size() > 1:
+                torch.distributed.barrier()
+            self.bank = BackgroundBank(bank_path)
 
     def get_bg_image(self, idx):
         return self.image_dataset[idx][0]
 
+    def __call__(self, im, mask, obs):
+        if self.bank is None or tuple(to_torch_uint8(im).shape[:2]) != self.bank.resolution:
+            return super().__call__(im, mask, obs)
+        if random.random() <= self.p:
+            im = to_torch_uint8(im)
+            mask = to_torch_uint8(mask)
+            im_bg = torch.as_tensor(self.bank[random.randint(0, len(self.bank) - 1)])
+            mask_bg = mask == 0
+            im[mask_bg] = im_bg[mask_bg]
+        return im, mask, obs
+
+
+class _ResizedBackgrounds:
+    def __init__(self, background_augmentation, resolution):
+        self.background_augmentation = background_augmentation
+        self.resolution = resolution
+
+    def __len__(self):
+        return len(self.background_augmentation.image_dataset)
+
+    def __getitem__(self, idx):
+        h, w = self.resolution
+        im_bg = to_pil(self.background_augmentation.get_bg_image(idx))
+        return np.asarray(im_bg.convert('RGB').resize((w, h)))
+
+
+def _no_collate(image):
+    # Module level so that the dataloader workers can be spawned.
+    return image
+
+
+def make_background_bank(background_augmentation, bank_path, resolution, n_workers=8):
+    """
+    Decodes the background images once and writes them, resized to resolution (h, w)
+    as BackgroundAugmentation does, in a (N, h, w, 3) uint8 .npy file that can be memory-mapped.
+    """
+    bank_path = Path(bank_path)
+    images = _ResizedBackgrounds(background_augmentation, resolution)
+    h, w = resolution
+    logger.info(f'Writing {len(images)} backgrounds of {w}x{h} to {bank_path} '
+                f'({len(images) * h * w * 3 / 2**30:.1f} GB)')
+    tmp_path = bank_path.with_name(f'{bank_path.stem}.{os.getpid()}.tmp.npy')
+    bank = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8, shape=(len(images), h, w, 3))
+    iterator = torch.utils.data.DataLoader(images, batch_size=None, num_workers=n_workers,
+                                           collate_fn=_no_collate)
+    for idx, im_bg in enumerate(tqdm(iterator, desc=f'Background bank {w}x{h}')):
+        bank[idx] = im_bg
+    bank.flush()
+    del bank
+    os.replace(tmp_path, bank_path)
+    return bank_path
+
+
+class BackgroundBank:
+    """
+    Background images written by make_background_bank.
+    The file is memory-mapped lazily, so the pages are shared by all the dataloader workers.
+    """
+    def __init__(self, bank_path):
+        self.bank_path = Path(bank_path)
+        bank = np.load(self.bank_path, mmap_mode='r')
+        self.n_images, self.resolution = len(bank), tuple(bank.shape[1:3])
+        self._bank = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_bank'] = None
+        return state
+
+    @property
+    def bank(self):
+        if self._bank is None:
+            self._bank = np.load(self.bank_path, mmap_mode='r')
+        return self._bank
+
+    def __len__(self):
+        return self.n_images
+
+    def __getitem__(self, idx):
+        return np.array(self.bank[idx])
+
 
 class CropResizeToAspectAugmentation:
     def __init__(self, resize=(640, 480)):
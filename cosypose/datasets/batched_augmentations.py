@@ -0,0 +1,111 @@
+import math
+import torch
+import torch.nn.functional as F
+
+
+def rgb_to_l(images):
+    # Same integer conversion as PIL's convert('L').
+    r, g, b = images.int().unbind(1)
+    return ((r * 19595 + g * 38470 + b * 7471 + 0x8000) >> 16).unsqueeze(1).float()
+
+
+def blend(degenerate, images, factor):
+    # Same as PIL's Image.blend, values are truncated to uint8.
+    out = degenerate + factor.view(-1, 1, 1, 1) * (images - degenerate)
+    return out.clamp(0, 255).floor()
+
+
+def gaussian_blur(images, sigma):
+    radius = int(math.ceil(3 * sigma))
+    x = torch.arange(-radius, radius + 1, dtype=images.dtype, device=images.device)
+    kernel = torch.exp(-x ** 2 / (2 * sigma ** 2))
+    kernel = kernel / kernel.sum()
+    bsz, c, h, w = images.shape
+    out = images.reshape(bsz * c, 1, h, w)
+    out = F.conv2d(F.pad(out, (radius, radius, 0, 0), mode='replicate'), kernel.view(1, 1, 1, -1))
+    out = F.conv2d(F.pad(out, (0, 0, radius, radius), mode='replicate'), kernel.view(1, 1, -1, 1))
+    return out.view(bsz, c, h, w).round().clamp(0, 255)
+
+
+def smooth(images):
+    # PIL's ImageFilter.SMOOTH, border pixels are unchanged.
+    bsz, c, h, w = images.shape
+    kernel = torch.ones(3, 3, dtype=images.dtype, device=images.device)
+    kernel[1, 1] = 5
+    kernel = kernel / 13
+    out = F.conv2d(images.reshape(bsz * c, 1, h, w), kernel.view(1, 1, 3, 3)).view(bsz, c, h - 2, w - 2)
+    smoothed = images.clone()
+    smoothed[..., 1:-1, 1:-1] = out.round().clamp(0, 255)
+    return smoothed
+
+
+class BatchedRGBAugmentation:
+    """
+    The RGB augmentations of PoseDataset and DetectionDataset (PillowBlur, PillowSharpness,
+    PillowContrast, PillowBrightness, PillowColor and GrayScale) applied to a collated
+    (B, 3, H, W) uint8 batch, on the device of the batch.
+    Parameters are drawn per sample with the same distributions: the augmentations are
+    applied to a sample with probability p, each enhancement with its own probability.
+    """
+    def __init__(self, p=0.8, gray_augmentation=False):
+        self.p = p
+        self.blur_factor_interval = (1, 3)
+        self.enhancements = [
+            (self.sharpness, 0.3, (0., 50.)),
+            (self.contrast, 0.3, (0.2, 50.)),
+            (self.brightness, 0.5, (0.1, 6.0)),
+            (self.color, 0.3, (0., 20.)),
+        ]
+        self.gray_p = 0.5 if gray_augmentation else 0.
+
+    @staticmethod
+    def sharpness(images, factor):
+        return blend(smooth(images), images, factor)
+
+    @staticmethod
+    def contrast(images, factor):
+        mean = (rgb_to_l(images).mean(dim=(1, 2, 3)) + 0.5).floor()
+        return blend(mean.view(-1, 1, 1, 1).expand_as(images), images, factor)
+
+    @staticmethod
+    def brightness(images, factor):
+        return blend(torch.zeros_like(images), images, factor)
+
+    @staticmethod
+    def color(images, factor):
+        return blend(rgb_to_l(images).expand_as(images), images, factor)
+
+    @staticmethod
+    def grayscale(images):
+        r, g, b = images.unbind(1)
+        gray = (0.2989 * r + 0.5870 * g + 0.1140 * b).floor()
+        return gray.unsqueeze(1).repeat(1, 3, 1, 1)
+
+    def apply_to(self, images, mask, fn, *args):
+        ids = torch.nonzero(mask).flatten()
+        if len(ids) > 0:
+            images[ids] = fn(images[ids], *[arg[ids] for arg in args])
+        return images
+
+    def __call__(self, images):
+        assert images.dim() == 4 and images.shape[1] == 3 and images.dtype == torch.uint8
+        bsz, device = images.shape[0], images.device
+        augment = torch.rand(bsz, device=device) < self.p
+        if not augment.any():
+            return images
+        images = images.float()
+
+        k_min, k_max = self.blur_factor_interval
+        radius = torch.randint(k_min, k_max + 1, (bsz, ), device=device)
+        for k in range(k_min, k_max + 1):
+            images = self.apply_to(images, augment & (radius == k), lambda x: gaussian_blur(x, sigma=k))
+
+        for fn, p, (factor_min, factor_max) in self.enhancements:
+            apply = augment & (torch.rand(bsz, device=device) <= p)
+            factor = torch.empty(bsz, device=device).uniform_(factor_min, factor_max)
+            images = self.apply_to(images, apply, fn, factor)
+
+        if self.gray_p > 0:
+            apply = augment & (torch.rand(bsz, device=device) <= self.gray_p)
+            images = self.apply_to(images, apply, self.grayscale)
+        return images.to(torch.uint8)
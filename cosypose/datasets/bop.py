@@ -1,9 +1,10 @@
-import pickle
 import json
 from pathlib import Path
+from collections import OrderedDict
 
 import numpy as np
 import pandas as pd
+import pyarrow.feather as feather
 import torch
 from PIL import Image
 
@@ -22,6 +23,108 @@ def remap_bop_targets(targets):
     return targets
 
 
+ANNOTATION_FILES = ("scene_camera", "scene_gt_info", "scene_gt")
+
+
+def write_annotations_store(annotations, save_dir):
+    """
+    Flattens the annotations of all scenes into one feather table per annotation file,
+    with one row per camera or per object, sorted by scene.
+    views.feather lists the views of each file with their number of rows.
+    """
+    save_dir = Path(save_dir)
+    save_dir.mkdir(exist_ok=True, parents=True)
+    rows = {name: [] for name in ANNOTATION_FILES}
+    views = []
+    for scene_id in sorted(annotations.keys()):
+        for name in ANNOTATION_FILES:
+            for view_id, view_annotations in annotations[scene_id].get(name, dict()).items():
+                if name == "scene_camera":
+                    view_annotations = [view_annotations]
+                views.append(dict(name=name, scene_id=scene_id, view_id=view_id,
+                                  n_rows=len(view_annotations)))
+                rows[name].extend([dict(scene_id=scene_id, **a) for a in view_annotations])
+    for name in ANNOTATION_FILES:
+        pd.DataFrame(rows[name]).to_feather(save_dir / f"{name}.feather")
+    pd.DataFrame(views, columns=["name", "scene_id", "view_id", "n_rows"]).to_feather(
+        save_dir / "views.feather")
+
+
+class BOPAnnotations:
+    """
+    Annotations of a split written by write_annotations_store.
+    get_view(scene_id_str, view_id_str) returns the annotations of a view in the format of
+    the json files of its scene: dict(scene_camera=..., scene_gt=[...], scene_gt_info=[...]).
+    Only the rows of the view are read from the memory-mapped tables,
+    the max_views last used views are kept in memory.
+    """
+    def __init__(self, save_dir, max_views=4096):
+        self.save_dir = Path(save_dir)
+        self.max_views = max_views
+        views = pd.read_feather(self.save_dir / "views.feather")
+        self.view_rows = dict()
+        self.scene_files = dict()
+        for name in ANNOTATION_FILES:
+            views_name = views[views["name"] == name]
+            n_rows = views_name["n_rows"].values
+            starts = np.concatenate(([0], np.cumsum(n_rows)[:-1])).tolist()
+            self.view_rows[name] = dict(zip(
+                zip(views_name["scene_id"].tolist(), views_name["view_id"].tolist()),
+                zip(starts, n_rows.tolist())))
+            for scene_id in views_name["scene_id"].unique():
+                self.scene_files.setdefault(scene_id, set()).add(name)
+        self.tables = dict()
+        self.cache = OrderedDict()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(tables=dict(), cache=OrderedDict())
+        return state
+
+    def keys(self):
+        return self.scene_files.keys()
+
+    def __contains__(self, scene_id):
+        return scene_id in self.scene_files
+
+    def __len__(self):
+        return len(self.scene_files)
+
+    def get_table(self, name):
+        if name not in self.tables:
+            path = (self.save_dir / f"{name}.feather").as_posix()
+            self.tables[name] = feather.read_table(path, memory_map=True)
+        return self.tables[name]
+
+    def read_records(self, name, start, n_rows):
+        records = []
+        for row in self.get_table(name).slice(start, n_rows).to_pylist():
+            records.append({k: v for k, v in row.items()
+                            if k != "scene_id" and v is not None
+                            and not (isinstance(v, float) and np.isnan(v))})
+        return records
+
+    def load_view(self, scene_id, view_id):
+        view_annotations = dict()
+        for name in self.scene_files[scene_id]:
+            rows = self.view_rows[name].get((scene_id, view_id), None)
+            if rows is not None:
+                records = self.read_records(name, *rows)
+                view_annotations[name] = records[0] if name == "scene_camera" else records
+        return view_annotations
+
+    def get_view(self, scene_id, view_id):
+        key = (scene_id, view_id)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        view_annotations = self.load_view(scene_id, view_id)
+        self.cache[key] = view_annotations
+        while len(self.cache) > self.max_views:
+            self.cache.popitem(last=False)
+        return view_annotations
+
+
 @MEMORY.cache
 def build_index(ds_dir, save_file, split, save_file_annotations):
     scene_ids, cam_ids, view_ids = [], [], []
@@ -53,7 +156,7 @@ def build_index(ds_dir, save_file, split, save_file_annotations):
         }
     )
     frame_index.to_feather(save_file)
-    save_file_annotations.write_bytes(pickle.dumps(annotations))
+    write_annotations_store(annotations, save_file_annotations)
     return
 
 
@@ -69,7 +172,7 @@ class BOPDataset:
 
         logger.info("Building index and loading annotations...")
         save_file_index = self.ds_dir / f"index_{split}.feather"
-        save_file_annotations = self.ds_dir / f"annotations_{split}.pkl"
+        save_file_annotations = self.ds_dir / f"annotations_{split}"
         build_index(
             ds_dir=ds_dir,
             save_file=save_file_index,
@@ -77,7 +180,7 @@ class BOPDataset:
             split=split,
         )
         self.frame_index = pd.read_feather(save_file_index).reset_index(drop=True)
-        self.annotations = pickle.loads(save_file_annotations.read_bytes())
+        self.annotations = BOPAnnotations(save_file_annotations)
 
         models_infos = json.loads((ds_dir / "models" / "models_info.json").read_text())
         self.all_labels = [f"obj_{int(obj_id):06d}" for obj_id in models_infos.keys()]
@@ -86,14 +189,11 @@ class BOPDataset:
     def __len__(self):
         return len(self.frame_index)
 
-    def __getitem__(self, frame_id):
-        row = self.frame_index.iloc[frame_id]
-        scene_id, view_id = row.scene_id, row.view_id
-        view_id = int(view_id)
-        view_id_str = f"{view_id:06d}"
-        scene_id_str = f"{int(scene_id):06d}"
-        scene_dir = self.base_dir / scene_id_str
+    def get_scene_dir(self, scene_id):
+        return self.base_dir / f"{int(scene_id):06d}"
 
+    def load_rgb(self, scene_dir, view_id):
+        view_id_str = f"{view_id:06d}"
         rgb_dir = scene_dir / "rgb"
         if not rgb_dir.exists():
             rgb_dir = scene_dir / "gray"
@@ -107,10 +207,39 @@ class BOPDataset:
         if rgb.ndim == 2:
             rgb = np.repeat(rgb[..., None], 3, axis=-1)
         rgb = rgb[..., :3]
-        h, w = rgb.shape[:2]
-        rgb = torch.as_tensor(rgb)
+        return rgb
+
+    def load_mask(self, scene_dir, view_id, n_objects, resolution):
+        view_id_str = f"{view_id:06d}"
+        mask = np.zeros(resolution, dtype=np.uint8)
+        if n_objects == 0:
+            return mask
+        mask_path = scene_dir / "mask_visib" / f"{view_id_str}_all.png"
+        if mask_path.exists():
+            mask = np.array(Image.open(mask_path))
+        else:
+            for n in range(n_objects):
+                mask_n = np.array(
+                    Image.open(
+                        scene_dir / "mask_visib" / f"{view_id_str}_{n:06d}.png"
+                    )
+                )
+                mask[mask_n == 255] = n + 1
+        return mask
+
+    def load_depth_raw(self, scene_dir, view_id):
+        depth_path = scene_dir / "depth" / f"{view_id:06d}.png"
+        if not depth_path.exists():
+            depth_path = depth_path.with_suffix(".tif")
+        return np.array(inout.load_depth(depth_path))
 
-        cam_annotation = self.annotations[scene_id_str]["scene_camera"][str(view_id)]
+    def get_annotations(self, scene_id, view_id):
+        """
+        Returns the camera (without resolution), the objects and
+        the depth scale of a frame.
+        """
+        view_annotations = self.annotations.get_view(f"{int(scene_id):06d}", str(view_id))
+        cam_annotation = view_annotations["scene_camera"]
         if "cam_R_w2c" in cam_annotation:
             RC0 = np.array(cam_annotation["cam_R_w2c"]).reshape(3, 3)
             tC0 = np.array(cam_annotation["cam_t_w2c"]) * 0.001
@@ -120,16 +249,15 @@ class BOPDataset:
         K = np.array(cam_annotation["cam_K"]).reshape(3, 3)
         T0C = TC0.inverse()
         T0C = T0C.toHomogeneousMatrix()
-        camera = dict(T0C=T0C, K=K, TWC=T0C, resolution=rgb.shape[:2])
+        camera = dict(T0C=T0C, K=K, TWC=T0C)
 
         T0C = TC0.inverse()
 
         objects = []
-        mask = np.zeros((h, w), dtype=np.uint8)
-        if "scene_gt_info" in self.annotations[scene_id_str]:
-            annotation = self.annotations[scene_id_str]["scene_gt"][str(view_id)]
+        if "scene_gt_info" in view_annotations:
+            annotation = view_annotations["scene_gt"]
             n_objects = len(annotation)
-            visib = self.annotations[scene_id_str]["scene_gt_info"][str(view_id)]
+            visib = view_annotations["scene_gt_info"]
             for n in range(n_objects):
                 RCO = np.array(annotation[n]["cam_R_m2c"]).reshape(3, 3)
                 tCO = np.array(annotation[n]["cam_t_m2c"]) * 0.001
@@ -154,27 +282,27 @@ class BOPDataset:
                     bbox=[x1, y1, x2, y2],
                 )
                 objects.append(obj)
+        return camera, objects, cam_annotation.get("depth_scale", None)
 
-            mask_path = scene_dir / "mask_visib" / f"{view_id_str}_all.png"
-            if mask_path.exists():
-                mask = np.array(Image.open(mask_path))
-            else:
-                for n in range(n_objects):
-                    mask_n = np.array(
-                        Image.open(
-                            scene_dir / "mask_visib" / f"{view_id_str}_{n:06d}.png"
-                        )
-                    )
-                    mask[mask_n == 255] = n + 1
+    def __getitem__(self, frame_id):
+        row = self.frame_index.iloc[frame_id]
+        scene_id, view_id = row.scene_id, row.view_id
+        view_id = int(view_id)
+        scene_dir = self.get_scene_dir(scene_id)
+
+        rgb = self.load_rgb(scene_dir, view_id)
+        h, w = rgb.shape[:2]
+        rgb = torch.as_tensor(rgb)
+
+        camera, objects, depth_scale = self.get_annotations(scene_id, view_id)
+        camera.update(resolution=rgb.shape[:2])
 
+        mask = self.load_mask(scene_dir, view_id, len(objects), (h, w))
         mask = torch.as_tensor(mask)
 
         if self.load_depth:
-            depth_path = scene_dir / "depth" / f"{view_id_str}.png"
-            if not depth_path.exists():
-                depth_path = depth_path.with_suffix(".tif")
-            depth = np.array(inout.load_depth(depth_path))
-            camera["depth"] = depth * cam_annotation["depth_scale"] / 1000
+            depth = self.load_depth_raw(scene_dir, view_id)
+            camera["depth"] = depth * depth_scale / 1000
 
         obs = dict(
             objects=objects,
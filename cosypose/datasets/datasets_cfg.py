@@ -30,8 +30,13 @@ def keep_bop19(ds):
 
 
 def make_scene_dataset(ds_name, n_frames=None):
+    # Packed BOP datasets, e.g. tless.bop19.packed
+    if ds_name.endswith('.packed'):
+        from .packed_bop import load_packed_bop_dataset
+        ds = load_packed_bop_dataset(make_scene_dataset(ds_name[:-len('.packed')]))
+
     # TLESS
-    if ds_name == 'tless.primesense.train':
+    elif ds_name == 'tless.primesense.train':
         ds = _make_tless_dataset('train_primesense')
 
     elif ds_name == 'tless.primesense.test':
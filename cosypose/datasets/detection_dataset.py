@@ -9,6 +9,7 @@ from .augmentations import (
     PillowBlur, PillowSharpness, PillowContrast, PillowBrightness, PillowColor, to_torch_uint8,
     GrayScale
 )
+from .batched_augmentations import BatchedRGBAugmentation
 
 
 class DetectionDataset(torch.utils.data.Dataset):
@@ -19,7 +20,9 @@ class DetectionDataset(torch.utils.data.Dataset):
                  resize=(640, 480),
                  gray_augmentation=False,
                  rgb_augmentation=False,
-                 background_augmentation=False):
+                 background_augmentation=False,
+                 batched_augmentation=False,
+                 background_bank=False):
 
         self.scene_ds = VisibilityWrapper(scene_ds)
 
@@ -27,7 +30,8 @@ class DetectionDataset(torch.utils.data.Dataset):
 
         self.background_augmentation = background_augmentation
         self.background_augmentations = VOCBackgroundAugmentation(
-            voc_root=LOCAL_DATA_DIR / 'VOCdevkit/VOC2012', p=0.3)
+            voc_root=LOCAL_DATA_DIR / 'VOCdevkit/VOC2012', p=0.3,
+            bank_resolution=resize if background_augmentation and background_bank else None)
 
         self.rgb_augmentation = rgb_augmentation
         self.rgb_augmentations = [
@@ -38,12 +42,26 @@ class DetectionDataset(torch.utils.data.Dataset):
             PillowColor(p=0.3, factor_interval=(0., 20.))
         ]
 
+        # RGB augmentations are applied to the collated batches with augment_batch.
+        self.batched_augmentation = batched_augmentation
+        self.batched_rgb_augmentation = BatchedRGBAugmentation(p=0.8, gray_augmentation=False)
+
         self.label_to_category_id = label_to_category_id
         self.min_area = min_area
 
     def __len__(self):
         return len(self.scene_ds)
 
+    def augment_batch(self, data, device=None):
+        images, targets = data
+        if self.batched_augmentation and self.rgb_augmentation and len(images) > 0:
+            images = torch.stack([torch.as_tensor(im) for im in images]).permute(0, 3, 1, 2)
+            if device is not None:
+                images = images.to(device, non_blocking=True)
+            images = self.batched_rgb_augmentation(images).permute(0, 2, 3, 1)
+            images = tuple(images)
+        return images, targets
+
     def get_data(self, idx):
         rgb, mask, state = self.scene_ds[idx]
 
@@ -52,7 +70,7 @@ class DetectionDataset(torch.utils.data.Dataset):
         if self.background_augmentation:
             rgb, mask, state = self.background_augmentations(rgb, mask, state)
 
-        if self.rgb_augmentation and random.random() < 0.8:
+        if self.rgb_augmentation and not self.batched_augmentation and random.random() < 0.8:
             for augmentation in self.rgb_augmentations:
                 rgb, mask, state = augmentation(rgb, mask, state)
 
@@ -0,0 +1,220 @@
+import json
+import numpy as np
+import pandas as pd
+import torch
+from pathlib import Path
+from tqdm import tqdm
+from torch.utils.data import DataLoader
+
+from cosypose.utils.logging import get_logger
+
+
+logger = get_logger(__name__)
+
+FRAME_INFO_KEYS = ("scene_id", "cam_id", "view_id", "cam_name")
+
+
+class _RawFramesDataset:
+    def __init__(self, scene_ds, load_depth):
+        self.scene_ds = scene_ds
+        self.load_depth = load_depth
+
+    def __len__(self):
+        return len(self.scene_ds.frame_index)
+
+    def __getitem__(self, frame_id):
+        ds = self.scene_ds
+        row = ds.frame_index.iloc[frame_id]
+        scene_id, view_id = row.scene_id, int(row.view_id)
+        scene_dir = ds.get_scene_dir(scene_id)
+        rgb = ds.load_rgb(scene_dir, view_id)
+        camera, objects, depth_scale = ds.get_annotations(scene_id, view_id)
+        mask = ds.load_mask(scene_dir, view_id, len(objects), rgb.shape[:2])
+        depth = None
+        if self.load_depth:
+            depth = ds.load_depth_raw(scene_dir, view_id)
+        return dict(row=row, rgb=rgb, mask=mask, depth=depth,
+                    camera=camera, objects=objects, depth_scale=depth_scale)
+
+
+def _no_collate(frame):
+    # Module level so that the dataloader workers can be spawned.
+    return frame
+
+
+def pack_bop_dataset(scene_ds, pack_dir, frames_per_shard=1000, load_depth=None, n_workers=4):
+    """
+    Converts the frames of a BOPDataset into contiguous arrays:
+    - shard_<n>/{rgb,mask,depth}.bin contain the uint8 images, uint8 label masks
+      and uint16 depth of the frames, read with offsets stored in the frame index.
+      Depth is packed if load_depth, by default if the split has depth images.
+    - cameras_K.npy, cameras_T0C.npy and objects_T0O.npy contain the poses,
+      objects.feather the other object annotations.
+    """
+    pack_dir = Path(pack_dir)
+    pack_dir.mkdir(exist_ok=True, parents=True)
+    if load_depth is None:
+        load_depth = any((scene_dir / 'depth').exists() for scene_dir in scene_ds.base_dir.iterdir())
+
+    raw_ds = _RawFramesDataset(scene_ds, load_depth=load_depth)
+    dataloader = DataLoader(raw_ds, batch_size=None, num_workers=n_workers,
+                            collate_fn=_no_collate)
+
+    frame_index, objects_infos = [], []
+    K, T0C, T0O = [], [], []
+    files = dict()
+    for frame_id, data in enumerate(tqdm(dataloader)):
+        shard_id = frame_id // frames_per_shard
+        if frame_id % frames_per_shard == 0:
+            for f in files.values():
+                f.close()
+            shard_dir = pack_dir / f'shard_{shard_id:06d}'
+            shard_dir.mkdir(exist_ok=True)
+            keys = ('rgb', 'mask', 'depth') if load_depth else ('rgb', 'mask')
+            files = {k: open(shard_dir / f'{k}.bin', 'wb') for k in keys}
+
+        h, w = data['rgb'].shape[:2]
+        frame_infos = {k: data['row'][k] for k in FRAME_INFO_KEYS}
+        frame_infos.update(shard_id=shard_id, height=h, width=w,
+                           obj_start=len(objects_infos), n_objects=len(data['objects']))
+        for k, dtype in (('rgb', np.uint8), ('mask', np.uint8), ('depth', np.uint16)):
+            if k in files:
+                array = data[k]
+                if k == 'depth':
+                    assert np.all(array == np.round(array)) and array.max() <= np.iinfo(np.uint16).max
+                frame_infos[f'{k}_offset'] = files[k].tell()
+                files[k].write(np.ascontiguousarray(array, dtype=dtype).tobytes())
+        frame_infos['depth_scale'] = data['depth_scale'] if data['depth_scale'] is not None else np.nan
+        frame_index.append(frame_infos)
+
+        K.append(data['camera']['K'])
+        T0C.append(data['camera']['T0C'])
+        for obj in data['objects']:
+            x1, y1, x2, y2 = obj['bbox']
+            objects_infos.append(dict(label=obj['label'], visib_fract=obj['visib_fract'],
+                                      id_in_segm=obj['id_in_segm'],
+                                      bbox_x1=x1, bbox_y1=y1, bbox_x2=x2, bbox_y2=y2))
+            T0O.append(obj['T0O'])
+    for f in files.values():
+        f.close()
+
+    pd.DataFrame(frame_index).to_feather(pack_dir / 'frame_index.feather')
+    pd.DataFrame(objects_infos, columns=['label', 'visib_fract', 'id_in_segm',
+                                         'bbox_x1', 'bbox_y1', 'bbox_x2', 'bbox_y2']
+                 ).to_feather(pack_dir / 'objects.feather')
+    np.save(pack_dir / 'cameras_K.npy', np.stack(K) if len(K) > 0 else np.empty((0, 3, 3)))
+    np.save(pack_dir / 'cameras_T0C.npy', np.stack(T0C) if len(T0C) > 0 else np.empty((0, 4, 4)))
+    np.save(pack_dir / 'objects_T0O.npy', np.stack(T0O) if len(T0O) > 0 else np.empty((0, 4, 4)))
+    infos = dict(name=scene_ds.name, split=scene_ds.split, ds_dir=str(scene_ds.ds_dir),
+                 all_labels=scene_ds.all_labels, load_depth=load_depth, n_frames=len(frame_index))
+    (pack_dir / 'infos.json').write_text(json.dumps(infos))
+    logger.info(f'Packed {len(frame_index)} frames in {pack_dir}')
+    return pack_dir
+
+
+class PackedBOPDataset:
+    """
+    BOPDataset served from the arrays written by pack_bop_dataset.
+    Frames are read by slicing memory-mapped shards.
+    """
+    def __init__(self, pack_dir, load_depth=False):
+        self.pack_dir = Path(pack_dir)
+        infos = json.loads((self.pack_dir / 'infos.json').read_text())
+        self.name = infos['name']
+        self.split = infos['split']
+        self.ds_dir = Path(infos['ds_dir'])
+        self.base_dir = self.ds_dir / self.split
+        self.all_labels = infos['all_labels']
+        self.has_depth = infos['load_depth']
+        self.load_depth = load_depth
+
+        self.frame_index = pd.read_feather(self.pack_dir / 'frame_index.feather')
+        self.frame_index['pack_id'] = np.arange(len(self.frame_index))
+        self.objects_infos = pd.read_feather(self.pack_dir / 'objects.feather')
+        self.cameras_K = np.load(self.pack_dir / 'cameras_K.npy', mmap_mode='r')
+        self.cameras_T0C = np.load(self.pack_dir / 'cameras_T0C.npy', mmap_mode='r')
+        self.objects_T0O = np.load(self.pack_dir / 'objects_T0O.npy', mmap_mode='r')
+        self.shards = dict()
+
+    @staticmethod
+    def is_packed(pack_dir):
+        return (Path(pack_dir) / 'infos.json').exists()
+
+    def __len__(self):
+        return len(self.frame_index)
+
+    def get_shard(self, shard_id, k):
+        # NOTE: Opened lazily, so that each dataloader worker has its own memory maps.
+        key = (shard_id, k)
+        if key not in self.shards:
+            path = self.pack_dir / f'shard_{shard_id:06d}' / f'{k}.bin'
+            dtype = np.uint16 if k == 'depth' else np.uint8
+            self.shards[key] = np.memmap(path, dtype=dtype, mode='r')
+        return self.shards[key]
+
+    def read_array(self, row, k, shape):
+        dtype = np.uint16 if k == 'depth' else np.uint8
+        start = row[f'{k}_offset'] // np.dtype(dtype).itemsize
+        array = self.get_shard(row.shard_id, k)[start:start + np.prod(shape)]
+        return np.array(array).reshape(shape)
+
+    def __getitem__(self, frame_id):
+        row = self.frame_index.iloc[frame_id]
+        pack_id = row.pack_id
+        h, w = int(row.height), int(row.width)
+
+        rgb = torch.as_tensor(self.read_array(row, 'rgb', (h, w, 3)))
+        mask = torch.as_tensor(self.read_array(row, 'mask', (h, w)))
+
+        T0C = np.array(self.cameras_T0C[pack_id])
+        camera = dict(T0C=T0C, K=np.array(self.cameras_K[pack_id]), TWC=T0C, resolution=rgb.shape[:2])
+
+        objects = []
+        obj_start, n_objects = int(row.obj_start), int(row.n_objects)
+        obj_slice = slice(obj_start, obj_start + n_objects)
+        labels = self.objects_infos['label'].values[obj_slice].tolist()
+        visib_fract = self.objects_infos['visib_fract'].values[obj_slice].tolist()
+        bboxes = self.objects_infos.loc[:, ['bbox_x1', 'bbox_y1', 'bbox_x2', 'bbox_y2']].values[obj_slice]
+        objects_T0O = np.array(self.objects_T0O[obj_slice])
+        for n in range(n_objects):
+            T0O = objects_T0O[n]
+            obj = dict(
+                label=labels[n],
+                name=labels[n],
+                TWO=T0O,
+                T0O=T0O,
+                visib_fract=visib_fract[n],
+                id_in_segm=n + 1,
+                bbox=list(bboxes[n]),
+            )
+            objects.append(obj)
+
+        if self.load_depth:
+            assert self.has_depth, 'Depth was not packed.'
+            depth = self.read_array(row, 'depth', (h, w)).astype(np.float32)
+            camera["depth"] = depth * row.depth_scale / 1000
+
+        obs = dict(
+            objects=objects,
+            camera=camera,
+            frame_info=row[list(FRAME_INFO_KEYS)].to_dict(),
+        )
+        return rgb, mask, obs
+
+
+def load_packed_bop_dataset(scene_ds, pack_dir=None, **pack_kwargs):
+    """
+    PackedBOPDataset with the frames of scene_ds, the split is packed
+    in <ds_dir>/packed_<split> the first time.
+    """
+    if pack_dir is None:
+        pack_dir = scene_ds.ds_dir / f'packed_{scene_ds.split}'
+    if not PackedBOPDataset.is_packed(pack_dir):
+        full_ds = scene_ds.__class__(scene_ds.ds_dir, split=scene_ds.split)
+        pack_bop_dataset(full_ds, pack_dir, **pack_kwargs)
+    packed_ds = PackedBOPDataset(pack_dir, load_depth=scene_ds.load_depth)
+    frame_index = scene_ds.frame_index.loc[:, ['scene_id', 'view_id']].merge(
+        packed_ds.frame_index, on=['scene_id', 'view_id'])
+    assert len(frame_index) == len(scene_ds.frame_index), 'Some frames are not packed.'
+    packed_ds.frame_index = frame_index
+    return packed_ds
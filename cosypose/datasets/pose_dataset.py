@@ -11,6 +11,7 @@ from .augmentations import (
     PillowBlur, PillowSharpness, PillowContrast, PillowBrightness, PillowColor, to_torch_uint8,
     GrayScale
 )
+from .batched_augmentations import BatchedRGBAugmentation
 
 @dataclass
 class PoseData:
@@ -39,16 +40,23 @@ class PoseDataset(torch.utils.data.Dataset):
                  min_area=None,
                  rgb_augmentation=False,
                  gray_augmentation=False,
-                 background_augmentation=False):
+                 background_augmentation=False,
+                 batched_augmentation=False,
+                 background_bank=False,
+                 n_objects_per_image=1):
 
         self.scene_ds = VisibilityWrapper(scene_ds)
 
         self.resize_augmentation = CropResizeToAspectAugmentation(resize=resize)
         self.min_area = min_area
+        # With n_objects_per_image > 1, get_data returns a list with the data of up to
+        # n_objects_per_image visible objects of the frame, flattened by collate_fn.
+        self.n_objects_per_image = n_objects_per_image
 
         self.background_augmentation = background_augmentation
         self.background_augmentations = VOCBackgroundAugmentation(
-            voc_root=LOCAL_DATA_DIR / 'VOCdevkit/VOC2012', p=0.3)
+            voc_root=LOCAL_DATA_DIR / 'VOCdevkit/VOC2012', p=0.3,
+            bank_resolution=resize if background_augmentation and background_bank else None)
 
         self.rgb_augmentation = rgb_augmentation
         self.rgb_augmentations = [
@@ -61,10 +69,16 @@ class PoseDataset(torch.utils.data.Dataset):
         if gray_augmentation:
             self.rgb_augmentations.append(GrayScale(p=0.5))
 
+        # RGB augmentations are applied to the collated batches with augment_batch.
+        self.batched_augmentation = batched_augmentation
+        self.batched_rgb_augmentation = BatchedRGBAugmentation(p=0.8, gray_augmentation=gray_augmentation)
+
     def __len__(self):
         return len(self.scene_ds)
 
     def collate_fn(self, batch):
+        if isinstance(batch[0], list):
+            batch = [x for datas in batch for x in datas]
         data = dict()
         for k in batch[0].__annotations__:
             v = [getattr(x, k) for x in batch]
@@ -74,6 +88,14 @@ class PoseDataset(torch.utils.data.Dataset):
         data = PoseData(**data)
         return data
 
+    def augment_batch(self, data, device=None):
+        if self.batched_augmentation and self.rgb_augmentation:
+            images = torch.as_tensor(data.images)
+            if device is not None:
+                images = images.to(device, non_blocking=True)
+            data.images = self.batched_rgb_augmentation(images)
+        return data
+
     def get_data(self, idx):
         rgb, mask, state = self.scene_ds[idx]
 
@@ -82,7 +104,7 @@ class PoseDataset(torch.utils.data.Dataset):
         if self.background_augmentation:
             rgb, mask, state = self.background_augmentations(rgb, mask, state)
 
-        if self.rgb_augmentation and random.random() < 0.8:
+        if self.rgb_augmentation and not self.batched_augmentation and random.random() < 0.8:
             for augmentation in self.rgb_augmentations:
                 rgb, mask, state = augmentation(rgb, mask, state)
 
@@ -109,20 +131,26 @@ class PoseDataset(torch.utils.data.Dataset):
 
         rgb = torch.as_tensor(rgb).permute(2, 0, 1).to(torch.uint8)
         assert rgb.shape[0] == 3
-
-        obj = random.sample(objects_visible, k=1)[0]
-        TWO = torch.as_tensor(obj['TWO'])
-        TWC = torch.as_tensor(state['camera']['TWC'])
-        TCO = invert_T(TWC) @ TWO
-
-        data = PoseData(
-            images=np.asarray(rgb),
-            bboxes=np.asarray(obj['bbox']),
-            TCO=np.asarray(TCO),
-            K=np.asarray(state['camera']['K']),
-            objects=obj,
-        )
-        return data
+        images = np.asarray(rgb)
+        K = np.asarray(state['camera']['K'])
+        TCW = invert_T(torch.as_tensor(state['camera']['TWC']))
+
+        n_objects = min(self.n_objects_per_image, len(objects_visible))
+        datas = []
+        for obj in random.sample(objects_visible, k=n_objects):
+            TWO = torch.as_tensor(obj['TWO'])
+            TCO = TCW @ TWO
+            data = PoseData(
+                images=images,
+                bboxes=np.asarray(obj['bbox']),
+                TCO=np.asarray(TCO),
+                K=K,
+                objects=obj,
+            )
+            datas.append(data)
+        if self.n_objects_per_image == 1:
+            return datas[0]
+        return datas
 
     def __getitem__(self, index):
         try_index = index
@@ -7,6 +7,7 @@ import cv2
 from io import BytesIO
 from .utils import make_detections_from_segmentation
 from .datasets_cfg import make_urdf_dataset
+from .synthetic_shards import ShardReader
 from pathlib import Path
 import torch.multiprocessing
 
@@ -27,6 +28,9 @@ class SyntheticSceneDataset:
         )
         self.object_set = self.cfg.scene_kwargs["urdf_ds"]
         self.keys = keys
+        self.shards = None
+        if ShardReader.is_shards_dir(self.ds_dir / "shards"):
+            self.shards = ShardReader(self.ds_dir / "shards")
         urdf_ds_name = self.cfg.scene_kwargs["urdf_ds"]
         self.name = urdf_ds_name
         urdf_ds = make_urdf_dataset(urdf_ds_name)
@@ -52,8 +56,11 @@ class SyntheticSceneDataset:
 
     def __getitem__(self, idx):
         key = self.keys[idx]
-        pkl_path = (self.ds_dir / "dumps" / key).with_suffix(".pkl")
-        dic = pkl.loads(pkl_path.read_bytes())
+        if self.shards is not None:
+            dic = pkl.loads(self.shards[key])
+        else:
+            pkl_path = (self.ds_dir / "dumps" / key).with_suffix(".pkl")
+            dic = pkl.loads(pkl_path.read_bytes())
 
         cam = dic["camera"]
         rgb = self._deserialize_im_cv2(cam["rgb"])
@@ -63,7 +70,7 @@ class SyntheticSceneDataset:
         dets_gt = make_detections_from_segmentation(torch.as_tensor(mask).unsqueeze(0))[
             0
         ]
-        mask_uniqs = set(np.unique(mask[mask > 0]))
+        mask_uniqs = set(dets_gt.keys()) - {0}
         for obj in objects:
             if obj["id_in_segm"] in mask_uniqs:
                 obj["bbox"] = dets_gt[obj["id_in_segm"]].numpy()
@@ -0,0 +1,135 @@
+import os
+import socket
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from tqdm import tqdm
+
+from cosypose.utils.logging import get_logger
+
+
+logger = get_logger(__name__)
+
+INDEX_COLUMNS = ("key", "offset", "size")
+
+
+class ShardWriter:
+    """
+    Append-only shards of serialized frames (the buffers otherwise written in dumps/<key>.pkl).
+    shards_dir/<name>-<n>.bin contains the concatenated buffers, shards_dir/<name>-<n>.index
+    one line key<TAB>offset<TAB>size per buffer, appended once the buffer is written.
+    A new shard is started when the current one exceeds max_shard_size bytes, a writer
+    re-created with the same name appends to its last shard.
+    Each process must use its own name.
+    """
+    def __init__(self, shards_dir, name=None, max_shard_size=4 * 2**30):
+        self.shards_dir = Path(shards_dir)
+        self.shards_dir.mkdir(exist_ok=True, parents=True)
+        if name is None:
+            name = f"{socket.gethostname()}-{os.getpid()}"
+        self.name = name
+        self.max_shard_size = max_shard_size
+        self.shard_id = max(len(list(self.shards_dir.glob(f"{name}-*.bin"))) - 1, 0)
+        self.data_file, self.index_file = None, None
+
+    def _open_next(self):
+        self.close()
+        shard_path = self.shards_dir / f"{self.name}-{self.shard_id:04d}"
+        self.data_file = open(shard_path.with_suffix(".bin"), "ab")
+        self.index_file = open(  # pylint: disable=unspecified-encoding
+            shard_path.with_suffix(".index"), "a"
+        )
+        self.shard_id += 1
+
+    def append(self, key, buf):
+        while self.data_file is None or self.data_file.tell() >= self.max_shard_size:
+            self._open_next()
+        offset = self.data_file.tell()
+        self.data_file.write(buf)
+        self.data_file.flush()
+        self.index_file.write(f"{key}\t{offset}\t{len(buf)}\n")
+        self.index_file.flush()
+
+    def close(self):
+        for f in (self.data_file, self.index_file):
+            if f is not None:
+                f.close()
+        self.data_file, self.index_file = None, None
+
+
+class ShardReader:
+    """
+    Reads the buffers written by ShardWriter by key.
+    Shards are memory-mapped lazily so that each dataloader worker has its own maps.
+    If a key was written several times (e.g. a resumed recording), the last one is used.
+    """
+    def __init__(self, shards_dir):
+        self.shards_dir = Path(shards_dir)
+        index = []
+        for index_path in sorted(self.shards_dir.glob("*.index")):
+            shard_index = pd.read_csv(index_path, sep="\t", header=None, names=INDEX_COLUMNS,
+                                      dtype=dict(key=str))
+            # An interrupted writer may leave an incomplete last line.
+            shard_index = shard_index.dropna()
+            shard_index["shard"] = index_path.stem
+            index.append(shard_index)
+        if len(index) > 0:
+            index = pd.concat(index, axis=0)
+        else:
+            index = pd.DataFrame(columns=[*INDEX_COLUMNS, "shard"])
+        index = index.drop_duplicates("key", keep="last").set_index("key")
+        self.index = index.astype(dict(offset=np.int64, size=np.int64))
+        self.shards = dict()
+
+    @staticmethod
+    def is_shards_dir(shards_dir):
+        return Path(shards_dir).is_dir() and len(list(Path(shards_dir).glob("*.index"))) > 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["shards"] = dict()
+        return state
+
+    def keys(self):
+        return self.index.index.tolist()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index.index
+
+    def get_shard(self, shard):
+        if shard not in self.shards:
+            path = (self.shards_dir / shard).with_suffix(".bin")
+            self.shards[shard] = np.memmap(path, dtype=np.uint8, mode="r")
+        return self.shards[shard]
+
+    def __getitem__(self, key):
+        shard, offset, size = self.index.loc[key, ["shard", "offset", "size"]]
+        return self.get_shard(shard)[offset:offset + size].tobytes()
+
+
+def convert_dumps_to_shards(ds_dir, max_shard_size=4 * 2**30, remove_dumps=False):
+    """
+    Copies the dumps/<key>.pkl files of a synthetic dataset into ds_dir/shards,
+    keys are unchanged. Already converted keys are skipped.
+    """
+    ds_dir = Path(ds_dir)
+    shards_dir = ds_dir / "shards"
+    done_keys = set()
+    if ShardReader.is_shards_dir(shards_dir):
+        done_keys = set(ShardReader(shards_dir).keys())
+    writer = ShardWriter(shards_dir, name="dumps", max_shard_size=max_shard_size)
+    pkl_paths = sorted((ds_dir / "dumps").glob("*.pkl"))
+    n_converted = 0
+    for pkl_path in tqdm(pkl_paths):
+        if pkl_path.stem not in done_keys:
+            writer.append(pkl_path.stem, pkl_path.read_bytes())
+            n_converted += 1
+    writer.close()
+    if remove_dumps:
+        for pkl_path in pkl_paths:
+            pkl_path.unlink()
+    logger.info(f"Converted {n_converted} frames to {shards_dir}")
+    return shards_dir
@@ -1,6 +1,5 @@
 import torch
 import torchvision
-import numpy as np
 from cosypose.lib3d.camera_geometry import get_K_crop_resize
 
 
@@ -24,19 +23,47 @@ def crop_to_aspect_ratio(images, box, masks=None, K=None):
     return images, masks, K
 
 
+def make_boxes_from_segmentation(masks, n_ids=None):
+    """
+    Boxes of all the ids of (B, H, W) label masks in a single pass over the pixels:
+    the (id, row) and (id, column) pairs present in the masks are scattered to
+    (B, n_ids, H) and (B, n_ids, W) occupancy arrays, whose first/last nonzero give the box.
+    Returns boxes (B, n_ids, 4) as x1, y1, x2, y2 (int64) and valid (B, n_ids),
+    True if the id is in the mask. n_ids defaults to masks.max() + 1.
+    """
+    assert masks.dim() == 3
+    bsz, h, w = masks.shape
+    labels = masks.long()
+    if n_ids is None:
+        n_ids = int(labels.max().item()) + 1 if labels.numel() > 0 else 0
+    device = masks.device
+
+    def first_last(index, size):
+        occupied = torch.zeros((bsz, n_ids * size), dtype=torch.uint8, device=device)
+        occupied.scatter_(1, index.flatten(1), 1)
+        occupied = occupied.view(bsz, n_ids, size)
+        first = occupied.argmax(dim=-1)
+        last = size - 1 - occupied.flip(-1).argmax(dim=-1)
+        return first, last, occupied.any(dim=-1)
+
+    arange_y = torch.arange(h, device=device).view(1, h, 1)
+    arange_x = torch.arange(w, device=device).view(1, 1, w)
+    y1, y2, valid = first_last(labels * h + arange_y, h)
+    x1, x2, _ = first_last(labels * w + arange_x, w)
+    boxes = torch.stack((x1, y1, x2, y2), dim=-1)
+    return boxes, valid
+
+
 def make_detections_from_segmentation(masks):
-    detections = []
     if masks.dim() == 4:
         assert masks.shape[0] == 1
         masks = masks.squeeze(0)
 
-    for mask_n in masks:
-        dets_n = dict()
-        for uniq in torch.unique(mask_n, sorted=True):
-            ids = np.where((mask_n == uniq).cpu().numpy())
-            x1, y1, x2, y2 = np.min(ids[1]), np.min(ids[0]), np.max(ids[1]), np.max(ids[0])
-            dets_n[int(uniq.item())] = torch.tensor([x1, y1, x2, y2]).to(mask_n.device)
-        detections.append(dets_n)
+    detections = []
+    boxes, valid = make_boxes_from_segmentation(masks)
+    for boxes_n, valid_n in zip(boxes, valid):
+        ids = torch.nonzero(valid_n).flatten().tolist()
+        detections.append({uniq: boxes_n[uniq] for uniq in ids})
     return detections
 
 
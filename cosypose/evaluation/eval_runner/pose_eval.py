@@ -12,10 +12,15 @@ from cosypose.utils.distributed import get_world_size, get_rank, get_tmp_dir
 import cosypose.utils.tensor_collection as tc
 from cosypose.evaluation.data_utils import parse_obs_data
 from cosypose.datasets.samplers import DistributedSceneSampler
+from cosypose.evaluation.predictions_store import LazyPredictions
+from cosypose.utils.logging import get_logger
+
+logger = get_logger(__name__)
 
 
 class PoseEvaluation:
-    def __init__(self, scene_ds, meters, batch_size=64, cache_data=True, n_workers=4, sampler=None):
+    def __init__(self, scene_ds, meters, batch_size=64, cache_data=True, n_workers=4, sampler=None,
+                 streaming=False):
 
         self.rank = get_rank()
         self.world_size = get_world_size()
@@ -31,13 +36,20 @@ class PoseEvaluation:
                                 num_workers=n_workers,
                                 sampler=sampler, collate_fn=self.collate_fn)
 
-        if cache_data:
+        # In streaming mode, the meters only keep running statistics
+        # and the ground truth is not cached.
+        self.streaming = streaming
+        if cache_data and not streaming:
             self.dataloader = list(tqdm(dataloader))
         else:
             self.dataloader = dataloader
 
         self.meters = meters
         self.meters = OrderedDict({k: v for k, v in sorted(self.meters.items(), key=lambda item: item[0])})
+        if streaming:
+            for meter_k, meter in self.meters.items():
+                assert hasattr(meter, 'streaming'), f'Meter {meter_k} does not support streaming.'
+                meter.streaming = True
 
 
     @staticmethod
@@ -58,15 +70,33 @@ class PoseEvaluation:
         obj_data = tc.concatenate(obj_data)
         return obj_data
 
-    def evaluate(self, obj_predictions, device='cuda'):
+    def evaluate(self, obj_predictions, device='cuda', summary_interval=None):
         for meter in self.meters.values():
             meter.reset()
-        obj_predictions = obj_predictions.to(device)
-        for obj_data_gt in tqdm(self.dataloader):
+        # Predictions from the store are only read for the frames of each batch.
+        lazy = isinstance(obj_predictions, LazyPredictions)
+        if not lazy:
+            obj_predictions = obj_predictions.to(device)
+        for n, obj_data_gt in enumerate(tqdm(self.dataloader)):
+            preds = obj_predictions
+            if lazy:
+                preds = obj_predictions.select_frames(obj_data_gt.infos).to(device)
             for k, meter in self.meters.items():
-                meter.add(obj_predictions, obj_data_gt.to(device))
+                meter.add(preds, obj_data_gt.to(device))
+            if summary_interval is not None and (n + 1) % summary_interval == 0:
+                logger.info(f'Running summary (rank={self.rank}, n_batches={n+1}): {self.running_summary()}')
         return self.summary()
 
+    def running_summary(self):
+        """ Summary of the data seen so far by this process, meant for streaming meters. """
+        summary = dict()
+        for meter_k, meter in sorted(self.meters.items()):
+            if len(meter.datas) > 0:
+                summary_, _ = meter.summary()
+                for k, v in summary_.items():
+                    summary[meter_k + '/' + k] = v
+        return summary
+
     def summary(self):
         summary, dfs = dict(), dict()
         for meter_k, meter in sorted(self.meters.items()):
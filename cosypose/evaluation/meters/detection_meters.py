@@ -5,6 +5,7 @@ import torchvision
 import torch
 from torch.utils.data import TensorDataset, DataLoader
 from .base import Meter
+from .running_stats import DetectionRunningStats, make_labels_df
 
 from .utils import (
     match_poses,
@@ -25,6 +26,7 @@ class DetectionMeter(Meter):
         targets=None,
         visib_gt_min=-1,
         n_top=-1,
+        streaming=False,
     ):
 
         self.iou_threshold = iou_threshold
@@ -33,6 +35,7 @@ class DetectionMeter(Meter):
         self.visib_gt_min = visib_gt_min
         self.errors_bsz = errors_bsz
         self.n_top = n_top
+        self.streaming = streaming
         self.reset()
 
     def compute_metrics(self, bbox_pred, bbox_gt):
@@ -184,11 +187,23 @@ class DetectionMeter(Meter):
         )
         preds["iou_valid"] = "pred_id", preds_match_merge["iou_valid"].data
 
-        self.datas["gt_df"].append(gt)
-        self.datas["pred_df"].append(preds)
-        self.datas["matches_df"].append(matches)
+        if self.streaming:
+            if len(self.datas["stats"]) == 0:
+                self.datas["stats"].append(DetectionRunningStats(n_top=self.n_top))
+            self.datas["stats"][0].update(gt, preds, matches)
+        else:
+            self.datas["gt_df"].append(gt)
+            self.datas["pred_df"].append(preds)
+            self.datas["matches_df"].append(matches)
 
     def summary(self):
+        if self.streaming:
+            # Statistics of the different ranks are merged after gather_distributed.
+            stats = DetectionRunningStats(n_top=self.n_top)
+            for stats_n in self.datas["stats"]:
+                stats.merge(stats_n)
+            return stats.summary()
+
         gt_df = xr.concat(self.datas["gt_df"], dim="gt_id")
         matches_df = xr.concat(self.datas["matches_df"], dim="match_id")
         pred_df = xr.concat(self.datas["pred_df"], dim="pred_id")
@@ -264,5 +279,6 @@ class DetectionMeter(Meter):
             }
         )
 
-        dfs = dict(gt=gt_df, matches=matches_df, preds=pred_df, ap=ap_dfs)
+        labels_df = make_labels_df(n_gts, ap_dfs)
+        dfs = dict(gt=gt_df, matches=matches_df, preds=pred_df, ap=ap_dfs, labels=labels_df)
         return summary, dfs
@@ -5,7 +5,11 @@ from collections import OrderedDict
 import torch
 from torch.utils.data import TensorDataset, DataLoader
 
-from cosypose.lib3d.distances import dists_add, dists_add_symmetric
+from cosypose.lib3d.distances import (
+    dists_add,
+    dists_add_symmetric_chunked,
+    SymmetricDistanceIndex,
+)
 from cosypose.utils.xarray import xr_merge
 
 from .utils import (
@@ -17,6 +21,7 @@ from .utils import (
     compute_auc_posecnn,
 )
 from .base import Meter
+from .running_stats import PoseErrorRunningStats, make_labels_df
 
 
 class PoseErrorMeter(Meter):
@@ -36,6 +41,8 @@ class PoseErrorMeter(Meter):
         targets=None,
         visib_gt_min=-1,
         n_top=-1,
+        nn_backend="kdtree",
+        streaming=False,
     ):
 
         self.sample_n_points = sample_n_points
@@ -52,18 +59,42 @@ class PoseErrorMeter(Meter):
         self.report_AP = report_AP
         self.report_error_stats = report_error_stats
         self.report_error_AUC = report_error_AUC
+        self.streaming = streaming
         self.reset()
 
         if self.exact_meshes:
-            assert self.errors_bsz == 1 and sample_n_points is None
+            assert sample_n_points is None
+
+        assert nn_backend in {"kdtree", "brute"}
+        self.nn_backend = nn_backend
+        # Built on the first symmetric error, ADD does not need it.
+        self.nn_index = None
+
+    def dists_add_symmetric(self, TXO_pred, TXO_gt, points, labels, points_mask=None):
+        if self.nn_backend == "kdtree" and self.exact_meshes:
+            if self.nn_index is None:
+                self.nn_index = SymmetricDistanceIndex(self.mesh_db)
+            return self.nn_index.dists_add_symmetric(TXO_pred, TXO_gt, points, labels)
+        return dists_add_symmetric_chunked(TXO_pred, TXO_gt, points, points_mask=points_mask)
+
+    def get_points_mask(self, labels):
+        n_points = torch.as_tensor(
+            [self.mesh_db.infos[label]["n_points"] for label in labels],
+            device=self.mesh_db.points.device,
+        )
+        n_points_max = int(n_points.max()) if len(n_points) > 0 else 0
+        arange = torch.arange(n_points_max, device=n_points.device)
+        return arange.unsqueeze(0) < n_points.unsqueeze(1)
 
     def compute_errors(self, TXO_pred, TXO_gt, labels):
         meshes = self.mesh_db.select(labels)
 
+        points_mask = None
         if self.exact_meshes:
-            assert len(labels) == 1
-            n_points = self.mesh_db.infos[labels[0]]["n_points"]
-            points = meshes.points[:, :n_points]
+            # Meshes are padded to the largest mesh of the database,
+            # padded points are masked out of the errors.
+            points_mask = self.get_points_mask(labels)
+            points = meshes.points[:, :points_mask.shape[1]]
         else:
             if self.sample_n_points is not None:
                 points = meshes.sample_points(self.sample_n_points, deterministic=True)
@@ -74,7 +105,9 @@ class PoseErrorMeter(Meter):
             dists = dists_add(TXO_pred, TXO_gt, points)
 
         elif self.error_type.upper() == "ADD-S":
-            dists = dists_add_symmetric(TXO_pred, TXO_gt, points)
+            dists = self.dists_add_symmetric(
+                TXO_pred, TXO_gt, points, labels, points_mask=points_mask
+            )
 
         elif self.error_type.upper() == "ADD(-S)":
             ids_nosym, ids_sym = [], []
@@ -93,15 +126,22 @@ class PoseErrorMeter(Meter):
                     TXO_pred[ids_nosym], TXO_gt[ids_nosym], points[ids_nosym]
                 )
             if len(ids_sym) > 0:
-                dists[ids_sym] = dists_add_symmetric(
-                    TXO_pred[ids_sym], TXO_gt[ids_sym], points[ids_sym]
+                dists[ids_sym] = self.dists_add_symmetric(
+                    TXO_pred[ids_sym], TXO_gt[ids_sym], points[ids_sym], labels[ids_sym],
+                    points_mask=points_mask[ids_sym] if points_mask is not None else None,
                 )
         else:
             raise ValueError("Error not supported", self.error_type)
 
         errors = dict()
-        errors["norm_avg"] = torch.norm(dists, dim=-1, p=2).mean(-1)
-        errors["xyz_avg"] = dists.abs().mean(dim=-2)
+        if points_mask is not None:
+            weights = points_mask.to(dists.dtype)
+            weights = weights / weights.sum(dim=-1, keepdim=True)
+            errors["norm_avg"] = (torch.norm(dists, dim=-1, p=2) * weights).sum(-1)
+            errors["xyz_avg"] = (dists.abs() * weights.unsqueeze(-1)).sum(dim=-2)
+        else:
+            errors["norm_avg"] = torch.norm(dists, dim=-1, p=2).mean(-1)
+            errors["xyz_avg"] = dists.abs().mean(dim=-2)
         errors["TCO_xyz"] = (TXO_pred[:, :3, -1] - TXO_gt[:, :3, -1]).abs()
         errors["TCO_norm"] = torch.norm(
             TXO_pred[:, :3, -1] - TXO_gt[:, :3, -1], dim=-1, p=2
@@ -111,7 +151,11 @@ class PoseErrorMeter(Meter):
     def compute_errors_batch(self, TXO_pred, TXO_gt, labels):
         errors = []
         ids = torch.arange(len(labels))
-        ds = TensorDataset(TXO_pred, TXO_gt, ids)
+        if self.exact_meshes:
+            # Batch meshes with similar number of points together to limit padding.
+            n_points = np.array([self.mesh_db.infos[label]["n_points"] for label in labels])
+            ids = torch.as_tensor(np.argsort(n_points, kind="stable"), dtype=torch.long)
+        ds = TensorDataset(TXO_pred[ids], TXO_gt[ids], ids)
         dl = DataLoader(ds, batch_size=self.errors_bsz)
         for TXO_pred_, TXO_gt_, ids_ in dl:
             labels_ = labels[ids_.numpy()]
@@ -128,8 +172,12 @@ class PoseErrorMeter(Meter):
             )
 
         errorsd = dict()
+        inv_ids = torch.empty_like(ids)
+        inv_ids[ids] = torch.arange(len(ids))
         for k in errors[0].keys():
             errorsd[k] = torch.cat([errors_n[k] for errors_n in errors], dim=0)
+            if len(ids) > 0:
+                errorsd[k] = errorsd[k][inv_ids.to(errorsd[k].device)]
         return errorsd
 
     def add(self, pred_data, gt_data):
@@ -295,11 +343,29 @@ class PoseErrorMeter(Meter):
         )
         preds["0.1d"] = "pred_id", preds_match_merge["0.1d"].data
 
-        self.datas["gt_df"].append(gt)
-        self.datas["pred_df"].append(preds)
-        self.datas["matches_df"].append(matches)
+        if self.streaming:
+            if len(self.datas["stats"]) == 0:
+                self.datas["stats"].append(
+                    PoseErrorRunningStats(n_top=self.n_top, keep_ap_data=self.report_AP)
+                )
+            self.datas["stats"][0].update(gt, preds, matches)
+        else:
+            self.datas["gt_df"].append(gt)
+            self.datas["pred_df"].append(preds)
+            self.datas["matches_df"].append(matches)
 
     def summary(self):
+        if self.streaming:
+            # Statistics of the different ranks are merged after gather_distributed.
+            stats = PoseErrorRunningStats(n_top=self.n_top, keep_ap_data=self.report_AP)
+            for stats_n in self.datas["stats"]:
+                stats.merge(stats_n)
+            return stats.summary(
+                report_AP=self.report_AP,
+                report_error_stats=self.report_error_stats,
+                report_error_AUC=self.report_error_AUC,
+            )
+
         gt_df = xr.concat(self.datas["gt_df"], dim="gt_id")
         matches_df = xr.concat(self.datas["matches_df"], dim="match_id")
         pred_df = xr.concat(self.datas["pred_df"], dim="pred_id")
@@ -406,5 +472,6 @@ class PoseErrorMeter(Meter):
                 }
             )
 
-        dfs = dict(gt=gt_df, matches=matches_df, preds=pred_df, ap=ap_dfs)
+        labels_df = make_labels_df(n_gts, ap_dfs, AUCs=AUC)
+        dfs = dict(gt=gt_df, matches=matches_df, preds=pred_df, ap=ap_dfs, labels=labels_df)
         return summary, dfs
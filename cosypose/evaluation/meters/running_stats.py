@@ -0,0 +1,265 @@
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from sklearn.metrics import average_precision_score
+
+from .utils import (
+    auc_posecnn_stats,
+    merge_auc_posecnn_stats,
+    compute_auc_posecnn_from_stats,
+)
+
+
+class APRunningStats:
+    """
+    Per-label number of gt that can be matched and (score, valid_k) pairs of the predictions,
+    updated with the gt/preds datasets of each batch, to compute the AP as the meters' summary.
+    The pairs are only kept when keep_ap_data is set: this is O(n_preds), as the preds dataset
+    of the non-streaming meters, but only stores a score and a boolean per prediction.
+    """
+    def __init__(self, valid_k, n_top=-1, keep_ap_data=True):
+        self.valid_k = valid_k
+        self.n_top = n_top
+        self.keep_ap_data = keep_ap_data
+        self.n_gt_valid = dict()
+        self.ap_data = dict()
+
+    def update(self, gt, preds):
+        # Number of gt that can be matched, for the AP.
+        group_keys = ['scene_id', 'view_id', 'label']
+        gt_df = gt[[*group_keys, 'valid']].to_dataframe()
+        if self.n_top > 0:
+            subdf = gt_df.groupby(group_keys).sum().reset_index()
+            subdf['gt_count'] = np.minimum(self.n_top, subdf['valid'])
+            n_gt_valid = subdf.groupby('label')['gt_count'].sum()
+        else:
+            n_gt_valid = gt_df.groupby('label')['valid'].sum()
+        for label, n in n_gt_valid.items():
+            self.n_gt_valid[label] = self.n_gt_valid.get(label, 0) + int(n)
+
+        if self.keep_ap_data:
+            pred_labels = preds['label'].values
+            scores = preds['score'].values
+            tp = preds[self.valid_k].values.astype(bool)
+            for label in np.unique(pred_labels):
+                mask = pred_labels == label
+                self.ap_data.setdefault(label, []).append((scores[mask], tp[mask]))
+
+    def merge(self, other):
+        assert self.valid_k == other.valid_k and self.n_top == other.n_top
+        for label, n in other.n_gt_valid.items():
+            self.n_gt_valid[label] = self.n_gt_valid.get(label, 0) + n
+        self.keep_ap_data = self.keep_ap_data and other.keep_ap_data
+        for label, data in other.ap_data.items():
+            self.ap_data[label] = self.ap_data.get(label, []) + data
+        return self
+
+    def get_ap_df(self, labels):
+        data = [(label, d) for label in labels for d in self.ap_data.get(label, [])]
+        return pd.DataFrame({
+            "label": np.concatenate([np.full(len(d[0]), label) for label, d in data]
+                                    or [np.empty(0, dtype=object)]),
+            self.valid_k: np.concatenate([d[1] for _, d in data] or [np.empty(0, dtype=bool)]),
+            "score": np.concatenate([d[0] for _, d in data] or [np.empty(0)]),
+        })
+
+    def compute_ap(self):
+        # Same AP dataframes as the summary of the meters.
+        valid_k = self.valid_k
+        assert self.keep_ap_data
+
+        def compute_ap(label_df, label_n_gt):
+            label_df = label_df.sort_values("score", ascending=False).reset_index(drop=True)
+            label_df["n_tp"] = np.cumsum(label_df[valid_k].values.astype(np.float32))
+            label_df["prec"] = label_df["n_tp"] / (np.arange(len(label_df)) + 1)
+            label_df["recall"] = label_df["n_tp"] / label_n_gt
+            y_true = label_df[valid_k]
+            y_score = label_df["score"]
+            ap = average_precision_score(y_true, y_score) * y_true.sum() / label_n_gt
+            label_df["AP"] = ap
+            label_df["n_gt"] = label_n_gt
+            return ap, label_df
+
+        ap_dfs = dict()
+        for label, n_gt in self.n_gt_valid.items():
+            label_df = self.get_ap_df([label]).drop(columns="label")
+            if label_df[valid_k].sum() > 0:
+                _, ap_dfs[label] = compute_ap(label_df, n_gt)
+        if len(ap_dfs) > 0:
+            mAP = np.mean([np.unique(ap_df["AP"]).item() for ap_df in ap_dfs.values()])
+            AP, ap_dfs["all"] = compute_ap(self.get_ap_df(list(self.ap_data.keys())),
+                                           sum(list(self.n_gt_valid.values())))
+        else:
+            AP, mAP = 0.0, 0.0
+        return AP, mAP, ap_dfs
+
+
+class PoseErrorRunningStats:
+    """
+    Running statistics of the PoseErrorMeter summary, updated with the gt/preds/matches
+    datasets of each batch instead of keeping them in memory.
+    The memory does not depend on the number of frames, except for the (score, 0.1d)
+    pairs of the predictions that are kept to compute the exact AP when keep_ap_data is set
+    (see APRunningStats).
+    summary returns the same dfs as PoseErrorMeter.summary, gt, matches and preds are None
+    as they are not kept.
+    """
+    def __init__(self, n_top=-1, keep_ap_data=False):
+        self.n_top = n_top
+        self.n_gt = 0
+        self.n_pred = 0
+        self.n_matched = 0
+        self.n_valid_01d = 0
+        self.auc_stats = dict()
+        self.auc_stats_all = auc_posecnn_stats([])
+        self.errors_sum = dict(norm=0., xyz=np.zeros(3), TCO_xyz=np.zeros(3), TCO_norm=0.)
+        self.ap_stats = APRunningStats('0.1d', n_top=n_top, keep_ap_data=keep_ap_data)
+
+    def update(self, gt, preds, matches):
+        self.n_gt += gt.sizes['gt_id']
+        self.n_pred += preds.sizes['pred_id']
+        self.n_matched += matches.sizes['match_id']
+        self.ap_stats.update(gt, preds)
+
+        # Errors of valid gt, for the AUC and 0.1d.
+        valid = gt['valid'].values.astype(bool)
+        labels = gt['label'].values[valid]
+        norm = gt['norm'].values[valid]
+        assert np.all(~np.isnan(norm))
+        self.n_valid_01d += int(gt['0.1d'].values[valid].sum())
+        self.auc_stats_all = merge_auc_posecnn_stats(self.auc_stats_all, auc_posecnn_stats(norm))
+        for label in np.unique(labels):
+            stats = auc_posecnn_stats(norm[labels == label])
+            if label in self.auc_stats:
+                stats = merge_auc_posecnn_stats(self.auc_stats[label], stats)
+            self.auc_stats[label] = stats
+
+        for k in self.errors_sum.keys():
+            self.errors_sum[k] = self.errors_sum[k] + matches[k].values.sum(0)
+
+    def merge(self, other):
+        assert self.n_top == other.n_top
+        self.n_gt += other.n_gt
+        self.n_pred += other.n_pred
+        self.n_matched += other.n_matched
+        self.n_valid_01d += other.n_valid_01d
+        self.ap_stats.merge(other.ap_stats)
+        self.auc_stats_all = merge_auc_posecnn_stats(self.auc_stats_all, other.auc_stats_all)
+        for label, stats in other.auc_stats.items():
+            if label in self.auc_stats:
+                stats = merge_auc_posecnn_stats(self.auc_stats[label], stats)
+            self.auc_stats[label] = stats
+        for k in self.errors_sum.keys():
+            self.errors_sum[k] = self.errors_sum[k] + other.errors_sum[k]
+        return self
+
+    def summary(self, report_AP=False, report_error_stats=False, report_error_AUC=False):
+        n_gt_valid = int(sum(list(self.ap_stats.n_gt_valid.values())))
+        summary = {
+            "n_gt": self.n_gt,
+            "n_gt_valid": n_gt_valid,
+            "n_pred": self.n_pred,
+            "n_matched": self.n_matched,
+            "matched_gt_ratio": self.n_matched / n_gt_valid,
+            "pred_matched_ratio": self.n_pred / max(self.n_matched, 1),
+            "0.1d": self.n_valid_01d / n_gt_valid,
+        }
+
+        if report_error_stats:
+            n_matched = self.n_matched if self.n_matched > 0 else np.nan
+            errors_mean = {k: v / n_matched for k, v in self.errors_sum.items()}
+            summary.update(
+                {
+                    "norm": float(errors_mean["norm"]),
+                    "xyz": errors_mean["xyz"].tolist(),
+                    "TCO_xyz": errors_mean["TCO_xyz"].tolist(),
+                    "TCO_norm": float(errors_mean["TCO_norm"]),
+                }
+            )
+
+        ap_dfs = dict()
+        if self.ap_stats.keep_ap_data:
+            AP, mAP, ap_dfs = self.ap_stats.compute_ap()
+        if report_AP:
+            assert self.ap_stats.keep_ap_data
+            summary.update(
+                {
+                    "AP": AP,
+                    "mAP": mAP,
+                }
+            )
+
+        AUCs = OrderedDict({label: compute_auc_posecnn_from_stats(stats)
+                            for label, stats in sorted(self.auc_stats.items())})
+        if report_error_AUC:
+            summary.update(
+                {
+                    "AUC/objects/mean": np.nanmean(list(AUCs.values())) if len(AUCs) > 0 else np.nan,
+                    "AUC": compute_auc_posecnn_from_stats(self.auc_stats_all),
+                }
+            )
+
+        labels_df = make_labels_df(self.ap_stats.n_gt_valid, ap_dfs, AUCs=AUCs)
+        dfs = dict(gt=None, matches=None, preds=None, ap=ap_dfs, labels=labels_df)
+        return summary, dfs
+
+
+class DetectionRunningStats:
+    """
+    Running statistics of the DetectionMeter summary, same as PoseErrorRunningStats.
+    """
+    def __init__(self, n_top=-1):
+        self.n_top = n_top
+        self.n_gt = 0
+        self.n_pred = 0
+        self.n_matched = 0
+        self.n_valid_iou = 0
+        self.ap_stats = APRunningStats('iou_valid', n_top=n_top, keep_ap_data=True)
+
+    def update(self, gt, preds, matches):
+        self.n_gt += gt.sizes['gt_id']
+        self.n_pred += preds.sizes['pred_id']
+        self.n_matched += matches.sizes['match_id']
+        self.ap_stats.update(gt, preds)
+        valid = gt['valid'].values.astype(bool)
+        self.n_valid_iou += int(gt['iou_valid'].values[valid].sum())
+
+    def merge(self, other):
+        assert self.n_top == other.n_top
+        self.n_gt += other.n_gt
+        self.n_pred += other.n_pred
+        self.n_matched += other.n_matched
+        self.n_valid_iou += other.n_valid_iou
+        self.ap_stats.merge(other.ap_stats)
+        return self
+
+    def summary(self):
+        n_gt_valid = int(sum(list(self.ap_stats.n_gt_valid.values())))
+        AP, mAP, ap_dfs = self.ap_stats.compute_ap()
+        summary = {
+            "n_gt": self.n_gt,
+            "n_gt_valid": n_gt_valid,
+            "n_pred": self.n_pred,
+            "n_matched": self.n_matched,
+            "matched_gt_ratio": self.n_matched / n_gt_valid,
+            "pred_matched_ratio": self.n_pred / max(self.n_matched, 1),
+            "iou_valid_recall": self.n_valid_iou / n_gt_valid,
+            "AP": AP,
+            "mAP": mAP,
+        }
+        labels_df = make_labels_df(self.ap_stats.n_gt_valid, ap_dfs)
+        dfs = dict(gt=None, matches=None, preds=None, ap=ap_dfs, labels=labels_df)
+        return summary, dfs
+
+
+def make_labels_df(n_gt_valid, ap_dfs, AUCs=None):
+    labels = sorted(n_gt_valid.keys())
+    labels_df = dict(
+        label=labels,
+        n_gt_valid=[int(n_gt_valid[label]) for label in labels],
+    )
+    if AUCs is not None:
+        labels_df.update(AUC=[AUCs.get(label, np.nan) for label in labels])
+    labels_df.update(AP=[np.unique(ap_dfs[label]["AP"]).item() if label in ap_dfs else np.nan
+                         for label in labels])
+    return pd.DataFrame(labels_df)
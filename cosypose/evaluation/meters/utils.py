@@ -22,10 +22,8 @@ def add_inst_num(infos,
                  group_keys=['scene_id', 'view_id', 'label'],
                  key='pred_inst_num'):
 
-    inst_num = np.empty(len(infos), dtype=np.int32)
-    for group_name, group_ids in infos.groupby(group_keys).groups.items():
-        inst_num[group_ids.values] = np.arange(len(group_ids))
-    infos[key] = inst_num
+    inst_num = infos.groupby(list(group_keys), sort=False).cumcount().values
+    infos[key] = inst_num.astype(np.int32)
     return infos
 
 
@@ -34,35 +32,28 @@ def get_top_n_ids(infos,
                   top_key='score',
                   n_top=-1, targets=None):
 
-    infos['id_before_top_n'] = np.arange(len(infos))
     group_keys = list(group_keys)
-
-    if targets is not None:
-        targets_inst_count = dict()
-        for k, ids in targets.groupby(group_keys).groups.items():
-            targets_inst_count[k] = targets.loc[ids[0], 'inst_count']
-
-    def get_top_n(group_k):
-        if n_top > 0:
-            return n_top
-        elif targets is not None:
-            return targets_inst_count.get(group_k, 0)
-        else:
-            return None
-
-    keep_ids = []
-    for k, ids in infos.groupby(group_keys).groups.items():
-        group = infos.iloc[ids].sort_values(top_key, ascending=False)
-        top_n = get_top_n(k)
-        if top_n is None:
-            top_n = len(group)
-        keep_ids.append(group['id_before_top_n'].values[:top_n])
-    if len(keep_ids) > 0:
-        keep_ids = np.concatenate(keep_ids)
+    if len(infos) == 0:
+        return []
+
+    # Sort by group then decreasing top_key, ties are kept in the order of infos.
+    group_ids = infos.groupby(group_keys, sort=True).ngroup().values
+    ids = np.arange(len(infos))
+    order = np.lexsort((ids, -infos[top_key].values.astype(np.float64), group_ids))
+    order = order[group_ids[order] >= 0]
+    group_ids_sorted = group_ids[order]
+    rank = np.arange(len(order)) - np.searchsorted(group_ids_sorted, group_ids_sorted, side='left')
+
+    if n_top > 0:
+        keep = rank < n_top
+    elif targets is not None:
+        targets_inst_count = targets.drop_duplicates(group_keys).loc[:, group_keys + ['inst_count']]
+        inst_count = infos.loc[:, group_keys].merge(targets_inst_count, on=group_keys, how='left')
+        inst_count = inst_count['inst_count'].fillna(0).values
+        keep = rank < inst_count[order]
     else:
-        keep_ids = []
-    del infos['id_before_top_n']
-    return keep_ids
+        keep = np.ones(len(order), dtype=bool)
+    return order[keep]
 
 
 def add_valid_gt(gt_infos,
@@ -97,6 +88,59 @@ def get_candidate_matches(pred_infos, gt_infos,
 
 
 def match_poses(cand_infos, group_keys=['scene_id', 'view_id', 'label']):
+    """
+    Greedy matching of predictions to ground truths within each group.
+    Predictions are processed by decreasing score and matched to the
+    available ground truth with the lowest (finite) error.
+    Candidates are sorted once by (group, score desc, error asc) and matched
+    in a single pass over the sorted candidates.
+    """
+    assert 'error' in cand_infos
+
+    if len(cand_infos) == 0:
+        return cand_infos
+
+    group_keys = list(group_keys)
+    group_ids = cand_infos.groupby(group_keys, sort=True).ngroup().values
+    pred_ids = cand_infos['pred_id'].values
+    gt_ids = cand_infos['gt_id'].values
+    errors = cand_infos['error'].values.astype(np.float64)
+    scores = cand_infos['score'].values.astype(np.float64)
+    cand_ids = np.arange(len(cand_infos))
+
+    # Ties in scores are broken by first appearance of the prediction (stable sort),
+    # ties in errors by order in cand_infos.
+    _, pred_first_ids, pred_inv = np.unique(pred_ids, return_index=True, return_inverse=True)
+    pred_first = pred_first_ids[pred_inv.reshape(-1)]
+    order = np.lexsort((cand_ids, errors, pred_first, -scores, group_ids))
+    # Candidates with a missing group key are dropped, as groupby does.
+    order = order[group_ids[order] >= 0]
+
+    pred_sorted = pred_ids[order].tolist()
+    gt_sorted = gt_ids[order].tolist()
+    valid_sorted = (errors[order] < np.inf).tolist()
+    order = order.tolist()
+
+    gt_taken = set()
+    matched_ids = []
+    pred_done = None
+    for n in range(len(order)):
+        pred_id = pred_sorted[n]
+        if pred_id == pred_done:
+            continue
+        gt_id = gt_sorted[n]
+        if valid_sorted[n] and gt_id not in gt_taken:
+            gt_taken.add(gt_id)
+            matched_ids.append(order[n])
+            pred_done = pred_id
+    matches = cand_infos.iloc[matched_ids].reset_index(drop=True)
+    return matches
+
+
+def match_poses_iterrows(cand_infos, group_keys=['scene_id', 'view_id', 'label']):
+    """
+    Reference implementation of match_poses, slow on large datasets.
+    """
     assert 'error' in cand_infos
 
     matches = []
@@ -150,3 +194,30 @@ def compute_auc_posecnn(errors):
     ids = np.where(mrec[1:] != mrec[:-1])[0] + 1
     ap = ((mrec[ids] - mrec[ids-1]) * mpre[ids]).sum() * 10
     return ap
+
+
+def auc_posecnn_stats(errors):
+    """
+    Sufficient statistics of compute_auc_posecnn, which only depends on the number of
+    errors, and the number, sum and max of the errors below the 0.1 threshold.
+    """
+    errors = np.asarray(errors, dtype=np.float64)
+    errors_below = errors[errors <= 0.1]
+    return dict(n=len(errors), n_below=len(errors_below),
+                sum_below=errors_below.sum(),
+                max_below=errors_below.max() if len(errors_below) > 0 else 0.)
+
+
+def merge_auc_posecnn_stats(stats1, stats2):
+    return dict(n=stats1['n'] + stats2['n'],
+                n_below=stats1['n_below'] + stats2['n_below'],
+                sum_below=stats1['sum_below'] + stats2['sum_below'],
+                max_below=max(stats1['max_below'], stats2['max_below']))
+
+
+def compute_auc_posecnn_from_stats(stats):
+    # NOTE: Closed form of the area computed in compute_auc_posecnn.
+    if stats['n_below'] == 0:
+        return np.nan
+    area = 0.1 * stats['n_below'] - stats['sum_below'] + stats['max_below']
+    return area / stats['n'] * 10
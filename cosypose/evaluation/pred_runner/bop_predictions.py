@@ -79,9 +79,23 @@ class BopPredictionRunner:
                         mv_predictor=None,
                         n_coarse_iterations=1,
                         n_refiner_iterations=1,
-                        detection_th=0.0):
+                        detection_th=0.0,
+                        predictions_writer=None,
+                        predictions_prefix=None):
+        """
+        If predictions_writer is provided, the predictions of each batch are appended
+        to the store under '<predictions_prefix>/<key>' and not kept in memory.
+        """
 
         predictions = defaultdict(list)
+
+        def add_predictions(k, v):
+            if predictions_writer is not None:
+                key = k if predictions_prefix is None else f'{predictions_prefix}/{k}'
+                predictions_writer.append(key, v)
+            else:
+                predictions[k].append(v)
+
         use_icp = icp_refiner is not None
         for n, data in enumerate(tqdm(self.dataloader)):
             images = data['images'].cuda().float().permute(0, 3, 1, 2) / 255
@@ -142,8 +156,8 @@ class BopPredictionRunner:
             for k, v in all_preds.items():
                 v.infos = v.infos.loc[:, ['scene_id', 'view_id', 'label', 'score']]
                 v.infos['time'] = duration
-                predictions[k].append(v.cpu())
-            predictions['detections'].append(this_batch_detections.cpu())
+                add_predictions(k, v.cpu())
+            add_predictions('detections', this_batch_detections.cpu())
 
         predictions = dict(predictions)
         for k, v in predictions.items():
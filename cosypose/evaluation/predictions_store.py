@@ -0,0 +1,211 @@
+import json
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import torch
+from pathlib import Path
+from urllib.parse import quote
+
+import cosypose.utils.tensor_collection as tc
+
+
+class PredictionsWriter:
+    """
+    Append-only on-disk store of predictions (PandasTensorCollection), indexed by key.
+    For each key, the infos are appended to an Arrow IPC stream and each tensor
+    to a raw binary file that can be memory-mapped by PredictionsReader.
+    Each process writes in its own directory: store_dir/rank=<rank>/<key>.
+    The directory of the rank is cleared when the writer is created, and the rank 0
+    removes the directories of ranks >= world_size left by a previous run.
+    """
+    def __init__(self, store_dir, rank=0, world_size=1):
+        assert 0 <= rank < world_size
+        store_dir = Path(store_dir)
+        self.rank_dir = store_dir / f'rank={rank}'
+        if self.rank_dir.exists():
+            shutil.rmtree(self.rank_dir)
+        if rank == 0:
+            for rank_dir in store_dir.glob('rank=*'):
+                if int(rank_dir.name.split('=')[-1]) >= world_size:
+                    shutil.rmtree(rank_dir)
+        self.rank_dir.mkdir(parents=True)
+        (self.rank_dir / 'writer.json').write_text(json.dumps(dict(rank=rank, world_size=world_size)))
+        self.key_writers = dict()
+
+    def _open(self, key, data):
+        key_dir = self.rank_dir / quote(key, safe='')
+        key_dir.mkdir(exist_ok=True)
+        schema = pa.Schema.from_pandas(data.infos, preserve_index=False)
+        sink = pa.OSFile((key_dir / 'infos.arrow').as_posix(), 'wb')
+        tensors = dict()
+        for k, v in data.tensors.items():
+            tensors[k] = dict(dtype=str(v.cpu().numpy().dtype), shape=list(v.shape[1:]))
+        key_writer = dict(
+            key_dir=key_dir,
+            schema=schema,
+            sink=sink,
+            infos_writer=pa.ipc.new_stream(sink, schema),
+            tensor_files={k: open(key_dir / f'{k}.bin', 'wb') for k in tensors.keys()},
+            tensors=tensors,
+            n_rows=0,
+        )
+        self.key_writers[key] = key_writer
+        return key_writer
+
+    def append(self, key, data):
+        if len(data) == 0:
+            return
+        key_writer = self.key_writers.get(key, None)
+        if key_writer is None:
+            key_writer = self._open(key, data)
+
+        schema = key_writer['schema']
+        table = pa.Table.from_pandas(data.infos, preserve_index=False)
+        if table.schema.names != schema.names:
+            raise ValueError(f'Infos columns of {key} changed: {table.schema.names}, '
+                             f'expected {schema.names}')
+        try:
+            table = table.cast(schema)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+            raise ValueError(f'Infos of {key} cannot be cast to the schema of the first batch '
+                             f'{schema.types}: {table.schema.types}') from e
+        key_writer['infos_writer'].write_table(table)
+        key_writer['sink'].flush()
+        assert set(data.tensors.keys()) == set(key_writer['tensors'].keys())
+        for k, f in key_writer['tensor_files'].items():
+            array = data.tensors[k].detach().cpu().numpy()
+            tensor_infos = key_writer['tensors'][k]
+            assert list(array.shape[1:]) == tensor_infos['shape']
+            f.write(np.ascontiguousarray(array, dtype=tensor_infos['dtype']).tobytes())
+            f.flush()
+        key_writer['n_rows'] += len(data)
+
+        # Written last, readers only consider the first n_rows rows.
+        meta = dict(key=key, n_rows=key_writer['n_rows'], tensors=key_writer['tensors'])
+        (key_writer['key_dir'] / 'meta.json').write_text(json.dumps(meta))
+
+    def close(self):
+        for key_writer in self.key_writers.values():
+            key_writer['infos_writer'].close()
+            key_writer['sink'].close()
+            for f in key_writer['tensor_files'].values():
+                f.close()
+        self.key_writers = dict()
+
+
+class PredictionsReader:
+    """
+    Reads the predictions written by PredictionsWriter (all ranks).
+    Infos are read for one key at a time, tensors are memory-mapped and only
+    the selected rows are loaded.
+    The ranks of the store must be the ranks 0..world_size-1 of a single run.
+    """
+    def __init__(self, store_dir):
+        self.store_dir = Path(store_dir)
+        self.parts = dict()
+        rank_dirs = sorted(self.store_dir.glob('rank=*'), key=lambda p: int(p.name.split('=')[-1]))
+        ranks = [int(rank_dir.name.split('=')[-1]) for rank_dir in rank_dirs]
+        world_sizes = {json.loads((rank_dir / 'writer.json').read_text())['world_size']
+                       for rank_dir in rank_dirs if (rank_dir / 'writer.json').exists()}
+        if len(rank_dirs) > 0 and (len(world_sizes) != 1 or ranks != list(range(next(iter(world_sizes))))):
+            raise ValueError(f'Predictions of {self.store_dir} are not from a single run: '
+                             f'ranks {ranks}, world sizes {sorted(world_sizes)}')
+        for rank_dir in rank_dirs:
+            for meta_path in sorted(rank_dir.glob('*/meta.json')):
+                meta = json.loads(meta_path.read_text())
+                meta['key_dir'] = meta_path.parent
+                self.parts.setdefault(meta['key'], []).append(meta)
+
+    @staticmethod
+    def is_store(store_dir):
+        return Path(store_dir).is_dir() and len(list(Path(store_dir).glob('rank=*/*/meta.json'))) > 0
+
+    def keys(self):
+        return list(self.parts.keys())
+
+    def __contains__(self, key):
+        return key in self.parts
+
+    def __getitem__(self, key):
+        return LazyPredictions(self, key)
+
+    def read_infos(self, key, columns=None):
+        infos = []
+        for part in self.parts[key]:
+            with pa.memory_map((part['key_dir'] / 'infos.arrow').as_posix()) as source:
+                table = pa.ipc.open_stream(source).read_all()
+            if columns is not None:
+                table = table.select(list(columns))
+            infos.append(table.slice(0, part['n_rows']).to_pandas())
+        return pd.concat(infos, axis=0).reset_index(drop=True)
+
+    def read_tensors(self, key, ids=None):
+        parts = self.parts[key]
+        offsets = np.cumsum([0] + [part['n_rows'] for part in parts])
+        if ids is None:
+            ids = np.arange(offsets[-1])
+        ids = np.asarray(ids, dtype=np.int64)
+        tensors = dict()
+        for k, tensor_infos in parts[0]['tensors'].items():
+            dtype, shape = np.dtype(tensor_infos['dtype']), tensor_infos['shape']
+            array = np.empty((len(ids), *shape), dtype=dtype)
+            for part, offset in zip(parts, offsets[:-1]):
+                mask = (ids >= offset) & (ids < offset + part['n_rows'])
+                if mask.any():
+                    mmap = np.memmap(part['key_dir'] / f'{k}.bin', dtype=dtype, mode='r',
+                                     shape=(part['n_rows'], *shape))
+                    array[mask] = mmap[ids[mask] - offset]
+            tensors[k] = torch.as_tensor(array)
+        return tensors
+
+
+class LazyPredictions:
+    """
+    Predictions of one key of a PredictionsReader, infos are loaded in memory
+    and tensors are only read for the selected rows.
+    """
+    def __init__(self, reader, key):
+        self.reader = reader
+        self.key = key
+        self.infos = reader.read_infos(key)
+
+    def __len__(self):
+        return len(self.infos)
+
+    def __getitem__(self, ids):
+        ids = np.arange(len(self))[ids]
+        infos = self.infos.iloc[ids].reset_index(drop=True)
+        return tc.PandasTensorCollection(infos=infos, **self.reader.read_tensors(self.key, ids))
+
+    def load(self):
+        return self[:]
+
+    def select(self, scene_ids=None, view_ids=None, labels=None):
+        mask = np.ones(len(self), dtype=bool)
+        for column, values in (('scene_id', scene_ids), ('view_id', view_ids), ('label', labels)):
+            if values is not None:
+                mask &= np.isin(self.infos[column].values, np.asarray(values))
+        return self[np.where(mask)[0]]
+
+    def select_frames(self, frames):
+        """ frames: DataFrame with scene_id and view_id columns. """
+        frames = frames.loc[:, ['scene_id', 'view_id']].drop_duplicates()
+        infos = self.infos.loc[:, ['scene_id', 'view_id']].copy()
+        infos['row_id'] = np.arange(len(infos))
+        ids = np.sort(infos.merge(frames, on=['scene_id', 'view_id'])['row_id'].values)
+        return self[ids]
+
+
+def load_predictions(results_dir, key, lazy=True):
+    """
+    Predictions of a run saved either in the predictions store or in results.pth.tar.
+    With the store, only the predictions of key are read, and the tensors are
+    read on demand if lazy.
+    """
+    results_dir = Path(results_dir)
+    store_dir = results_dir / 'predictions'
+    if PredictionsReader.is_store(store_dir):
+        predictions = PredictionsReader(store_dir)[key]
+        return predictions if lazy else predictions.load()
+    return torch.load(results_dir / 'results.pth.tar')['predictions'][key]
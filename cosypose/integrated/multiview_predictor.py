@@ -6,16 +6,18 @@ import cosypose.utils.tensor_collection as tc
 from cosypose.lib3d.transform_ops import invert_T
 from cosypose.multiview.ransac import multiview_candidate_matching
 from cosypose.multiview.bundle_adjustment import make_view_groups, MultiviewRefinement
+from cosypose.multiview.batched_bundle_adjustment import BatchedMultiviewRefinement
 
 from cosypose.utils.logging import get_logger
 logger = get_logger(__name__)
 
 
 class MultiviewScenePredictor:
-    def __init__(self, mesh_db, n_sym=64, ba_aabb=True, ba_n_points=None):
-        self.mesh_db_ransac = mesh_db.batched(n_sym=n_sym, aabb=True).cuda().float()
+    def __init__(self, mesh_db, n_sym=64, ba_aabb=True, ba_n_points=None, device='cuda'):
+        self.device = device
+        self.mesh_db_ransac = mesh_db.batched(n_sym=n_sym, aabb=True).to(device).float()
         self.mesh_db_ba = mesh_db.batched(
-            aabb=ba_aabb, resample_n_points=ba_n_points, n_sym=n_sym).cuda().float()
+            aabb=ba_aabb, resample_n_points=ba_n_points, n_sym=n_sym).to(device).float()
 
     def reproject_scene(self, objects, cameras):
         TCO_data = []
@@ -43,8 +45,17 @@ class MultiviewScenePredictor:
     def predict_scene_state(
             self, candidates, cameras,
             score_th=0.3, use_known_camera_poses=False,
-            ransac_n_iter=2000, ransac_dist_threshold=0.02,
-            ba_n_iter=100):
+            ransac_n_iter=2000, ransac_dist_threshold=0.02, ransac_adaptive=False,
+            ba_n_iter=100, ba_jacobian=None, ba_solver=None, ba_batched=False):
+
+        if ba_batched:
+            # All view groups are refined together, this uses the analytic jacobian and schur solver.
+            if ba_jacobian not in (None, 'analytic') or ba_solver not in (None, 'schur'):
+                raise ValueError('Batched bundle adjustment only supports ba_jacobian=analytic and '
+                                 f'ba_solver=schur, got {ba_jacobian} and {ba_solver}.')
+        else:
+            ba_jacobian = 'autograd' if ba_jacobian is None else ba_jacobian
+            ba_solver = 'dense' if ba_solver is None else ba_solver
 
         predictions = dict()
         cand_inputs = candidates
@@ -63,6 +74,7 @@ class MultiviewScenePredictor:
         matching_outputs = multiview_candidate_matching(
             candidates=candidates, mesh_db=self.mesh_db_ransac,
             n_ransac_iter=ransac_n_iter, dist_threshold=ransac_dist_threshold,
+            adaptive=ransac_adaptive,
             cameras=cameras if use_known_camera_poses else None
         )
 
@@ -77,20 +89,34 @@ class MultiviewScenePredictor:
         predictions['cand_matched'] = candidates
 
         group_infos = make_view_groups(pairs_TC1C2)
-        candidates = candidates.merge_df(group_infos, on='view_id').cuda()
+        candidates = candidates.merge_df(group_infos, on='view_id').to(self.device)
 
         pred_objects, pred_cameras, pred_reproj = [], [], []
         pred_reproj_init = []
+        view_groups, problems = [], []
         for (view_group, candidate_ids) in candidates.infos.groupby('view_group').groups.items():
             candidates_n = candidates[candidate_ids]
             problem = MultiviewRefinement(candidates=candidates_n,
                                           cameras=cameras,
                                           pairs_TC1C2=pairs_TC1C2,
                                           mesh_db=self.mesh_db_ba)
-            ba_outputs = problem.solve(
+            view_groups.append(view_group)
+            problems.append(problem)
+
+        if ba_batched:
+            all_ba_outputs = BatchedMultiviewRefinement(problems).solve(
                 n_iterations=ba_n_iter,
                 optimize_cameras=not use_known_camera_poses,
             )
+        else:
+            all_ba_outputs = [problem.solve(
+                n_iterations=ba_n_iter,
+                optimize_cameras=not use_known_camera_poses,
+                jacobian=ba_jacobian,
+                solver=ba_solver,
+            ) for problem in problems]
+
+        for view_group, ba_outputs in zip(view_groups, all_ba_outputs):
             pred_objects_, pred_cameras_ = ba_outputs['objects'], ba_outputs['cameras']
             for x in (pred_objects_, pred_cameras_):
                 x.infos['view_group'] = view_group
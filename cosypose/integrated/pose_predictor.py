@@ -15,11 +15,23 @@ class CoarseRefinePosePredictor(torch.nn.Module):
     def __init__(self,
                  coarse_model=None,
                  refiner_model=None,
-                 bsz_objects=64):
+                 bsz_objects=64,
+                 pipelined=False,
+                 amp_dtype=None,
+                 channels_last=False):
+        """
+        amp_dtype: torch.float16 or torch.bfloat16 to run the networks of the
+        coarse and refiner models in mixed precision.
+        """
         super().__init__()
         self.coarse_model = coarse_model
         self.refiner_model = refiner_model
         self.bsz_objects = bsz_objects
+        self.pipelined = pipelined
+        if amp_dtype is not None or channels_last:
+            for model in (coarse_model, refiner_model):
+                if model is not None:
+                    model.enable_mixed_precision(dtype=amp_dtype, channels_last=channels_last)
         self.eval()
 
     @torch.no_grad()
@@ -32,17 +44,38 @@ class CoarseRefinePosePredictor(torch.nn.Module):
         ds = TensorDataset(ids)
         dl = DataLoader(ds, batch_size=self.bsz_objects)
 
-        preds = defaultdict(list)
-        for (batch_ids, ) in dl:
-            timer.resume()
+        def get_inputs(batch_ids):
             obj_inputs = obj_data[batch_ids.numpy()]
-            labels = obj_inputs.infos['label'].values
             im_ids = obj_inputs.infos['batch_im_id'].values
-            images_ = images[im_ids]
-            K_ = K[im_ids]
-            TCO_input = obj_inputs.poses
-            outputs = model(images=images_, K=K_, TCO=TCO_input,
-                            n_iterations=n_iterations, labels=labels)
+            inputs = dict(images=images[im_ids], K=K[im_ids], TCO=obj_inputs.poses,
+                          labels=obj_inputs.infos['label'].values)
+            return obj_inputs, inputs
+
+        def prefetch(batch_ids):
+            # Crops the next batch and starts rendering it while the current batch is processed.
+            obj_inputs, inputs = get_inputs(batch_ids)
+            prefetched_inputs = model.crop_and_render(**inputs, asynchronous=True)
+            return obj_inputs, inputs, prefetched_inputs
+
+        batches = list(dl)
+        next_batch = None
+        if self.pipelined and len(batches) > 0:
+            timer.resume()
+            next_batch = prefetch(batches[0][0])
+            timer.pause()
+
+        preds = defaultdict(list)
+        for batch_n, (batch_ids, ) in enumerate(batches):
+            timer.resume()
+            if self.pipelined:
+                obj_inputs, inputs, prefetched_inputs = next_batch
+                if batch_n + 1 < len(batches):
+                    next_batch = prefetch(batches[batch_n + 1][0])
+            else:
+                obj_inputs, inputs = get_inputs(batch_ids)
+                prefetched_inputs = None
+            outputs = model(**inputs, n_iterations=n_iterations,
+                            prefetched_inputs=prefetched_inputs)
             timer.pause()
             for n in range(1, n_iterations+1):
                 iter_outputs = outputs[f'iteration={n}']
@@ -1,4 +1,6 @@
+import numpy as np
 import torch
+from scipy.spatial import cKDTree
 from cosypose.lib3d.transform_ops import transform_pts
 
 
@@ -8,12 +10,85 @@ def dists_add(TXO_pred, TXO_gt, points):
     dists = TXO_gt_points - TXO_pred_points
     return dists
 
-def dists_add_symmetric(TXO_pred, TXO_gt, points):
+def dists_add_symmetric(TXO_pred, TXO_gt, points, points_mask=None):
+    """
+    points_mask: (bsz, n_points) bool, False for padded points which can't be
+    selected as the closest point.
+    """
     TXO_pred_points = transform_pts(TXO_pred, points)
     TXO_gt_points = transform_pts(TXO_gt, points)
     distances = torch.cdist(TXO_gt_points, TXO_pred_points,
                             p=2, compute_mode='donot_use_mm_for_euclid_dist')
-    closest_points_idx = torch.argmin(distances, dim=2).squeeze()
-    TXO_pred_closest_to_gt = torch.index_select(TXO_pred_points, 1, closest_points_idx)
+    if points_mask is not None:
+        distances.masked_fill_(~points_mask.unsqueeze(1), float('inf'))
+    closest_points_idx = torch.argmin(distances, dim=2)
+    TXO_pred_closest_to_gt = torch.gather(
+        TXO_pred_points, 1, closest_points_idx.unsqueeze(-1).expand(-1, -1, 3))
     min_translations = TXO_gt_points - TXO_pred_closest_to_gt
     return min_translations
+
+
+def dists_add_symmetric_chunked(TXO_pred, TXO_gt, points, points_mask=None, max_elements=2**26):
+    """
+    Same as dists_add_symmetric, the gt points are processed in chunks so that
+    the distance matrix has at most max_elements elements.
+    """
+    bsz, n_points = points.shape[:2]
+    chunk_size = max(max_elements // max(bsz * n_points, 1), 1)
+    if chunk_size >= n_points:
+        return dists_add_symmetric(TXO_pred, TXO_gt, points, points_mask=points_mask)
+
+    TXO_pred_points = transform_pts(TXO_pred, points)
+    TXO_gt_points = transform_pts(TXO_gt, points)
+    min_translations = torch.empty_like(TXO_gt_points)
+    for start in range(0, n_points, chunk_size):
+        TXO_gt_points_ = TXO_gt_points[:, start:start + chunk_size]
+        distances = torch.cdist(TXO_gt_points_, TXO_pred_points,
+                                p=2, compute_mode='donot_use_mm_for_euclid_dist')
+        if points_mask is not None:
+            distances.masked_fill_(~points_mask.unsqueeze(1), float('inf'))
+        closest_points_idx = torch.argmin(distances, dim=2)
+        TXO_pred_closest_to_gt = torch.gather(
+            TXO_pred_points, 1, closest_points_idx.unsqueeze(-1).expand(-1, -1, 3))
+        min_translations[:, start:start + chunk_size] = TXO_gt_points_ - TXO_pred_closest_to_gt
+    return min_translations
+
+
+class SymmetricDistanceIndex:
+    """
+    KD-trees on the points of each mesh of a BatchedMeshes,
+    built once on the first query of each mesh.
+    The nearest neighbor search of ADD-S is done in the frame of the predicted object,
+    where the predicted points are the mesh points.
+    """
+    def __init__(self, mesh_db, n_workers=-1):
+        self.n_workers = n_workers
+        self.mesh_db = mesh_db
+        self.trees = dict()
+
+    def get_tree(self, label):
+        if label not in self.trees:
+            n = self.mesh_db.label_to_id[label]
+            n_points = self.mesh_db.infos[label]['n_points']
+            points = self.mesh_db.points[n, :n_points].detach().cpu().double().numpy()
+            self.trees[label] = cKDTree(points)
+        return self.trees[label]
+
+    def dists_add_symmetric(self, TXO_pred, TXO_gt, points, labels):
+        TXO_pred_points = transform_pts(TXO_pred, points)
+        TXO_gt_points = transform_pts(TXO_gt, points)
+        TOgt_Opred = torch.inverse(TXO_pred.double()) @ TXO_gt.double()
+        query_points = transform_pts(TOgt_Opred, points.double()).cpu().numpy()
+
+        labels = np.asarray(labels)
+        closest_points_idx = np.empty(query_points.shape[:2], dtype=np.int64)
+        for label in np.unique(labels):
+            ids = np.where(labels == label)[0]
+            _, idx = self.get_tree(label).query(query_points[ids].reshape(-1, 3), workers=self.n_workers)
+            closest_points_idx[ids] = idx.reshape(len(ids), -1)
+
+        closest_points_idx = torch.as_tensor(closest_points_idx, device=TXO_pred_points.device)
+        TXO_pred_closest_to_gt = torch.gather(
+            TXO_pred_points, 1, closest_points_idx.unsqueeze(-1).expand(-1, -1, 3))
+        min_translations = TXO_gt_points - TXO_pred_closest_to_gt
+        return min_translations
@@ -21,6 +21,44 @@ def compute_rotation_matrix_from_ortho6d(poses):
     return matrix
 
 
+def skew_matrix(v):
+    zeros = torch.zeros_like(v[..., 0])
+    M = torch.stack((zeros, -v[..., 2], v[..., 1],
+                     v[..., 2], zeros, -v[..., 0],
+                     -v[..., 1], v[..., 0], zeros), dim=-1)
+    return M.view(*v.shape[:-1], 3, 3)
+
+
+def compute_rotation_matrix_from_ortho6d_jacobian(poses):
+    """
+    Jacobian of compute_rotation_matrix_from_ortho6d.
+    Returns J (..., 3, 3, 6) where J[..., k, :, :] is the derivative
+    of the k-th column of the rotation matrix w.r.t. the 6d parameters.
+    """
+    assert poses.shape[-1] == 6
+    a = poses[..., 0:3]
+    b = poses[..., 3:6]
+    eye = torch.eye(3, dtype=poses.dtype, device=poses.device).expand(*a.shape[:-1], 3, 3)
+    a_norm = torch.norm(a, p=2, dim=-1, keepdim=True)
+    x = a / a_norm
+    w = torch.cross(x, b, dim=-1)
+    w_norm = torch.norm(w, p=2, dim=-1, keepdim=True)
+    z = w / w_norm
+    skew_x, skew_z = skew_matrix(x), skew_matrix(z)
+
+    dx_da = (eye - x.unsqueeze(-1) @ x.unsqueeze(-2)) / a_norm.unsqueeze(-1)
+    dz_dw = (eye - z.unsqueeze(-1) @ z.unsqueeze(-2)) / w_norm.unsqueeze(-1)
+    dz_da = - dz_dw @ skew_matrix(b) @ dx_da
+    dz_db = dz_dw @ skew_x
+    dy_da = skew_z @ dx_da - skew_x @ dz_da
+    dy_db = - skew_x @ dz_db
+
+    J_x = torch.cat((dx_da, torch.zeros_like(dx_da)), dim=-1)
+    J_y = torch.cat((dy_da, dy_db), dim=-1)
+    J_z = torch.cat((dz_da, dz_db), dim=-1)
+    return torch.stack((J_x, J_y, J_z), dim=-3)
+
+
 def euler2quat(xyz, axes='sxyz'):
     """
     euler: sxyz
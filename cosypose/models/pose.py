@@ -1,5 +1,6 @@
 import torch
 from torch import nn
+from contextlib import nullcontext
 
 from cosypose.config import DEBUG_DATA_DIR
 from cosypose.lib3d.camera_geometry import get_K_crop_resize, boxes_from_uv
@@ -37,6 +38,21 @@ class PosePredictor(nn.Module):
         self.debug = False
         self.tmp_debug = dict()
 
+        self.amp_dtype = None
+        self.channels_last = False
+
+    def enable_mixed_precision(self, dtype=torch.float16, channels_last=False):
+        """
+        Runs the backbone and the heads under autocast with dtype (torch.float16 or torch.bfloat16),
+        the crops and pose updates stay in float32.
+        With channels_last, the backbone weights and inputs use the channels-last memory format.
+        """
+        self.amp_dtype = dtype
+        self.channels_last = channels_last
+        if channels_last:
+            self.backbone.to(memory_format=torch.channels_last)
+        return self
+
     def enable_debug(self):
         self.debug = True
 
@@ -91,14 +107,45 @@ class PosePredictor(nn.Module):
         return TCO_updated
 
     def net_forward(self, x):
-        x = self.backbone(x)
-        x = x.flatten(2).mean(dim=-1)
-        outputs = dict()
-        for k, head in self.heads.items():
-            outputs[k] = head(x)
-        return outputs
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        autocast = nullcontext()
+        if self.amp_dtype is not None:
+            autocast = torch.autocast(device_type=x.device.type, dtype=self.amp_dtype)
+        with autocast:
+            x = self.backbone(x)
+            x = x.flatten(2).mean(dim=-1)
+            outputs = dict()
+            for k, head in self.heads.items():
+                outputs[k] = head(x)
+        return {k: v.float() for k, v in outputs.items()}
+
+    def crop_and_render(self, images, K, labels, TCO, asynchronous=False):
+        TCO_input = TCO.detach()
+        images_crop, K_crop, boxes_rend, boxes_crop = self.crop_inputs(
+            images, K, TCO_input, labels
+        )
+        render = self.renderer.render_async if asynchronous else self.renderer.render
+        renders = render(
+            obj_infos=[dict(name=l) for l in labels],
+            TCO=TCO_input,
+            K=K_crop,
+            resolution=self.render_size,
+        )
+        return dict(
+            TCO_input=TCO_input,
+            images_crop=images_crop,
+            K_crop=K_crop,
+            boxes_rend=boxes_rend,
+            boxes_crop=boxes_crop,
+            renders=renders,
+        )
 
-    def forward(self, images, K, labels, TCO, n_iterations=1):
+    def forward(self, images, K, labels, TCO, n_iterations=1, prefetched_inputs=None):
+        """
+        prefetched_inputs: output of crop_and_render(..., asynchronous=True) for
+        the first iteration, used to overlap rendering with other computations.
+        """
         bsz, nchannels, h, w = images.shape
         assert K.shape == (bsz, 3, 3)
         assert TCO.shape == (bsz, 4, 4)
@@ -107,16 +154,17 @@ class PosePredictor(nn.Module):
         outputs = dict()
         TCO_input = TCO
         for n in range(n_iterations):
-            TCO_input = TCO_input.detach()
-            images_crop, K_crop, boxes_rend, boxes_crop = self.crop_inputs(
-                images, K, TCO_input, labels
-            )
-            renders = self.renderer.render(
-                obj_infos=[dict(name=l) for l in labels],
-                TCO=TCO_input,
-                K=K_crop,
-                resolution=self.render_size,
-            )
+            if n == 0 and prefetched_inputs is not None:
+                inputs = dict(prefetched_inputs)
+                inputs["renders"] = inputs["renders"].result()
+            else:
+                inputs = self.crop_and_render(images, K, labels, TCO_input)
+            TCO_input = inputs["TCO_input"]
+            images_crop = inputs["images_crop"]
+            K_crop = inputs["K_crop"]
+            boxes_rend = inputs["boxes_rend"]
+            boxes_crop = inputs["boxes_crop"]
+            renders = inputs["renders"]
 
             x = torch.cat((images_crop, renders), dim=1)
 
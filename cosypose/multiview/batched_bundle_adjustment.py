@@ -0,0 +1,166 @@
+import numpy as np
+import torch
+
+from cosypose.lib3d.transform_ops import compute_transform_from_pose9d
+from cosypose.lib3d.camera_geometry import project_points
+from cosypose.lib3d.symmetric_distances import symmetric_distance_reprojected
+
+from .bundle_adjustment import project_points_pose9d_jacobian, compute_schur_lm_step
+
+from cosypose.utils.logging import get_logger
+from cosypose.utils.timer import Timer
+logger = get_logger(__name__)
+
+
+class BatchedMultiviewRefinement:
+    """
+    Solves several independent MultiviewRefinement problems in a single LM loop.
+    Objects, cameras and candidates of all problems are concatenated, each problem
+    keeps its own lambda schedule and stops updating once it has converged.
+    The LM step (compute_schur_lm_step) is the same as MultiviewRefinement(solver='schur').
+    """
+    def __init__(self, problems):
+        assert len(problems) > 0
+        self.problems = problems
+        self.n_problems = len(problems)
+        self.device, self.dtype = problems[0].device, problems[0].dtype
+        self.mesh_db = problems[0].mesh_db
+        n_points = {problem.n_points for problem in problems}
+        assert len(n_points) == 1, 'All problems must use the same number of points per object.'
+        self.n_points = n_points.pop()
+
+        n_objects = np.array([problem.n_objects for problem in problems])
+        n_views = np.array([problem.n_views for problem in problems])
+        obj_offsets = np.concatenate(([0], np.cumsum(n_objects)[:-1]))
+        view_offsets = np.concatenate(([0], np.cumsum(n_views)[:-1]))
+        self.obj_slices = [slice(o, o + n) for o, n in zip(obj_offsets, n_objects)]
+        self.view_slices = [slice(o, o + n) for o, n in zip(view_offsets, n_views)]
+        self.n_objects = int(n_objects.sum())
+        self.n_views = int(n_views.sum())
+
+        problem_ids = np.arange(self.n_problems)
+        obj_problem = np.repeat(problem_ids, n_objects)
+        view_problem = np.repeat(problem_ids, n_views)
+        view_local = np.concatenate([np.arange(n) for n in n_views])
+        cand_problem = np.concatenate([np.full(problem.n_candidates, n) for n, problem in enumerate(problems)])
+        cand_obj_ids = np.concatenate([np.asarray(problem.cand_obj_ids, dtype=int) + o
+                                       for problem, o in zip(problems, obj_offsets)])
+        cand_view_ids = np.concatenate([np.asarray(problem.cand_view_ids, dtype=int) + o
+                                        for problem, o in zip(problems, view_offsets)])
+        n_per_cand = self.n_points * 2
+        res_cand = np.repeat(np.arange(len(cand_obj_ids)), n_per_cand)
+
+        def as_tensor(x):
+            return torch.as_tensor(x, dtype=torch.long, device=self.device)
+
+        self.obj_problem = as_tensor(obj_problem)
+        self.view_problem = as_tensor(view_problem)
+        self.view_local = as_tensor(view_local)
+        self.cand_obj_ids = as_tensor(cand_obj_ids)
+        self.cand_view_ids = as_tensor(cand_view_ids)
+        self.res_problem = as_tensor(cand_problem[res_cand])
+        self.res_obj = as_tensor(cand_obj_ids[res_cand])
+        self.res_view = as_tensor(cand_view_ids[res_cand])
+        self.n_residuals_per_problem = torch.zeros(
+            self.n_problems, dtype=self.dtype, device=self.device).index_add_(
+                0, self.res_problem, torch.ones(len(res_cand), dtype=self.dtype, device=self.device))
+
+        self.K = torch.cat([problem.K for problem in problems])
+        self.obj_points = torch.cat([problem.obj_points for problem in problems])
+        self.cand_TCO = torch.cat([problem.cand_TCO for problem in problems])
+        self.cand_labels = np.concatenate([np.asarray(problem.cand_labels) for problem in problems])
+
+    def forward_jacobian(self, TWO_9d, TCW_9d, residuals_threshold):
+        TWO = compute_transform_from_pose9d(TWO_9d)
+        TCW = compute_transform_from_pose9d(TCW_9d)
+        TCO = TCW[self.cand_view_ids] @ TWO[self.cand_obj_ids]
+        K = self.K[self.cand_view_ids]
+        _, sym = symmetric_distance_reprojected(self.cand_TCO, TCO, K, self.cand_labels, self.mesh_db)
+        TCO_cand_aligned = self.cand_TCO @ sym
+
+        points = self.obj_points[self.cand_obj_ids]
+        yhat, J_O, J_C = project_points_pose9d_jacobian(
+            points, K, TWO_9d[self.cand_obj_ids], TCW_9d[self.cand_view_ids])
+        y = project_points(points, K, TCO_cand_aligned)
+        errors = (y - yhat).flatten()
+        residuals = torch.min(errors ** 2, torch.ones_like(errors) * residuals_threshold)
+        loss = torch.zeros(self.n_problems, dtype=self.dtype, device=self.device).index_add_(
+            0, self.res_problem, residuals) / self.n_residuals_per_problem
+        return errors, loss, J_O.reshape(-1, 9), J_C.reshape(-1, 9)
+
+    def compute_lm_step(self, errors, J_O, J_C, lambd):
+        return compute_schur_lm_step(
+            errors, J_O, J_C, lambd,
+            res_obj=self.res_obj, res_view=self.res_view,
+            obj_problem=self.obj_problem, view_problem=self.view_problem, view_local=self.view_local,
+        )
+
+    def optimize_lm(self, TWO_9d, TCW_9d,
+                    optimize_cameras=True,
+                    n_iterations=50, residuals_threshold=25,
+                    lambd0=1e-3, L_down=9, L_up=11, eps=1e-5):
+        lambd = torch.full((self.n_problems, ), lambd0, dtype=self.dtype, device=self.device)
+        done = torch.zeros(self.n_problems, dtype=torch.bool, device=self.device)
+        n_steps = torch.zeros(self.n_problems, dtype=torch.long, device=self.device)
+        errors, loss, J_O, J_C = self.forward_jacobian(TWO_9d, TCW_9d, residuals_threshold)
+        for n in range(n_iterations):
+            if done.all():
+                break
+            active = ~done
+            n_steps += active.long()
+            with torch.no_grad():
+                h_O, h_C = self.compute_lm_step(errors, J_O, J_C, lambd)
+            TWO_9d_updated = TWO_9d + h_O
+            TCW_9d_updated = TCW_9d + h_C if optimize_cameras else TCW_9d
+            errors_, next_loss, J_O_, J_C_ = self.forward_jacobian(
+                TWO_9d_updated, TCW_9d_updated, residuals_threshold)
+
+            rho = loss - next_loss
+            converged = active & (rho.abs() < eps)
+            accept = active & ~converged & (rho > eps)
+            reject = active & ~converged & ~accept
+            done = done | converged
+
+            TWO_9d = torch.where(accept[self.obj_problem].unsqueeze(-1), TWO_9d_updated, TWO_9d)
+            TCW_9d = torch.where(accept[self.view_problem].unsqueeze(-1), TCW_9d_updated, TCW_9d)
+            accept_res = accept[self.res_problem]
+            errors = torch.where(accept_res, errors_, errors)
+            J_O = torch.where(accept_res.unsqueeze(-1), J_O_, J_O)
+            J_C = torch.where(accept_res.unsqueeze(-1), J_C_, J_C)
+            loss = torch.where(accept, next_loss, loss)
+            lambd = torch.where(accept, (lambd / L_down).clamp(min=1e-7), lambd)
+            lambd = torch.where(reject, (lambd * L_up).clamp(max=1e7), lambd)
+        return TWO_9d, TCW_9d, dict(loss=loss, lambda_=lambd, n_steps=n_steps, converged=done)
+
+    def solve(self, sample_n_init=1, **lm_kwargs):
+        timer_init = Timer()
+        timer_opt = Timer()
+
+        timer_init.start()
+        inits = [problem.robust_initialization_TWO_TCW(n_init=sample_n_init) for problem in self.problems]
+        TWO_9d_init = torch.cat([TWO_9d for (TWO_9d, _) in inits])
+        TCW_9d_init = torch.cat([TCW_9d for (_, TCW_9d) in inits])
+        time_init = timer_init.stop()
+
+        timer_opt.start()
+        TWO_9d_opt, TCW_9d_opt, infos = self.optimize_lm(TWO_9d_init, TCW_9d_init, **lm_kwargs)
+        time_opt = timer_opt.stop()
+
+        outputs = []
+        for n, problem in enumerate(self.problems):
+            obj_slice, view_slice = self.obj_slices[n], self.view_slices[n]
+            objects, cameras = problem.make_scene_infos(TWO_9d_opt[obj_slice], TCW_9d_opt[view_slice])
+            objects_init, cameras_init = problem.make_scene_infos(TWO_9d_init[obj_slice],
+                                                                  TCW_9d_init[view_slice])
+            outputs.append(dict(
+                objects_init=objects_init,
+                cameras_init=cameras_init,
+                objects=objects,
+                cameras=cameras,
+                loss=infos['loss'][n].item(),
+                n_steps=infos['n_steps'][n].item(),
+                converged=bool(infos['converged'][n].item()),
+                time_init=time_init,
+                time_opt=time_opt,
+            ))
+        return outputs
@@ -9,6 +9,10 @@ import cosypose.utils.tensor_collection as tc
 
 from cosypose.lib3d.transform_ops import invert_T, compute_transform_from_pose9d
 from cosypose.lib3d.camera_geometry import project_points
+from cosypose.lib3d.rotations import (
+    compute_rotation_matrix_from_ortho6d,
+    compute_rotation_matrix_from_ortho6d_jacobian,
+)
 from cosypose.lib3d.symmetric_distances import symmetric_distance_reprojected
 
 from .ransac import make_obj_infos
@@ -35,6 +39,110 @@ def make_view_groups(pairs_TC1C2):
     return view_df
 
 
+def project_points_pose9d_jacobian(points, K, TWO_9d, TCW_9d):
+    """
+    Projects points (N, n_points, 3) with K (N, 3, 3) and TCO = TCW @ TWO given as 9d poses (N, 9).
+    Returns the projections (N, n_points, 2) and their jacobians (N, n_points, 2, 9)
+    w.r.t. TWO_9d and TCW_9d.
+    """
+    n, n_points = points.shape[:2]
+    dtype, device = points.dtype, points.device
+    R_O = compute_rotation_matrix_from_ortho6d(TWO_9d[:, :6])
+    t_O = TWO_9d[:, 6:]
+    R_C = compute_rotation_matrix_from_ortho6d(TCW_9d[:, :6])
+    t_C = TCW_9d[:, 6:]
+    dR_O = compute_rotation_matrix_from_ortho6d_jacobian(TWO_9d[:, :6])
+    dR_C = compute_rotation_matrix_from_ortho6d_jacobian(TCW_9d[:, :6])
+
+    # Points in world and camera frames.
+    points_W = points @ R_O.transpose(-1, -2) + t_O.unsqueeze(1)
+    points_C = points_W @ R_C.transpose(-1, -2) + t_C.unsqueeze(1)
+    suv = points_C @ K.transpose(-1, -2)
+    uv = suv[..., :2] / suv[..., [2]]
+
+    # Derivatives of the projections w.r.t. the points in camera frame, (N, n_points, 2, 3).
+    K_ = K.unsqueeze(1)
+    d_uv_d_pC = (K_[..., :2, :] - uv.unsqueeze(-1) * K_[..., [2], :]) / suv[..., [2]].unsqueeze(-1)
+
+    # Derivatives of the points in camera frame w.r.t. 9d poses, (N, n_points, 3, 9).
+    d_RO_pO = torch.einsum('cpk,ckij->cpij', points, dR_O)
+    d_pC_d_TWO = torch.cat((R_C.unsqueeze(1) @ d_RO_pO,
+                            R_C.unsqueeze(1).expand(n, n_points, 3, 3)), dim=-1)
+    d_pC_d_TCW = torch.cat((torch.einsum('cpk,ckij->cpij', points_W, dR_C),
+                            torch.eye(3, dtype=dtype, device=device).expand(n, n_points, 3, 3)), dim=-1)
+    return uv, d_uv_d_pC @ d_pC_d_TWO, d_uv_d_pC @ d_pC_d_TCW
+
+
+def compute_schur_lm_step(errors, J_O, J_C, lambd, res_obj, res_view,
+                          obj_problem, view_problem, view_local):
+    """
+    LM step (J.t() @ J + lambd * I) h = J.t() @ errors of one or several independent problems
+    whose objects and views are concatenated.
+    Each residual only depends on one object and one view, given by res_obj and res_view,
+    J_O and J_C are the (n_residuals, 9) jacobian blocks w.r.t. this object and view.
+    obj_problem and view_problem are the problem of each object and view, view_local the
+    index of each view in its problem and lambd the (n_problems, ) damping of each problem.
+    The object blocks are eliminated (Schur complement) and the reduced camera system of each
+    problem is solved with Cholesky, the systems are formed and solved in float64.
+    Returns the (n_objects, 9) and (n_views, 9) steps.
+    """
+    out_dtype, device = J_O.dtype, J_O.device
+    dtype = torch.float64
+    J_O, J_C = J_O.to(dtype), J_C.to(dtype)
+    errors = errors.view(-1, 1).to(dtype)
+    lambd = lambd.to(dtype)
+    n_objects, n_views = len(obj_problem), len(view_problem)
+    n_problems = len(lambd)
+    max_n_views = int(view_local.max().item()) + 1 if n_views > 0 else 0
+    res_view_local = view_local[res_view]
+    eye = torch.eye(9, dtype=dtype, device=device)
+
+    def zeros(*shape):
+        return torch.zeros(*shape, dtype=dtype, device=device)
+
+    U = zeros(n_objects, 9, 9).index_add_(0, res_obj, J_O.unsqueeze(-1) * J_O.unsqueeze(-2))
+    V = zeros(n_views, 9, 9).index_add_(0, res_view, J_C.unsqueeze(-1) * J_C.unsqueeze(-2))
+    W = zeros(n_objects * max_n_views, 9, 9).index_add_(
+        0, res_obj * max_n_views + res_view_local, J_O.unsqueeze(-1) * J_C.unsqueeze(-2)
+    ).view(n_objects, max_n_views, 9, 9)
+    b_O = zeros(n_objects, 9).index_add_(0, res_obj, J_O * errors)
+    b_C = zeros(n_views, 9).index_add_(0, res_view, J_C * errors)
+    U = U + lambd[obj_problem].view(-1, 1, 1) * eye
+    V = V + lambd[view_problem].view(-1, 1, 1) * eye
+
+    # Damped object blocks are positive definite.
+    L_U, info_U = torch.linalg.cholesky_ex(U)
+    failed = torch.nonzero(info_U != 0).flatten()
+    if len(failed) > 0:
+        L_U[failed] = torch.linalg.cholesky(U[failed] + 1e-6 * U[failed].diagonal(
+            dim1=-2, dim2=-1).mean(-1).view(-1, 1, 1) * eye + 1e-12 * eye)
+    W_flat = W.permute(0, 2, 1, 3).reshape(n_objects, 9, max_n_views * 9)
+    U_inv_W = torch.cholesky_solve(W_flat, L_U).view(n_objects, 9, max_n_views, 9).permute(0, 2, 1, 3)
+    U_inv_b_O = torch.cholesky_solve(b_O.unsqueeze(-1), L_U).squeeze(-1)
+
+    # Reduced camera systems, padded views have an identity block.
+    S = zeros(n_problems, max_n_views, max_n_views, 9, 9).index_add_(
+        0, obj_problem, - torch.einsum('ovji,owjk->ovwik', W, U_inv_W))
+    diag = eye.repeat(n_problems, max_n_views, 1, 1)
+    diag[view_problem, view_local] = V
+    arange_v = torch.arange(max_n_views, device=device)
+    S[:, arange_v, arange_v] += diag
+    S = S.permute(0, 1, 3, 2, 4).reshape(n_problems, max_n_views * 9, max_n_views * 9)
+    rhs = zeros(n_problems, max_n_views, 9)
+    rhs[view_problem, view_local] = b_C
+    rhs.index_add_(0, obj_problem, - torch.einsum('ovji,oj->ovi', W, U_inv_b_O))
+    rhs = rhs.view(n_problems, -1, 1)
+
+    L, info = torch.linalg.cholesky_ex(S)
+    h_C = torch.cholesky_solve(rhs, L)
+    failed = torch.nonzero(info != 0).flatten()
+    if len(failed) > 0:
+        h_C[failed] = torch.pinverse(S[failed]) @ rhs[failed]
+    h_C = h_C.view(n_problems, max_n_views, 9)
+    h_O = U_inv_b_O - torch.einsum('ovij,ovj->oi', U_inv_W, h_C[obj_problem])
+    return h_O.to(out_dtype), h_C[view_problem, view_local].to(out_dtype)
+
+
 class SamplerError(Exception):
     pass
 
@@ -91,15 +199,13 @@ class MultiviewRefinement:
         return matrix
 
     def make_residuals_ids(self):
-        cand_ids, obj_ids, view_ids, point_ids, xy_ids = [], [], [], [], []
-        for cand_id in range(self.n_candidates):
-            for point_id in range(self.n_points):
-                for xy_id in range(2):
-                    cand_ids.append(cand_id)
-                    obj_ids.append(self.cand_obj_ids[cand_id])
-                    view_ids.append(self.cand_view_ids[cand_id])
-                    point_ids.append(point_id)
-                    xy_ids.append(xy_id)
+        # Residuals are ordered by candidate, then point, then x/y.
+        n_per_cand = self.n_points * 2
+        cand_ids = np.repeat(np.arange(self.n_candidates), n_per_cand)
+        point_ids = np.tile(np.repeat(np.arange(self.n_points), 2), self.n_candidates)
+        xy_ids = np.tile(np.arange(2), self.n_candidates * self.n_points)
+        obj_ids = np.asarray(self.cand_obj_ids, dtype=int).reshape(-1)[cand_ids]
+        view_ids = np.asarray(self.cand_view_ids, dtype=int).reshape(-1)[cand_ids]
         residuals_ids = dict(
             cand_id=cand_ids,
             obj_id=obj_ids,
@@ -107,6 +213,8 @@ class MultiviewRefinement:
             point_id=point_ids,
             xy_id=xy_ids,
         )
+        residuals_ids = {k: torch.as_tensor(v, dtype=torch.long, device=self.device)
+                         for k, v in residuals_ids.items()}
         return residuals_ids
 
     def sample_initial_TWO_TWC(self, seed):
@@ -181,7 +289,7 @@ class MultiviewRefinement:
         ]
 
         n_residuals = len(cand_ids)  # Number of residuals
-        arange_n = torch.arange(n_residuals)
+        arange_n = torch.arange(n_residuals, device=self.device)
 
         TCW_9d = TCW_9d.unsqueeze(0).repeat(n_residuals, 1, 1).requires_grad_()
         TWO_9d = TWO_9d.unsqueeze(0).repeat(n_residuals, 1, 1).requires_grad_()
@@ -213,23 +321,92 @@ class MultiviewRefinement:
 
         return errors, loss, TWO_9d.grad, TCW_9d.grad
 
+    def forward_jacobian_analytic(self, TWO_9d, TCW_9d, residuals_threshold, dense=True):
+        """
+        With dense=False, the jacobians are returned as the (n_residuals, 9) blocks w.r.t.
+        the object and the view of each residual (residuals_ids['obj_id'] and ['view_id'])
+        instead of (n_residuals, n_objects, 9) and (n_residuals, n_views, 9) tensors.
+        """
+        _, TCO_cand_aligned = self.align_TCO_cand(TWO_9d, TCW_9d)
+        cand_view_ids = self.residuals_ids['view_id'][::self.n_points * 2]
+        cand_obj_ids = self.residuals_ids['obj_id'][::self.n_points * 2]
+        K = self.K[cand_view_ids]
+        points = self.obj_points[cand_obj_ids]
+        yhat, J_O, J_C = project_points_pose9d_jacobian(
+            points, K, TWO_9d[cand_obj_ids], TCW_9d[cand_view_ids])
+
+        n_residuals = yhat.numel()
+        J_O, J_C = J_O.reshape(n_residuals, 9), J_C.reshape(n_residuals, 9)
+        if dense:
+            arange_n = torch.arange(n_residuals, device=self.device)
+            J_TWO = torch.zeros(n_residuals, self.n_objects, 9, dtype=self.dtype, device=self.device)
+            J_TCW = torch.zeros(n_residuals, self.n_views, 9, dtype=self.dtype, device=self.device)
+            J_TWO[arange_n, self.residuals_ids['obj_id']] = J_O
+            J_TCW[arange_n, self.residuals_ids['view_id']] = J_C
+        else:
+            J_TWO, J_TCW = J_O, J_C
+
+        y = project_points(points, K, TCO_cand_aligned)
+        errors = (y - yhat).flatten()
+        residuals = (errors ** 2)
+        residuals = torch.min(residuals, torch.ones_like(residuals) * residuals_threshold)
+        loss = residuals.mean()
+        return errors, loss, J_TWO, J_TCW
+
     def compute_lm_step(self, errors, J, lambd):
         errors = errors.view(errors.numel(), 1)
         A = J.t() @ J + lambd * self.idJ
         b = J.t() @ errors
         # Pinverse is faster on CPU.
-        h = torch.pinverse(A.cpu()).cuda() @ b
+        h = torch.pinverse(A.cpu()).to(A.device) @ b
         return h.flatten()
 
+    def compute_lm_step_schur(self, errors, J_O, J_C, lambd):
+        """
+        Same step as compute_lm_step, using the structure of J.t() @ J:
+        each residual only depends on one object and one camera, the object blocks
+        are eliminated (Schur complement) and the reduced camera system is solved with Cholesky.
+        J_O and J_C are the (n_residuals, 9) blocks of forward_jacobian_analytic(..., dense=False).
+        The systems are formed and solved in float64.
+        """
+        obj_ids, view_ids = self.residuals_ids['obj_id'], self.residuals_ids['view_id']
+        n_objects, n_views = self.n_objects, self.n_views
+        zeros = torch.zeros(max(n_objects, n_views), dtype=torch.long, device=self.device)
+        lambd = torch.full((1, ), lambd, dtype=self.dtype, device=self.device)
+        h_O, h_C = compute_schur_lm_step(
+            errors, J_O, J_C, lambd,
+            res_obj=obj_ids, res_view=view_ids,
+            obj_problem=zeros[:n_objects], view_problem=zeros[:n_views],
+            view_local=torch.arange(n_views, device=self.device),
+        )
+        return torch.cat((h_O.flatten(), h_C.flatten()))
+
     def optimize_lm(self, TWO_9d, TCW_9d,
                     optimize_cameras=True,
                     n_iterations=50, residuals_threshold=25,
-                    lambd0=1e-3, L_down=9, L_up=11, eps=1e-5):
+                    lambd0=1e-3, L_down=9, L_up=11, eps=1e-5,
+                    jacobian='autograd', solver='dense'):
         # See http://people.duke.edu/~hpgavin/ce281/lm.pdf
+        assert solver in ('dense', 'schur')
+        if jacobian == 'autograd':
+            forward_jacobian = self.forward_jacobian
+            if solver == 'schur':
+                def forward_jacobian(*args):
+                    # Blocks of the (dense) autograd jacobians used by the Schur solver.
+                    errors, loss, J_TWO, J_TCW = self.forward_jacobian(*args)
+                    arange_n = torch.arange(len(errors), device=self.device)
+                    return (errors, loss, J_TWO[arange_n, self.residuals_ids['obj_id']],
+                            J_TCW[arange_n, self.residuals_ids['view_id']])
+        elif jacobian == 'analytic':
+            def forward_jacobian(*args):
+                return self.forward_jacobian_analytic(*args, dense=solver == 'dense')
+        else:
+            raise ValueError(f'Unknown jacobian: {jacobian}')
         n_params_TWO = TWO_9d.numel()
         n_params_TCW = TCW_9d.numel()
         n_params = n_params_TWO + n_params_TCW
-        self.idJ = torch.eye(n_params).to(self.device).to(self.dtype)
+        if solver == 'dense':
+            self.idJ = torch.eye(n_params).to(self.device).to(self.dtype)
 
         prev_iter_is_update = False
         lambd = lambd0
@@ -238,7 +415,7 @@ class MultiviewRefinement:
         for n in range(n_iterations):
 
             if not prev_iter_is_update:
-                errors, loss, J_TWO, J_TCW = self.forward_jacobian(TWO_9d, TCW_9d, residuals_threshold)
+                errors, loss, J_TWO, J_TCW = forward_jacobian(TWO_9d, TCW_9d, residuals_threshold)
 
             history['TWO_9d'].append(TWO_9d)
             history['TCW_9d'].append(TCW_9d)
@@ -251,8 +428,11 @@ class MultiviewRefinement:
 
             # NOTE: This should not be necessary ?
             with torch.no_grad():
-                J = torch.cat((J_TWO.flatten(-2, -1), J_TCW.flatten(-2, -1)), dim=-1)
-                h = self.compute_lm_step(errors, J, lambd)
+                if solver == 'schur':
+                    h = self.compute_lm_step_schur(errors, J_TWO, J_TCW, lambd)
+                else:
+                    J = torch.cat((J_TWO.flatten(-2, -1), J_TCW.flatten(-2, -1)), dim=-1)
+                    h = self.compute_lm_step(errors, J, lambd)
                 h_TWO_9d = h[:n_params_TWO].view(self.n_objects, 9)
                 h_TCW_9d = h[n_params_TWO:].view(self.n_views, 9)
                 TWO_9d_updated = TWO_9d + h_TWO_9d
@@ -261,7 +441,7 @@ class MultiviewRefinement:
                 else:
                     TCW_9d_updated = TCW_9d
 
-            errors, next_loss, J_TWO, J_TCW = self.forward_jacobian(TWO_9d_updated, TCW_9d_updated, residuals_threshold)
+            errors, next_loss, J_TWO, J_TCW = forward_jacobian(TWO_9d_updated, TCW_9d_updated, residuals_threshold)
 
             rho = loss - next_loss
             if rho.abs() < eps:
@@ -88,6 +88,77 @@ def score_tmaches_batch(candidates, tmatches, TC1C2, mesh_db, bsz=4096):
     return torch.cat(all_dists, dim=0)
 
 
+def adaptive_ransac_scores(candidates, seeds, tmatches, mesh_db,
+                           dist_threshold=0.02, confidence=0.999, chunk_size=32,
+                           model_bsz=1e3, score_bsz=1e5):
+    """
+    Estimates and scores the hypotheses of each view pair by chunks of chunk_size seeds.
+    A view pair stops once enough hypotheses have been scored to reach the target confidence
+    given its best inlier ratio (n_iter >= log(1 - confidence) / log(1 - w^2)).
+    Returns the seeds, tmatches, TC1C2 and dists of the hypotheses that were actually scored.
+    """
+    n_seeds = len(seeds['view1'])
+    hypothesis_id = tmatches['hypothesis_id']
+    views = np.stack((seeds['view1'], seeds['view2']), axis=-1)
+    pair_ids = np.unique(views, axis=0, return_inverse=True)[1].reshape(-1)
+    n_pairs = pair_ids.max() + 1 if n_seeds > 0 else 0
+    # Seeds of a view pair are contiguous.
+    pair_start = np.full(n_pairs, n_seeds)
+    np.minimum.at(pair_start, pair_ids, np.arange(n_seeds))
+    rank = np.arange(n_seeds) - pair_start[pair_ids]
+    # The tmatches of a hypothesis are contiguous and sorted by hypothesis.
+    assert np.all(np.diff(hypothesis_id) >= 0)
+    seed_n_tmatches = np.bincount(hypothesis_id, minlength=n_seeds)
+    seed_offsets = np.concatenate(([0], np.cumsum(seed_n_tmatches)))
+    n_tmatches = seed_n_tmatches[pair_start] if n_pairs > 0 else np.zeros(0)
+
+    poses = candidates.poses
+    TC1C2 = torch.zeros(n_seeds, 4, 4, dtype=poses.dtype, device=poses.device)
+    dists = torch.zeros(len(hypothesis_id), dtype=poses.dtype, device=poses.device)
+    evaluated = np.zeros(n_seeds, dtype=bool)
+    active = np.ones(n_pairs, dtype=bool)
+    best_n_inliers = np.zeros(n_pairs)
+    n_iter = np.zeros(n_pairs, dtype=int)
+
+    for start in range(0, rank.max() + 1 if n_seeds > 0 else 0, chunk_size):
+        seed_ids = np.where(active[pair_ids] & (rank >= start) & (rank < start + chunk_size))[0]
+        if len(seed_ids) == 0:
+            break
+        seeds_ = {k: v[seed_ids] for k, v in seeds.items()}
+        TC1C2[seed_ids] = estimate_camera_poses_batch(candidates, seeds_, mesh_db, bsz=model_bsz)
+        evaluated[seed_ids] = True
+
+        lengths = seed_n_tmatches[seed_ids]
+        mtc_ids = np.arange(lengths.sum()) + np.repeat(
+            seed_offsets[seed_ids] - (np.cumsum(lengths) - lengths), lengths)
+        tmatches_ = {k: v[mtc_ids] for k, v in tmatches.items()}
+        dists_ = score_tmaches_batch(candidates, tmatches_, TC1C2, mesh_db, bsz=score_bsz)
+        dists[mtc_ids] = dists_
+
+        is_inlier = (dists_ <= dist_threshold).cpu().numpy()
+        n_inliers = np.bincount(tmatches_['hypothesis_id'], weights=is_inlier, minlength=n_seeds)
+        np.maximum.at(best_n_inliers, pair_ids[seed_ids], n_inliers[seed_ids])
+        np.add.at(n_iter, pair_ids[seed_ids], 1)
+
+        w = np.clip(best_n_inliers / np.maximum(n_tmatches, 1), 1e-6, 1.)
+        with np.errstate(divide='ignore'):
+            n_required = np.log(1 - confidence) / np.log(1 - w ** 2)
+        active &= n_iter < n_required
+
+    seed_ids = np.where(evaluated)[0]
+    mtc_ids = np.where(evaluated[hypothesis_id])[0]
+    new_ids = np.cumsum(evaluated) - 1
+    seeds = {k: v[seed_ids] for k, v in seeds.items()}
+    tmatches = {k: v[mtc_ids] for k, v in tmatches.items()}
+    tmatches['hypothesis_id'] = new_ids[tmatches['hypothesis_id']].astype(hypothesis_id.dtype)
+    return seeds, tmatches, TC1C2[seed_ids], dists[mtc_ids]
+
+
+def count_ransac_iterations(seeds):
+    infos = pd.DataFrame(dict(view1=seeds['view1'], view2=seeds['view2']))
+    return infos.groupby(['view1', 'view2']).size().rename('n_iter').reset_index()
+
+
 def scene_level_matching(candidates, inliers):
     cand1 = inliers['inlier_matches_cand1']
     cand2 = inliers['inlier_matches_cand2']
@@ -140,7 +211,11 @@ def multiview_candidate_matching(candidates, mesh_db,
                                  dist_threshold=0.02,
                                  cameras=None,
                                  n_ransac_iter=20,
-                                 n_min_inliers=3):
+                                 n_min_inliers=3,
+                                 n_threads=1,
+                                 adaptive=False,
+                                 adaptive_confidence=0.999,
+                                 adaptive_chunk_size=32):
     timer_models = Timer()
     timer_score = Timer()
     timer_misc = Timer()
@@ -157,23 +232,30 @@ def multiview_candidate_matching(candidates, mesh_db,
     timer_misc.pause()
 
     timer_models.start()
-    seeds, tmatches = cosypose_cext.make_ransac_infos(
-        candidates.infos['view_id'].values.tolist(), candidates.infos['label'].values.tolist(),
-        n_ransac_iter, 0,
+    label_ids, _ = pd.factorize(candidates.infos['label'])
+    seeds, tmatches = cosypose_cext.make_ransac_infos_bucketed(
+        candidates.infos['view_id'].values.astype(np.int32), label_ids.astype(np.int32),
+        n_ransac_iter, 0, n_threads,
     )
 
-    if not known_poses:
-        TC1C2 = estimate_camera_poses_batch(candidates, seeds, mesh_db, bsz=model_bsz)
-    else:
+    if known_poses:
         cameras.infos['idx'] = np.arange(len(cameras))
         view_map = cameras.infos.set_index('view_id')
         TWC1 = cameras.TWC[view_map.loc[seeds['view1'], 'idx'].values]
         TWC2 = cameras.TWC[view_map.loc[seeds['view2'], 'idx'].values]
         TC1C2 = invert_T(TWC1) @ TWC2
+    elif not adaptive:
+        TC1C2 = estimate_camera_poses_batch(candidates, seeds, mesh_db, bsz=model_bsz)
     timer_models.pause()
 
     timer_score.start()
-    dists = score_tmaches_batch(candidates, tmatches, TC1C2, mesh_db, bsz=score_bsz)
+    if adaptive and not known_poses:
+        seeds, tmatches, TC1C2, dists = adaptive_ransac_scores(
+            candidates, seeds, tmatches, mesh_db,
+            dist_threshold=dist_threshold, confidence=adaptive_confidence,
+            chunk_size=adaptive_chunk_size, model_bsz=model_bsz, score_bsz=score_bsz)
+    else:
+        dists = score_tmaches_batch(candidates, tmatches, TC1C2, mesh_db, bsz=score_bsz)
 
     inliers = cosypose_cext.find_ransac_inliers(
         seeds['view1'], seeds['view2'],
@@ -192,6 +274,7 @@ def multiview_candidate_matching(candidates, mesh_db,
         filtered_candidates=filtered_candidates,
         scene_infos=scene_infos,
         pairs_TC1C2=pairs_TC1C2,
+        ransac_iterations=count_ransac_iterations(seeds),
         time_models=timer_models.stop(),
         time_score=timer_score.stop(),
         time_misc=timer_misc.stop(),
@@ -31,6 +31,7 @@ class BopRecordingScene(BaseScene):
         border_check=True,
         gpu_renderer=False,
         n_textures_cache=50,
+        max_textures_loaded=200,
         seed=0,
     ):
 
@@ -46,6 +47,7 @@ class BopRecordingScene(BaseScene):
         # Domain randomization
         self.texture_ds = make_texture_dataset(texture_ds)
         self.n_textures_cache = min(n_textures_cache, len(self.texture_ds))
+        self.max_textures_loaded = max(max_textures_loaded, self.n_textures_cache)
         self.domain_randomization = domain_randomization
         self.textures_on_objects = textures_on_objects
 
@@ -57,6 +59,9 @@ class BopRecordingScene(BaseScene):
         self.gpu_renderer = gpu_renderer
 
         # Seeding
+        self.reseed(seed)
+
+    def reseed(self, seed):
         self.np_random = np.random.RandomState(seed)
         pin.seed(seed)
         self.seed = seed
@@ -86,13 +91,30 @@ class BopRecordingScene(BaseScene):
 
     def load_texture_cache(self):
         assert self._connected
-        ds_texture_ids = self.np_random.choice(
-            len(self.texture_ds), size=self.n_textures_cache
-        )
         self.texture_cache = TextureCache(self.texture_ds, self.client_id)
-        [self.texture_cache.get_texture(idx) for idx in ds_texture_ids]
+        self.textures = None
 
-    def connect(self, load=True):
+    def sample_textures(self, np_random):
+        ds_texture_ids = np_random.choice(
+            len(self.texture_ds), size=self.n_textures_cache
+        )
+        ds_texture_ids = list(dict.fromkeys(ds_texture_ids))
+        # Textures loaded for previous samples stay in the cache until there are more than
+        # max_textures_loaded, pybullet can only free them by reconnecting the client.
+        n_missing = len([idx for idx in ds_texture_ids if idx not in self.texture_cache])
+        if len(self.texture_cache) + n_missing > self.max_textures_loaded:
+            self.disconnect()
+            self.connect(load=True, sample_textures=False)
+        self.textures = [self.texture_cache.get_texture(idx) for idx in ds_texture_ids]
+
+    def reseed_textures(self, seed):
+        """
+        Samples the textures used for domain randomization from seed,
+        as connect(load=True) does for a scene created with this seed.
+        """
+        self.sample_textures(np.random.RandomState(seed))
+
+    def connect(self, load=True, sample_textures=True):
         super().connect(gpu_renderer=self.gpu_renderer)
 
         if load:
@@ -101,6 +123,8 @@ class BopRecordingScene(BaseScene):
             self.hide_plane()
             self.load_body_cache()
             self.load_texture_cache()
+            if sample_textures:
+                self.sample_textures(self.np_random)
 
     def disconnect(self):
         super().disconnect()
@@ -117,7 +141,7 @@ class BopRecordingScene(BaseScene):
             bodies = self.bodies + bodies
         for body in bodies:
             apply_random_textures(
-                body, self.texture_cache.cached_textures, np_random=self.np_random
+                body, self.textures, np_random=self.np_random
             )
 
     def objects_pos_orn_rand(self):
@@ -6,8 +6,13 @@ from PIL import Image
 from io import BytesIO
 import sys
 import os
+import time
 
 from deps.cosypose.cosypose.recording.bop_recording_scene import BopRecordingScene
+from deps.cosypose.cosypose.datasets.synthetic_shards import ShardWriter
+
+# One shard writer per process and dataset.
+_SHARD_WRITERS = dict()
 
 
 class SuppressStdout:
@@ -56,23 +61,43 @@ def _get_dic_buf(state, jpeg=True, jpeg_compression=100):
     return pickle.dumps(state)
 
 
-def write_chunk(state_list, seed, ds_dir):
-    key_to_buf = dict()
-    dumps_dir = Path(ds_dir) / "dumps"
-    dumps_dir.mkdir(exist_ok=True)
+def get_shard_writer(ds_dir):
+    shards_dir = Path(ds_dir) / "shards"
+    if shards_dir not in _SHARD_WRITERS:
+        _SHARD_WRITERS[shards_dir] = ShardWriter(shards_dir)
+    return _SHARD_WRITERS[shards_dir]
+
+
+def close_shard_writers():
+    for writer in _SHARD_WRITERS.values():
+        writer.close()
+    _SHARD_WRITERS.clear()
+
+
+def write_buf(key, buf, ds_dir, shard_writer=None):
+    if shard_writer is not None:
+        shard_writer.append(key, buf)
+    else:
+        dumps_dir = Path(ds_dir) / "dumps"
+        dumps_dir.mkdir(exist_ok=True)
+        (dumps_dir / key).with_suffix(".pkl").write_bytes(buf)
 
+
+def write_chunk(state_list, seed, ds_dir, use_shards=False):
+    key_to_buf = dict()
     for n, state in enumerate(state_list):
         key = f"{seed}-{n}"
         key_to_buf[key] = _get_dic_buf(state)
 
     # Write on disk
+    shard_writer = get_shard_writer(ds_dir) if use_shards else None
     for key, buf in key_to_buf.items():
-        (dumps_dir / key).with_suffix(".pkl").write_bytes(buf)
+        write_buf(key, buf, ds_dir, shard_writer=shard_writer)
     keys = list(key_to_buf.keys())
     return keys
 
 
-def record_chunk(ds_dir, scene_kwargs, seed, n_frames):
+def record_chunk(ds_dir, scene_kwargs, seed, n_frames, use_shards=False):
     ds_dir = Path(ds_dir)
     ds_dir.mkdir(exist_ok=True)
 
@@ -84,8 +109,44 @@ def record_chunk(ds_dir, scene_kwargs, seed, n_frames):
     for _ in range(n_frames):
         state = scene.make_new_scene()
         state_list.append(state)
-    keys = write_chunk(state_list, seed, ds_dir)
+    keys = write_chunk(state_list, seed, ds_dir, use_shards=use_shards)
     with SuppressStdout():
         scene.disconnect()
     del scene
     return keys, seed
+
+
+def record_frames(ds_dir, scene_kwargs, tasks, worker_id=0, use_shards=False):
+    """
+    Records the frames of tasks with a single scene that stays connected,
+    so that bodies and textures are only loaded once.
+    tasks yields (seed, frame_ids, n_frames_per_chunk). The textures of a seed are sampled
+    from the seed as in record_chunk (the scene is reconnected when too many textures are
+    loaded), and frame n with the seed seed * n_frames_per_chunk + n,
+    so that the frames do not depend on the worker and any subset of them can be recorded.
+    Each frame is written as soon as it is sampled, yields (seed, key, duration).
+    """
+    ds_dir = Path(ds_dir)
+    ds_dir.mkdir(exist_ok=True)
+    scene = BopRecordingScene(**dict(scene_kwargs, seed=worker_id))
+    with SuppressStdout():
+        scene.connect(load=True, sample_textures=False)
+    shard_writer = None
+    if use_shards:
+        shard_writer = ShardWriter(ds_dir / "shards", name=f"worker{worker_id}-{os.getpid()}")
+    try:
+        for seed, frame_ids, n_frames_per_chunk in tasks:
+            with SuppressStdout():
+                scene.reseed_textures(seed)
+            for n in frame_ids:
+                start = time.time()
+                scene.reseed(seed * n_frames_per_chunk + n)
+                state = scene.make_new_scene()
+                key = f"{seed}-{n}"
+                write_buf(key, _get_dic_buf(state), ds_dir, shard_writer=shard_writer)
+                yield seed, key, time.time() - start
+    finally:
+        if shard_writer is not None:
+            shard_writer.close()
+        with SuppressStdout():
+            scene.disconnect()
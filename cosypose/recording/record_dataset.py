@@ -1,21 +1,32 @@
 import yaml
+import time
+import queue
 import pickle
 import shutil
 from pathlib import Path
 from tqdm import tqdm
 import multiprocessing
 
-from .record_chunk import record_chunk
+from .record_chunk import record_chunk, record_frames, close_shard_writers
+from cosypose.utils.logging import get_logger
+
+logger = get_logger(__name__)
 
 
 def process_seed(args):
-    ds_dir, seed, n_frames_per_chunk, scene_kwargs = args
-    keys, _ = record_chunk(
-        ds_dir=ds_dir,
-        seed=seed,
-        n_frames=n_frames_per_chunk,
-        scene_kwargs=scene_kwargs,
-    )
+    ds_dir, seed, n_frames_per_chunk, scene_kwargs, use_shards = args
+    try:
+        keys, _ = record_chunk(
+            ds_dir=ds_dir,
+            seed=seed,
+            n_frames=n_frames_per_chunk,
+            scene_kwargs=scene_kwargs,
+            use_shards=use_shards,
+        )
+    finally:
+        # Pool workers are terminated without cleanup, the shards are closed after each seed
+        # and the next seed of the process appends to the same shard.
+        close_shard_writers()
     return keys, seed
 
 
@@ -27,6 +38,7 @@ def record_dataset_local(
     start_seed=0,
     resume=False,
     n_workers=4,
+    use_shards=False,
 ):
     seeds = set(range(start_seed, start_seed + n_chunks))
     if resume:
@@ -44,7 +56,7 @@ def record_dataset_local(
                     pool.imap(
                         process_seed,
                         [
-                            (ds_dir, seed, n_frames_per_chunk, scene_kwargs)
+                            (ds_dir, seed, n_frames_per_chunk, scene_kwargs, use_shards)
                             for seed in seeds
                         ],
                     ),
@@ -54,7 +66,7 @@ def record_dataset_local(
     else:
         results = []
         for seed in tqdm(seeds, desc="Processing seeds"):
-            keys, _ = process_seed((ds_dir, seed, n_frames_per_chunk, scene_kwargs))
+            keys, _ = process_seed((ds_dir, seed, n_frames_per_chunk, scene_kwargs, use_shards))
             results.append((keys, seed))
 
     seeds_file = open(  # pylint: disable=unspecified-encoding
@@ -74,6 +86,144 @@ def record_dataset_local(
     return all_keys
 
 
+def _worker_loop(worker_id, ds_dir, scene_kwargs, use_shards, task_queue, result_queue):
+    tasks = iter(task_queue.get, None)
+    for seed, key, duration in record_frames(ds_dir, scene_kwargs, tasks,
+                                             worker_id=worker_id, use_shards=use_shards):
+        result_queue.put((worker_id, seed, key, duration))
+    result_queue.put((worker_id, None, None, None))
+
+
+class RecordingMeter:
+    def __init__(self, n_workers):
+        self.start = time.time()
+        self.n_frames = [0] * n_workers
+        self.busy_time = [0.] * n_workers
+
+    def update(self, worker_id, duration):
+        self.n_frames[worker_id] += 1
+        self.busy_time[worker_id] += duration
+
+    def fps(self):
+        elapsed = max(time.time() - self.start, 1e-6)
+        return [n / elapsed for n in self.n_frames], sum(self.n_frames) / elapsed
+
+    def summary(self):
+        fps_workers, fps = self.fps()
+        return dict(fps=fps, fps_workers=fps_workers, n_frames_workers=self.n_frames,
+                    busy_time_workers=self.busy_time)
+
+
+def record_dataset_workers(
+    ds_dir,
+    scene_kwargs,
+    n_chunks,
+    n_frames_per_chunk,
+    start_seed=0,
+    resume=False,
+    n_workers=4,
+    use_shards=False,
+    log_interval=1000,
+):
+    """
+    Same as record_dataset_local with persistent workers that keep their scene connected
+    and take the next seed from a shared queue when they are done.
+    Frames are written and added to keys_recorded.txt one by one, resuming only records
+    the missing frames of each seed. Frames/sec of each worker are logged every log_interval frames.
+    """
+    ds_dir = Path(ds_dir)
+    done_seeds, done_keys = set(), []
+    if resume:
+        for line in (ds_dir / "seeds_recorded.txt").read_text().strip().split("\n"):
+            if line:
+                done_seeds.add(int(line))
+        done_keys = [k for k in (ds_dir / "keys_recorded.txt").read_text().strip().split("\n") if k]
+    done_keys_set = set(done_keys)
+
+    seeds_file = open(  # pylint: disable=unspecified-encoding
+        ds_dir / "seeds_recorded.txt", "a"
+    )
+    keys_file = open(  # pylint: disable=unspecified-encoding
+        ds_dir / "keys_recorded.txt", "a"
+    )
+
+    tasks, n_missing = [], dict()
+    for seed in range(start_seed, start_seed + n_chunks):
+        if seed in done_seeds:
+            continue
+        frame_ids = [n for n in range(n_frames_per_chunk) if f"{seed}-{n}" not in done_keys_set]
+        if len(frame_ids) > 0:
+            tasks.append((seed, frame_ids, n_frames_per_chunk))
+            n_missing[seed] = len(frame_ids)
+        else:
+            seeds_file.write(f"{seed}\n")
+    n_frames = sum(n_missing.values())
+    logger.info(f"Recording {n_frames} frames ({len(tasks)} seeds) with {n_workers} workers.")
+
+    all_keys = list(done_keys)
+    meter = RecordingMeter(max(n_workers, 1))
+    pbar = tqdm(total=n_frames)
+
+    def on_frame(worker_id, seed, key, duration):
+        all_keys.append(key)
+        keys_file.write(f"{key}\n")
+        keys_file.flush()
+        n_missing[seed] -= 1
+        if n_missing[seed] == 0:
+            seeds_file.write(f"{seed}\n")
+            seeds_file.flush()
+        meter.update(worker_id, duration)
+        pbar.update(1)
+        if pbar.n % log_interval == 0:
+            fps_workers, fps = meter.fps()
+            pbar.set_postfix(fps=f"{fps:.2f}")
+            logger.info(f"{pbar.n}/{n_frames} frames, {fps:.2f} frames/s, per worker: "
+                        + " ".join(f"{f:.2f}" for f in fps_workers))
+
+    if n_workers > 1:
+        task_queue, result_queue = multiprocessing.Queue(), multiprocessing.Queue()
+        for task in tasks:
+            task_queue.put(task)
+        for _ in range(n_workers):
+            task_queue.put(None)
+        workers = [
+            multiprocessing.Process(
+                target=_worker_loop,
+                args=(worker_id, ds_dir, scene_kwargs, use_shards, task_queue, result_queue),
+                daemon=True,
+            )
+            for worker_id in range(n_workers)
+        ]
+        for worker in workers:
+            worker.start()
+        n_running = n_workers
+        while n_running > 0:
+            try:
+                worker_id, seed, key, duration = result_queue.get(timeout=60)
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in workers):
+                    raise RuntimeError("All recording workers died.")
+                continue
+            if key is None:
+                n_running -= 1
+            else:
+                on_frame(worker_id, seed, key, duration)
+        for worker in workers:
+            worker.join()
+    else:
+        for seed, key, duration in record_frames(ds_dir, scene_kwargs, tasks, use_shards=use_shards):
+            on_frame(0, seed, key, duration)
+    pbar.close()
+
+    seeds_file.close()
+    keys_file.close()
+    summary = meter.summary()
+    logger.info(f"Recorded {n_frames} frames, {summary['fps']:.2f} frames/s, per worker: "
+                + " ".join(f"{f:.2f}" for f in summary["fps_workers"]))
+    all_keys = sorted(all_keys, key=lambda k: tuple(map(int, k.split("-"))))
+    return all_keys
+
+
 def record_dataset(args):
     if args.resume and not args.overwrite:
         resume_args = yaml.load(
@@ -95,7 +245,10 @@ def record_dataset(args):
 
     (args.ds_dir / "config.yaml").write_text(yaml.dump(args))
 
-    all_keys = record_dataset_local(
+    record_fn = record_dataset_local
+    if getattr(args, "persistent_workers", False):
+        record_fn = record_dataset_workers
+    all_keys = record_fn(
         ds_dir=args.ds_dir,
         scene_kwargs=args.scene_kwargs,
         start_seed=0,
@@ -103,6 +256,7 @@ def record_dataset(args):
         n_frames_per_chunk=int(args.n_frames_per_chunk),
         resume=args.resume,
         n_workers=args.n_workers,
+        use_shards=getattr(args, "use_shards", False),
     )
 
     n_train = int(args.train_ratio * len(all_keys))
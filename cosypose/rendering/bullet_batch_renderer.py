@@ -1,6 +1,8 @@
 import torch
 import numpy as np
 import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ThreadPoolExecutor
 
 from cosypose.lib3d.transform_ops import invert_T
 from .bullet_scene_renderer import BulletSceneRenderer
@@ -16,43 +18,128 @@ def init_renderer(urdf_ds, preload=True, gpu_renderer=True):
     return renderer
 
 
+class SharedRenderBuffers:
+    """
+    Ring of image/depth slots living in shared memory.
+    Workers write their renderings into a slot and only send back its index.
+    """
+    def __init__(self, n_slots, resolution, shm_names=None):
+        h, w = min(resolution), max(resolution)
+        self.n_slots = n_slots
+        self.resolution = resolution
+        self.images_shape = (n_slots, h, w, 3)
+        self.depths_shape = (n_slots, h, w)
+        create = shm_names is None
+        if create:
+            images_size = int(np.prod(self.images_shape)) * np.dtype(np.uint8).itemsize
+            depths_size = int(np.prod(self.depths_shape)) * np.dtype(np.float32).itemsize
+            self.images_shm = shared_memory.SharedMemory(create=True, size=images_size)
+            self.depths_shm = shared_memory.SharedMemory(create=True, size=depths_size)
+        else:
+            images_name, depths_name = shm_names
+            self.images_shm = shared_memory.SharedMemory(name=images_name)
+            self.depths_shm = shared_memory.SharedMemory(name=depths_name)
+        self.owner = create
+        self.images = np.ndarray(self.images_shape, dtype=np.uint8, buffer=self.images_shm.buf)
+        self.depths = np.ndarray(self.depths_shape, dtype=np.float32, buffer=self.depths_shm.buf)
+
+    def infos(self):
+        return dict(n_slots=self.n_slots, resolution=self.resolution,
+                    shm_names=(self.images_shm.name, self.depths_shm.name))
+
+    def matches(self, resolution):
+        return (min(resolution), max(resolution)) == self.images_shape[1:3]
+
+    def close(self):
+        del self.images, self.depths
+        for shm in (self.images_shm, self.depths_shm):
+            shm.close()
+            if self.owner:
+                shm.unlink()
+
+
+def render_chunk(renderer, kwargs):
+    obj_infos = kwargs["obj_infos"]
+    cam_infos = kwargs["cam_infos"]
+    render_depth = kwargs["render_depth"]
+    res = cam_infos[0]["resolution"]
+    h, w = min(res), max(res)
+    images = np.zeros((len(obj_infos), h, w, 3), dtype=np.uint8)
+    depth = np.zeros((len(obj_infos), h, w), dtype=np.float32)
+    is_valid = np.array([
+        np.isfinite(obj_info["TWO"]).all()
+        and np.isfinite(cam_info["TWC"]).all()
+        and np.isfinite(cam_info["K"]).all()
+        for obj_info, cam_info in zip(obj_infos, cam_infos)
+    ], dtype=bool)
+    valid_ids = np.where(is_valid)[0]
+    if len(valid_ids) > 0:
+        if len(valid_ids) == len(obj_infos):
+            renderer.render_single_objects(
+                obj_infos=obj_infos, cam_infos=cam_infos, render_depth=render_depth,
+                out_images=images, out_depths=depth,
+            )
+        else:
+            cam_obs = renderer.render_single_objects(
+                obj_infos=[obj_infos[n] for n in valid_ids],
+                cam_infos=[cam_infos[n] for n in valid_ids],
+                render_depth=render_depth,
+            )
+            images[valid_ids] = np.stack([d["rgb"] for d in cam_obs])
+            if render_depth:
+                depth[valid_ids] = np.stack([d["depth"] for d in cam_obs])
+    return images, depth if render_depth else None
+
+
 def worker_loop(
-    worker_id, in_queue, out_queue, object_set, preload=True, gpu_renderer=True
+    worker_id, in_queue, out_queue, object_set, preload=True, gpu_renderer=True,
+    shm_infos=None,
 ):
     renderer = init_renderer(object_set, preload=preload, gpu_renderer=gpu_renderer)
+    buffers = SharedRenderBuffers(**shm_infos) if shm_infos is not None else None
     while True:
         kwargs = in_queue.get()
         if kwargs is None:
+            if buffers is not None:
+                buffers.close()
             return
-        obj_infos = kwargs["obj_infos"]
-        cam_infos = kwargs["cam_infos"]
-        render_depth = kwargs["render_depth"]
-        is_valid = (
-            np.isfinite(obj_infos[0]["TWO"]).all()
-            and np.isfinite(cam_infos[0]["TWC"]).all()
-            and np.isfinite(cam_infos[0]["K"]).all()
-        )
-        if is_valid:
-            cam_obs = renderer.render_scene(
-                cam_infos=cam_infos, obj_infos=obj_infos, render_depth=render_depth
-            )
-            images = np.stack([d["rgb"] for d in cam_obs])
-            depth = np.stack([d["depth"] for d in cam_obs]) if render_depth else None
+        images, depth = render_chunk(renderer, kwargs)
+        slots = kwargs.get("slots", None)
+        if slots is not None:
+            buffers.images[slots] = images
+            if kwargs["render_depth"]:
+                buffers.depths[slots] = depth
+            out_queue.put((kwargs["data_ids"], slots, None, None))
         else:
-            res = cam_infos[0]["resolution"]
-            images = np.zeros((1, min(res), max(res), 3), dtype=np.uint8)
-            depth = np.zeros((1, min(res), max(res)), dtype=np.float32)
-        out_queue.put((kwargs["data_id"], images, depth))
+            out_queue.put((kwargs["data_ids"], None, images, depth))
 
 
 class BulletBatchRenderer:
-    def __init__(self, object_set, n_workers=8, preload_cache=True, gpu_renderer=True):
+    def __init__(self, object_set, n_workers=8, preload_cache=True, gpu_renderer=True,
+                 use_shared_memory=False, n_shm_slots=256, shm_resolution=(240, 320),
+                 chunked=False, render_cache=None):
         self.object_set = object_set
         self.n_workers = n_workers
+        self.chunked = chunked
+        self.render_cache = render_cache
+        self.buffers = None
+        if use_shared_memory:
+            self.buffers = SharedRenderBuffers(n_slots=n_shm_slots, resolution=shm_resolution)
         self.init_plotters(preload_cache, gpu_renderer)
         self.gpu_renderer = gpu_renderer
+        # NOTE: All renderings go through a single thread so that requests never interleave
+        # on the queues, render_async lets the caller overlap them with other work.
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def render_async(self, obj_infos, TCO, K, resolution=(240, 320), render_depth=False):
+        return self.executor.submit(self._render, obj_infos=obj_infos, TCO=TCO, K=K,
+                                    resolution=resolution, render_depth=render_depth)
 
     def render(self, obj_infos, TCO, K, resolution=(240, 320), render_depth=False):
+        return self.render_async(obj_infos=obj_infos, TCO=TCO, K=K,
+                                 resolution=resolution, render_depth=render_depth).result()
+
+    def _render(self, obj_infos, TCO, K, resolution=(240, 320), render_depth=False):
         TCO = torch.as_tensor(TCO).detach()
         TOC = invert_T(TCO).cpu().numpy()
         K = torch.as_tensor(K).cpu().numpy()
@@ -60,63 +147,140 @@ class BulletBatchRenderer:
         assert TCO.shape == (bsz, 4, 4)
         assert K.shape == (bsz, 3, 3)
 
-        # NOTE: Could be faster with pytorch 3.8's sharedmemory
-        for n in np.arange(bsz):
-            obj_info = dict(name=obj_infos[n]["name"], TWO=np.eye(4))
-            cam_info = dict(
-                resolution=resolution,
-                K=K[n],
-                TWC=TOC[n],
-            )
-            kwargs = dict(
-                cam_infos=[cam_info], obj_infos=[obj_info], render_depth=render_depth
-            )
+        if self.render_cache is not None:
+            images, depths = self._render_cached(obj_infos, TCO.cpu().numpy(), TOC, K,
+                                                 resolution, render_depth)
+            images = [self._to_tensor(images)]
+            depths = [self._to_tensor(depths) if render_depth else None]
+        else:
+            images, depths = [], []
+            for ids in self._split_ring(np.arange(bsz), resolution):
+                images_, depths_ = self._render_numpy(obj_infos, TOC, K, ids, resolution, render_depth)
+                # The slots of the ring are reused by the next chunk.
+                images.append(self._to_tensor(images_))
+                depths.append(self._to_tensor(depths_) if render_depth else None)
+
+        images = self._cat([im.float().permute(0, 3, 1, 2) / 255 for im in images])
+        if render_depth:
+            depths = self._cat([depth.float() for depth in depths])
+            return images, depths
+        else:
+            return images
+
+    def _render_cached(self, obj_infos, TCO, TOC, K, resolution, render_depth):
+        bsz = len(TCO)
+        h, w = min(resolution), max(resolution)
+        images = np.empty((bsz, h, w, 3), dtype=np.uint8)
+        depths = np.empty((bsz, h, w), dtype=np.float32) if render_depth else None
+        keys = [self.render_cache.make_key(obj_infos[n]["name"], TCO[n], K[n], resolution)
+                for n in range(bsz)]
+        missing_ids = []
+        for n, key in enumerate(keys):
+            entry = self.render_cache.get(key, render_depth=render_depth)
+            if entry is None:
+                missing_ids.append(n)
+            else:
+                images[n] = entry[0]
+                if render_depth:
+                    depths[n] = entry[1]
+        for ids in self._split_ring(np.array(missing_ids, dtype=int), resolution):
+            images_, depths_ = self._render_numpy(obj_infos, TOC, K, ids, resolution, render_depth)
+            images[ids] = images_
+            if render_depth:
+                depths[ids] = depths_
+            for n in ids:
+                self.render_cache.put(keys[n], images[n], depths[n] if render_depth else None)
+        return images, depths
+
+    def _use_shm(self, resolution):
+        return self.buffers is not None and self.buffers.matches(resolution)
+
+    def _split_ring(self, ids, resolution):
+        chunk_size = self.buffers.n_slots if self._use_shm(resolution) else max(len(ids), 1)
+        return [ids[start:start + chunk_size] for start in range(0, len(ids), chunk_size)]
+
+    def _render_numpy(self, obj_infos, TOC, K, ids, resolution, render_depth):
+        if self._use_shm(resolution):
+            return self._render_shm(obj_infos, TOC, K, ids, resolution, render_depth)
+        else:
+            return self._render_queue(obj_infos, TOC, K, ids, resolution, render_depth)
+
+    def _make_kwargs(self, obj_infos, TOC, K, ids, resolution, render_depth):
+        obj_infos_ = [dict(name=obj_infos[n]["name"], TWO=np.eye(4)) for n in ids]
+        cam_infos_ = [dict(resolution=resolution, K=K[n], TWC=TOC[n]) for n in ids]
+        return dict(
+            cam_infos=cam_infos_, obj_infos=obj_infos_, render_depth=render_depth
+        )
+
+    def _split_dispatch(self, positions):
+        if not self.chunked or len(positions) == 0:
+            return [positions[[n]] for n in range(len(positions))]
+        n_chunks = min(max(self.n_workers, 1), len(positions))
+        return np.array_split(positions, n_chunks)
+
+    def _dispatch(self, obj_infos, TOC, K, ids, resolution, render_depth, use_shm):
+        # NOTE: data_ids (and shared memory slots) are positions in ids.
+        n_messages = 0
+        for positions in self._split_dispatch(np.arange(len(ids))):
+            kwargs = self._make_kwargs(obj_infos, TOC, K, ids[positions], resolution, render_depth)
+            kwargs["data_ids"] = positions
+            if use_shm:
+                kwargs["slots"] = positions
             if self.n_workers > 0:
-                kwargs["data_id"] = n
                 self.in_queue.put(kwargs)
             else:
-                cam_obs = self.plotters[0].render_scene(**kwargs)
-                images = np.stack([d["rgb"] for d in cam_obs])
-                depth = (
-                    np.stack([d["depth"] for d in cam_obs]) if render_depth else None
-                )
-                self.out_queue.put((n, images, depth))
+                images, depth = render_chunk(self.plotters[0], kwargs)
+                if use_shm:
+                    self.buffers.images[positions] = images
+                    if render_depth:
+                        self.buffers.depths[positions] = depth
+                    self.out_queue.put((positions, positions, None, None))
+                else:
+                    self.out_queue.put((positions, None, images, depth))
+            n_messages += 1
+        return n_messages
 
-        images = [None for _ in np.arange(bsz)]
-        depths = [None for _ in np.arange(bsz)]
-        for n in np.arange(bsz):
-            data_id, im, depth = self.out_queue.get()
-            images[data_id] = im[0]
+    def _render_queue(self, obj_infos, TOC, K, ids, resolution, render_depth):
+        n_messages = self._dispatch(obj_infos, TOC, K, ids, resolution, render_depth, use_shm=False)
+        h, w = min(resolution), max(resolution)
+        images = np.empty((len(ids), h, w, 3), dtype=np.uint8)
+        depths = np.empty((len(ids), h, w), dtype=np.float32) if render_depth else None
+        for _ in range(n_messages):
+            data_ids, _, im, depth = self.out_queue.get()
+            images[data_ids] = im
             if render_depth:
-                depths[data_id] = depth[0]
+                depths[data_ids] = depth
+        return images, depths
+
+    def _render_shm(self, obj_infos, TOC, K, ids, resolution, render_depth):
+        n_messages = self._dispatch(obj_infos, TOC, K, ids, resolution, render_depth, use_shm=True)
+        for _ in range(n_messages):
+            self.out_queue.get()
+        n_slots = len(ids)
+        images = self.buffers.images[:n_slots]
+        depths = self.buffers.depths[:n_slots] if render_depth else None
+        return images, depths
+
+    def render_cache_stats(self):
+        if self.render_cache is None:
+            return dict()
+        return self.render_cache.stats()
+
+    def _to_tensor(self, array):
+        # NOTE: Always copies, shared memory slots can be reused once the tensor is created.
         if self.gpu_renderer:
-            images = (
-                torch.as_tensor(np.stack(images, axis=0))
-                .pin_memory()
-                .cuda(non_blocking=True)
-            )
+            return torch.as_tensor(array).pin_memory().cuda(non_blocking=True)
         else:
-            images = torch.as_tensor(np.stack(images, axis=0))
-        images = images.float().permute(0, 3, 1, 2) / 255
+            return torch.tensor(array)
 
-        if render_depth:
-            if self.gpu_renderer:
-                depths = (
-                    torch.as_tensor(np.stack(depths, axis=0))
-                    .pin_memory()
-                    .cuda(non_blocking=True)
-                )
-            else:
-                depths = torch.as_tensor(np.stack(depths, axis=0))
-            depths = depths.float()
-            return images, depths
-        else:
-            return images
+    def _cat(self, tensors):
+        return tensors[0] if len(tensors) == 1 else torch.cat(tensors, dim=0)
 
     def init_plotters(self, preload_cache, gpu_renderer):
         self.plotters = []
         self.in_queue = multiprocessing.Queue()
         self.out_queue = multiprocessing.Queue()
+        shm_infos = self.buffers.infos() if self.buffers is not None else None
 
         if self.n_workers > 0:
             for n in range(self.n_workers):
@@ -129,6 +293,7 @@ class BulletBatchRenderer:
                         object_set=self.object_set,
                         preload=preload_cache,
                         gpu_renderer=gpu_renderer,
+                        shm_infos=shm_infos,
                     ),
                 )
                 plotter.start()
@@ -139,14 +304,21 @@ class BulletBatchRenderer:
             ]
 
     def stop(self):
+        if getattr(self, "executor", None) is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
         if self.n_workers > 0:
             for p in self.plotters:
                 self.in_queue.put(None)
             for p in self.plotters:
                 p.join()
                 p.terminate()
+            self.plotters = []
         self.in_queue.close()
         self.out_queue.close()
+        if self.buffers is not None:
+            self.buffers.close()
+            self.buffers = None
 
     def __del__(self):
         self.stop()
@@ -23,6 +23,20 @@ class BulletSceneRenderer(BaseScene):
         if preload_cache:
             self.body_cache.get_bodies_by_ids(np.arange(len(self.urdf_ds)))
         self.background_color = background_color
+        self.cameras = dict()
+        self.buffers = dict()
+
+    def get_camera(self, resolution):
+        key = (min(resolution), max(resolution))
+        if key not in self.cameras:
+            self.cameras[key] = Camera(resolution=resolution, client_id=self.client_id)
+        return self.cameras[key]
+
+    def get_buffers(self, shape):
+        if shape not in self.buffers:
+            self.buffers[shape] = dict(bg_mask=np.empty(shape, dtype=bool),
+                                       tmp_mask=np.empty(shape, dtype=bool))
+        return self.buffers[shape]
 
     def setup_scene(self, obj_infos):
         labels = [obj['name'] for obj in obj_infos]
@@ -35,28 +49,64 @@ class BulletSceneRenderer(BaseScene):
                 pb.changeVisualShape(body.body_id, -1, physicsClientId=0, rgbaColor=color)
         return bodies
 
+    def _postprocess_obs(self, cam_obs_, render_depth=False, out_rgb=None, out_depth=None):
+        if self.background_color is not None:
+            im = cam_obs_['rgb']
+            mask = cam_obs_['mask']
+            buffers = self.get_buffers(mask.shape)
+            bg_mask = buffers['bg_mask']
+            np.less(mask, 0, out=bg_mask)
+            np.logical_or(bg_mask, np.equal(mask, 255, out=buffers['tmp_mask']), out=bg_mask)
+            im[bg_mask] = self.background_color
+            if render_depth:
+                near, far = cam_obs_['near'], cam_obs_['far']
+                # z_n = 2 * depth - 1, z_e = 2 * near * far / (far + near - z_n * (far - near))
+                z_e = cam_obs_['depth']
+                z_e *= -2 * (far - near)
+                z_e += 2 * far
+                np.divide(2 * near * far, z_e, out=z_e)
+                z_e[bg_mask] = 0.
+                cam_obs_['depth'] = z_e
+        if out_rgb is not None:
+            out_rgb[:] = cam_obs_['rgb']
+            cam_obs_['rgb'] = out_rgb
+        if render_depth and out_depth is not None:
+            out_depth[:] = cam_obs_['depth']
+            cam_obs_['depth'] = out_depth
+        return cam_obs_
+
     def render_images(self, cam_infos, render_depth=False):
         cam_obs = []
         for cam_info in cam_infos:
-            K = cam_info['K']
-            TWC = Transform(cam_info['TWC'])
-            resolution = cam_info['resolution']
-            cam = Camera(resolution=resolution, client_id=self.client_id)
-            cam.set_intrinsic_K(K)
-            cam.set_extrinsic_T(TWC)
+            cam = self.get_camera(cam_info['resolution'])
+            cam.set_intrinsic_K(cam_info['K'], cache_proj=True)
+            cam.set_extrinsic_T(Transform(cam_info['TWC']))
             cam_obs_ = cam.get_state()
-            if self.background_color is not None:
-                im = cam_obs_['rgb']
-                mask = cam_obs_['mask']
-                im[np.logical_or(mask < 0, mask == 255)] = self.background_color
-                if render_depth:
-                    depth = cam_obs_['depth']
-                    near, far = cam_obs_['near'], cam_obs_['far']
-                    z_n = 2 * depth - 1
-                    z_e = 2 * near * far / (far + near - z_n * (far - near))
-                    z_e[np.logical_or(mask < 0, mask == 255)] = 0.
-                    cam_obs_['depth'] = z_e
-            cam_obs.append(cam_obs_)
+            cam_obs.append(self._postprocess_obs(cam_obs_, render_depth=render_depth))
+        return cam_obs
+
+    def render_single_objects(self, obj_infos, cam_infos, render_depth=False,
+                              out_images=None, out_depths=None):
+        """
+        Renders each object alone, obj_infos[n] is seen from cam_infos[n].
+        Bodies and cameras are reused across the whole list. If out_images/out_depths
+        are given, the renderings are written directly into them.
+        """
+        assert len(obj_infos) == len(cam_infos)
+        self.body_cache.hide_bodies()
+        cam_obs = []
+        for n, (obj_info, cam_info) in enumerate(zip(obj_infos, cam_infos)):
+            body = self.body_cache.get_body_by_label(obj_info['name'])
+            hidden_pose = body.pose
+            body.pose = Transform(obj_info['TWO'])
+            cam = self.get_camera(cam_info['resolution'])
+            cam.set_intrinsic_K(cam_info['K'], cache_proj=True)
+            cam.set_extrinsic_T(Transform(cam_info['TWC']))
+            cam_obs.append(self._postprocess_obs(
+                cam.get_state(), render_depth=render_depth,
+                out_rgb=out_images[n] if out_images is not None else None,
+                out_depth=out_depths[n] if out_depths is not None else None))
+            body.pose = hidden_pose
         return cam_obs
 
     def render_scene(self, obj_infos, cam_infos, render_depth=False):
@@ -0,0 +1,83 @@
+import hashlib
+import numpy as np
+from pathlib import Path
+from collections import OrderedDict
+
+
+class RenderCache:
+    """
+    Bounded LRU cache of single-object renderings keyed on
+    (label, resolution, rounded TCO, rounded K).
+    Entries evicted from memory are written to cache_dir if it is provided.
+    """
+    def __init__(self, max_size=4096, TCO_decimals=4, K_decimals=2, cache_dir=None):
+        self.max_size = max_size
+        self.TCO_decimals = TCO_decimals
+        self.K_decimals = K_decimals
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(exist_ok=True, parents=True)
+        self.entries = OrderedDict()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.n_hits = 0
+        self.n_disk_hits = 0
+        self.n_misses = 0
+
+    def make_key(self, label, TCO, K, resolution):
+        # NOTE: + 0. maps -0. to 0. so that both give the same bytes.
+        TCO = np.round(np.asarray(TCO, dtype=np.float64), self.TCO_decimals) + 0.
+        K = np.round(np.asarray(K, dtype=np.float64), self.K_decimals) + 0.
+        h, w = min(resolution), max(resolution)
+        return (str(label), h, w, TCO.tobytes(), K.tobytes())
+
+    def _disk_path(self, key):
+        label, h, w, TCO_bytes, K_bytes = key
+        digest = hashlib.sha1(f'{label}/{h}x{w}'.encode() + TCO_bytes + K_bytes).hexdigest()
+        return self.cache_dir / f'{digest}.npz'
+
+    def get(self, key, render_depth=False):
+        entry = self.entries.get(key, None)
+        from_disk = False
+        if entry is None and self.cache_dir is not None:
+            path = self._disk_path(key)
+            if path.exists():
+                with np.load(path) as data:
+                    entry = (data['image'], data['depth'] if 'depth' in data.files else None)
+                from_disk = True
+        if entry is None or (render_depth and entry[1] is None):
+            self.n_misses += 1
+            return None
+        if from_disk:
+            self._insert(key, entry)
+            self.n_disk_hits += 1
+        else:
+            self.entries.move_to_end(key)
+            self.n_hits += 1
+        return entry
+
+    def put(self, key, image, depth=None):
+        image = np.array(image, dtype=np.uint8)
+        depth = np.array(depth, dtype=np.float32) if depth is not None else None
+        self._insert(key, (image, depth))
+
+    def _insert(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            old_key, (image, depth) = self.entries.popitem(last=False)
+            if self.cache_dir is not None:
+                arrays = dict(image=image)
+                if depth is not None:
+                    arrays.update(depth=depth)
+                np.savez(self._disk_path(old_key), **arrays)
+
+    def stats(self):
+        n_requests = self.n_hits + self.n_disk_hits + self.n_misses
+        hit_rate = (self.n_hits + self.n_disk_hits) / n_requests if n_requests > 0 else 0.
+        return dict(n_hits=self.n_hits, n_disk_hits=self.n_disk_hits, n_misses=self.n_misses,
+                    hit_rate=hit_rate, n_entries=len(self.entries))
+
+    def __len__(self):
+        return len(self.entries)
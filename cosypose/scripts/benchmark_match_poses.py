@@ -0,0 +1,61 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+
+from cosypose.evaluation.meters.utils import match_poses, match_poses_iterrows
+from cosypose.utils.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+def make_cand_infos(n_views=100, n_labels=5, max_n_inst=4, seed=0):
+    rng = np.random.RandomState(seed)
+    pred_infos, gt_infos = [], []
+    for view_id in range(n_views):
+        for label in range(n_labels):
+            n_pred, n_gt = rng.randint(0, max_n_inst + 1, size=2)
+            pred_infos += [dict(scene_id=0, view_id=view_id, label=f'obj_{label}',
+                                score=rng.rand()) for _ in range(n_pred)]
+            gt_infos += [dict(scene_id=0, view_id=view_id, label=f'obj_{label}') for _ in range(n_gt)]
+    pred_infos, gt_infos = pd.DataFrame(pred_infos), pd.DataFrame(gt_infos)
+    pred_infos['pred_id'] = np.arange(len(pred_infos))
+    gt_infos['gt_id'] = np.arange(len(gt_infos))
+    cand_infos = pred_infos.merge(gt_infos, on=['scene_id', 'view_id', 'label'])
+    cand_infos['cand_id'] = np.arange(len(cand_infos))
+    errors = rng.choice([0.01, 0.05, np.inf], size=len(cand_infos))
+    cand_infos['error'] = np.where(rng.rand(len(cand_infos)) < 0.5, errors, rng.rand(len(cand_infos)) * 0.1)
+    return cand_infos
+
+
+def main():
+    parser = argparse.ArgumentParser('Benchmark of match_poses against the iterrows implementation')
+    parser.add_argument('--n_views', default=1000, type=int)
+    parser.add_argument('--n_labels', default=10, type=int)
+    parser.add_argument('--max_n_inst', default=4, type=int)
+    parser.add_argument('--seed', default=0, type=int)
+    args = parser.parse_args()
+
+    cand_infos = make_cand_infos(n_views=args.n_views, n_labels=args.n_labels,
+                                 max_n_inst=args.max_n_inst, seed=args.seed)
+    logger.info(f'Number of candidates: {len(cand_infos)}')
+
+    start = time.time()
+    matches_ref = match_poses_iterrows(cand_infos.copy())
+    time_ref = time.time() - start
+
+    start = time.time()
+    matches = match_poses(cand_infos.copy())
+    time_new = time.time() - start
+
+    # NOTE: Recent pandas versions drop the group keys in groupby.apply.
+    columns = [c for c in matches.columns if c in matches_ref.columns]
+    matches_ref = matches_ref.loc[:, columns].astype(matches.dtypes[columns].to_dict())
+    pd.testing.assert_frame_equal(matches_ref, matches.loc[:, columns])
+    logger.info(f'Number of matches: {len(matches)}')
+    logger.info(f'match_poses_iterrows: {time_ref:.3f}s, match_poses: {time_new:.3f}s '
+                f'(x{time_ref / max(time_new, 1e-9):.1f})')
+
+
+if __name__ == '__main__':
+    main()
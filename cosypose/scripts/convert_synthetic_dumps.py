@@ -0,0 +1,23 @@
+import argparse
+from cosypose.config import LOCAL_DATA_DIR
+from cosypose.datasets.synthetic_shards import convert_dumps_to_shards
+from cosypose.utils.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser('Convert the dumps of a synthetic dataset to shards')
+    parser.add_argument('--ds_name', default='', type=str)
+    parser.add_argument('--max_shard_size_gb', default=4, type=float)
+    parser.add_argument('--remove_dumps', action='store_true')
+    args = parser.parse_args()
+
+    ds_dir = LOCAL_DATA_DIR / 'synt_datasets' / args.ds_name
+    convert_dumps_to_shards(ds_dir, max_shard_size=int(args.max_shard_size_gb * 2**30),
+                            remove_dumps=args.remove_dumps)
+    logger.info(f'synthetic.{args.ds_name} now reads frames from the shards.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+import argparse
+from cosypose.datasets.datasets_cfg import make_scene_dataset
+from cosypose.datasets.packed_bop import pack_bop_dataset
+from cosypose.utils.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser('Pack a BOP split into memory-mappable arrays')
+    parser.add_argument('--ds_name', default='tless.primesense.test', type=str)
+    parser.add_argument('--frames_per_shard', default=1000, type=int)
+    parser.add_argument('--n_workers', default=8, type=int)
+    args = parser.parse_args()
+
+    scene_ds = make_scene_dataset(args.ds_name)
+    # The whole split is packed, subsets are selected when loading the packed dataset.
+    pack_dir = scene_ds.ds_dir / f'packed_{scene_ds.split}'
+    scene_ds = scene_ds.__class__(scene_ds.ds_dir, split=scene_ds.split)
+    pack_bop_dataset(scene_ds, pack_dir,
+                     frames_per_shard=args.frames_per_shard,
+                     n_workers=args.n_workers)
+    logger.info(f'Use {args.ds_name}.packed to load it.')
+
+
+if __name__ == '__main__':
+    main()
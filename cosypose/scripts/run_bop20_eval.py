@@ -1,12 +1,12 @@
 import subprocess
 import shutil
 from tqdm import tqdm
-import torch
 import os
 import argparse
 import sys
 from pathlib import Path
 from cosypose.config import PROJECT_DIR, RESULTS_DIR
+from cosypose.evaluation.predictions_store import load_predictions
 
 
 TOOLKIT_DIR = Path(PROJECT_DIR / 'deps' / 'bop_toolkit_challenge')
@@ -45,8 +45,7 @@ def run_evaluation(args):
 
 
 def convert_results(results_path, out_csv_path, method):
-    predictions = torch.load(results_path)['predictions']
-    predictions = predictions[method]
+    predictions = load_predictions(results_path.parent, method, lazy=False)
     print("Predictions from:", results_path)
     print("Method:", method)
     print("Number of predictions: ", len(predictions))
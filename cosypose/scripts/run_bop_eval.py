@@ -2,10 +2,10 @@ import subprocess
 import os
 import argparse
 from tqdm import tqdm
-import torch
 import numpy as np
 from cosypose.bop_toolkit_lib import inout
 from cosypose.config import PROJECT_DIR, LOCAL_DATA_DIR, RESULTS_DIR, MEMORY
+from cosypose.evaluation.predictions_store import load_predictions
 
 SCRIPT_DIR = PROJECT_DIR / "cosypose/bop_toolkit_lib"
 SISO_SCRIPT_PATH = PROJECT_DIR / "cosypose/bop_toolkit_lib/eval_siso.py"
@@ -32,7 +32,7 @@ def main():
 
 @MEMORY.cache
 def convert_results(results_path, out_csv_path, method):
-    predictions = torch.load(results_path)["predictions"][method]
+    predictions = load_predictions(results_path.parent, method, lazy=False)
     print("Predictions from:", results_path)
     print("Method:", method)
     print("Number of predictions: ", len(predictions))
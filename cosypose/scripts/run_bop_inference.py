@@ -33,8 +33,9 @@ from cosypose.training.detector_models_cfg import (
 from cosypose.integrated.detector import Detector
 
 from cosypose.evaluation.pred_runner.bop_predictions import BopPredictionRunner
+from cosypose.evaluation.predictions_store import PredictionsWriter
 
-from cosypose.utils.distributed import get_tmp_dir, get_rank
+from cosypose.utils.distributed import get_tmp_dir, get_rank, get_world_size
 from cosypose.utils.distributed import init_distributed_mode
 
 from cosypose.config import EXP_DIR, RESULTS_DIR
@@ -173,25 +174,38 @@ def run_inference(args):
         }
     )
 
+    save_dir = Path(args.save_dir)
+    predictions_writer = None
+    if args.predictions_store:
+        # Predictions of each batch are written to disk by every rank.
+        predictions_writer = PredictionsWriter(save_dir / "predictions", rank=get_rank(),
+                                               world_size=get_world_size())
+
     all_predictions = dict()
     for pred_prefix, pred_kwargs_n in pred_kwargs.items():
         logger.info(f"Prediction: {pred_prefix}")
-        preds = pred_runner.get_predictions(**pred_kwargs_n)
+        preds = pred_runner.get_predictions(
+            **pred_kwargs_n,
+            predictions_writer=predictions_writer,
+            predictions_prefix=pred_prefix,
+        )
         for preds_name, preds_n in preds.items():
             all_predictions[f"{pred_prefix}/{preds_name}"] = preds_n
 
     logger.info("Done with inference.")
+    if predictions_writer is not None:
+        predictions_writer.close()
     torch.distributed.barrier()
 
     for k, v in all_predictions.items():
         all_predictions[k] = v.gather_distributed(tmp_dir=get_tmp_dir()).cpu()
 
     if get_rank() == 0:
-        save_dir = Path(args.save_dir)
         save_dir.mkdir(exist_ok=True, parents=True)
         logger.info(f"Finished inference on {args.ds_name}")
-        results = format_results(all_predictions, dict(), dict())
-        torch.save(results, save_dir / "results.pth.tar")
+        if not args.predictions_store:
+            results = format_results(all_predictions, dict(), dict())
+            torch.save(results, save_dir / "results.pth.tar")
         (save_dir / "config.yaml").write_text(yaml.dump(args))
         logger.info(f"Saved predictions in {save_dir}")
 
@@ -226,6 +240,7 @@ def main():
     cfg.n_groups = None
     cfg.skip_evaluation = False
     cfg.external_predictions = True
+    cfg.predictions_store = True
 
     cfg.n_coarse_iterations = 1
     cfg.n_refiner_iterations = 4
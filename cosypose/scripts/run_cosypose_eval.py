@@ -212,7 +212,7 @@ def get_pose_meters(scene_ds):
         mesh_db=mesh_db,
         exact_meshes=True,
         sample_n_points=None,
-        errors_bsz=1,
+        errors_bsz=16,
         # BOP-Like parameters
         n_top=n_top,
         visib_gt_min=visib_gt_min,
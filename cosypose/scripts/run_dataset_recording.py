@@ -29,6 +29,8 @@ def make_cfg(
     cfg.distributed = distributed
     cfg.n_workers = 1
     cfg.n_processes_per_gpu = 1
+    cfg.use_shards = False
+    cfg.persistent_workers = False
 
     cfg.scene_kwargs = dict(
         gpu_renderer=False,
@@ -96,6 +98,8 @@ def main():
     parser.add_argument("--debug", action="store_true")
     parser.add_argument("--local", action="store_true")
     parser.add_argument("--overwrite", action="store_true")
+    parser.add_argument("--use_shards", action="store_true")
+    parser.add_argument("--persistent_workers", action="store_true")
     args = parser.parse_args()
 
     print(f"{Fore.RED}using config {args.config} {Style.RESET_ALL}")
@@ -106,6 +110,10 @@ def main():
         distributed=not args.local,
         overwrite=args.overwrite,
     )
+    if args.use_shards:
+        cfg.use_shards = True
+    if args.persistent_workers:
+        cfg.persistent_workers = True
     for k, v in vars(cfg).items():
         print(k, v)
 
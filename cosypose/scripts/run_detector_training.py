@@ -45,6 +45,8 @@ if __name__ == '__main__':
     cfg.rgb_augmentation = True
     cfg.background_augmentation = True
     cfg.gray_augmentation = False
+    cfg.batched_augmentation = False
+    cfg.background_bank = False
 
     # Model
     cfg.backbone_str = 'resnet50-fpn'
@@ -41,6 +41,8 @@ def make_cfg(args):
     cfg.rgb_augmentation = True
     cfg.background_augmentation = True
     cfg.gray_augmentation = False
+    cfg.batched_augmentation = False
+    cfg.background_bank = False
 
     # Model
     cfg.backbone_str = 'efficientnet-b3'
@@ -56,6 +58,9 @@ def make_cfg(args):
     cfg.n_epochs_warmup = 50
     cfg.lr_epoch_decay = 500
     cfg.clip_grad_norm = 0.5
+    cfg.amp = False
+    cfg.amp_dtype = 'float16'
+    cfg.channels_last = False
 
     # Training
     cfg.batch_size = 32
@@ -69,6 +74,7 @@ def make_cfg(args):
     cfg.TCO_input_generator = 'fixed'
     cfg.n_iterations = 1
     cfg.min_area = None
+    cfg.n_objects_per_image = 1
 
     if 'bop-' in args.config:
         from cosypose.bop_config import BOP_CONFIG
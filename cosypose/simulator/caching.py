@@ -46,6 +46,11 @@ class BodyCache:
         bodies = [remaining[label].pop(0) for label in labels]
         return bodies
 
+    def get_body_by_label(self, label):
+        if len(self.cache[label]) == 0:
+            self._load_body(label)
+        return self.cache[label][0]
+
     def get_bodies_by_ids(self, ids):
         labels = [self.urdf_ds[idx]['label'] for idx in ids]
         return self.get_bodies_by_labels(labels)
@@ -71,3 +76,9 @@ class TextureCache:
     @property
     def cached_textures(self):
         return list(self.cache.values())
+
+    def __contains__(self, idx):
+        return idx in self.cache
+
+    def __len__(self):
+        return len(self.cache)
@@ -1,6 +1,7 @@
 import numpy as np
 import pybullet as pb
 import transforms3d
+from functools import lru_cache
 
 from cosypose.lib3d import Transform
 from cosypose.lib3d.rotations import euler2quat
@@ -33,6 +34,21 @@ def proj_from_K(K, h, w, near, far):
     return proj.T
 
 
+@lru_cache(maxsize=4096)
+def _cached_proj_from_K(K_key, h, w, near, far):
+    K = np.array(K_key).reshape(3, 3)
+    proj_mat = proj_from_K(K, h=h, w=w, near=near, far=far).flatten()
+    proj_mat.setflags(write=False)
+    return proj_mat
+
+
+def cached_proj_from_K(K, h, w, near, far, decimals=6):
+    # NOTE: K is quantized so that crops with (almost) identical intrinsics share an entry.
+    K_key = tuple(np.round(np.asarray(K, dtype=np.float64), decimals).flatten().tolist())
+    return _cached_proj_from_K(K_key, int(h), int(w),
+                               round(float(near), decimals), round(float(far), decimals))
+
+
 def K_from_fov(fov, resolution):
     h, w = min(resolution), max(resolution)
     f = h / (2 * np.tan(fov * 0.5 * np.pi / 180))
@@ -106,9 +122,12 @@ class Camera:
         TWC = Transform(R, t)
         self.set_extrinsic_T(TWC)
 
-    def set_intrinsic_K(self, K):
+    def set_intrinsic_K(self, K, cache_proj=False):
         h, w = self._shape
-        proj_mat = proj_from_K(K, near=self._near, far=self._far, h=h, w=w).flatten()
+        if cache_proj:
+            proj_mat = cached_proj_from_K(K, near=self._near, far=self._far, h=h, w=w)
+        else:
+            proj_mat = proj_from_K(K, near=self._near, far=self._far, h=h, w=w).flatten()
         assert np.allclose(proj_mat[11], -1)
         self._proj_mat = proj_mat
         self._K = K
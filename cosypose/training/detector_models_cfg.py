@@ -5,6 +5,10 @@ logger = get_logger(__name__)
 
 
 def check_update_config(cfg):
+    if not hasattr(cfg, 'batched_augmentation'):
+        cfg.batched_augmentation = False
+    if not hasattr(cfg, 'background_bank'):
+        cfg.background_bank = False
     return cfg
 
 
@@ -13,6 +13,16 @@ logger = get_logger(__name__)
 def check_update_config(config):
     if not hasattr(config, 'init_method'):
         config.init_method = 'v0'
+    if not hasattr(config, 'batched_augmentation'):
+        config.batched_augmentation = False
+    if not hasattr(config, 'background_bank'):
+        config.background_bank = False
+    if not hasattr(config, 'n_objects_per_image'):
+        config.n_objects_per_image = 1
+    if not hasattr(config, 'amp'):
+        config.amp = False
+        config.amp_dtype = 'float16'
+        config.channels_last = False
     return config
 
 
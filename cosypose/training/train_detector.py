@@ -157,6 +157,8 @@ def train_detector(args):
         rgb_augmentation=args.rgb_augmentation,
         background_augmentation=args.background_augmentation,
         gray_augmentation=args.gray_augmentation,
+        batched_augmentation=args.batched_augmentation,
+        background_bank=args.background_bank,
         label_to_category_id=label_to_category_id,
     )
     ds_train = DetectionDataset(scene_ds_train, **ds_kwargs)
@@ -247,6 +249,7 @@ def train_detector(args):
             iterator = tqdm(ds_iter_train, ncols=80)
             t = time.time()
             for n, sample in enumerate(iterator):
+                sample = ds_train.augment_batch(sample, device=device)
                 if n > 0:
                     meters_time['data'].add(time.time() - t)
 
@@ -278,6 +281,7 @@ def train_detector(args):
         def validation():
             model.train()
             for sample in tqdm(ds_iter_val, ncols=80):
+                sample = ds_val.augment_batch(sample, device=device)
                 loss = h(data=sample, meters=meters_val)
                 meters_val['loss_total'].add(loss.item())
 
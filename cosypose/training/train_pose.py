@@ -232,18 +232,23 @@ def train_pose(args):
         background_augmentation=args.background_augmentation,
         min_area=args.min_area,
         gray_augmentation=args.gray_augmentation,
+        batched_augmentation=args.batched_augmentation,
+        background_bank=args.background_bank,
+        n_objects_per_image=args.n_objects_per_image,
     )
     ds_train = PoseDataset(scene_ds_train, **ds_kwargs)
     ds_val = PoseDataset(scene_ds_val, **ds_kwargs)
 
-    train_sampler = PartialSampler(ds_train, epoch_size=args.epoch_size)
-    ds_iter_train = DataLoader(ds_train, sampler=train_sampler, batch_size=args.batch_size,
+    # With several objects per image, batches and epochs have the same number of objects.
+    frames_per_batch = max(args.batch_size // args.n_objects_per_image, 1)
+    train_sampler = PartialSampler(ds_train, epoch_size=args.epoch_size // args.n_objects_per_image)
+    ds_iter_train = DataLoader(ds_train, sampler=train_sampler, batch_size=frames_per_batch,
                                num_workers=args.n_dataloader_workers, collate_fn=ds_train.collate_fn,
                                drop_last=False, pin_memory=True)
     ds_iter_train = MultiEpochDataLoader(ds_iter_train)
 
-    val_sampler = PartialSampler(ds_val, epoch_size=int(0.1 * args.epoch_size))
-    ds_iter_val = DataLoader(ds_val, sampler=val_sampler, batch_size=args.batch_size,
+    val_sampler = PartialSampler(ds_val, epoch_size=int(0.1 * args.epoch_size) // args.n_objects_per_image)
+    ds_iter_val = DataLoader(ds_val, sampler=val_sampler, batch_size=frames_per_batch,
                              num_workers=args.n_dataloader_workers, collate_fn=ds_val.collate_fn,
                              drop_last=False, pin_memory=True)
     ds_iter_val = MultiEpochDataLoader(ds_iter_val)
@@ -254,6 +259,9 @@ def train_pose(args):
     mesh_db = MeshDataBase.from_object_ds(object_ds).batched(n_sym=args.n_symmetries_batch).cuda().float()
 
     model = create_model_pose(cfg=args, renderer=renderer, mesh_db=mesh_db).cuda()
+    if args.amp or args.channels_last:
+        amp_dtype = getattr(torch, args.amp_dtype) if args.amp else None
+        model.enable_mixed_precision(dtype=amp_dtype, channels_last=args.channels_last)
 
     eval_bundle = make_eval_bundle(args, model)
 
@@ -280,6 +288,8 @@ def train_pose(args):
 
     # Optimizer
     optimizer = torch.optim.Adam(model.parameters(), lr=args.lr, weight_decay=args.weight_decay)
+    # Loss scaling is only needed for float16, the scaler does nothing when disabled.
+    scaler = torch.amp.GradScaler('cuda', enabled=args.amp and args.amp_dtype == 'float16')
 
     # Warmup
     if args.n_epochs_warmup == 0:
@@ -311,6 +321,7 @@ def train_pose(args):
             iterator = tqdm(ds_iter_train, ncols=80)
             t = time.time()
             for n, sample in enumerate(iterator):
+                sample = ds_train.augment_batch(sample, device=device)
                 if n > 0:
                     meters_time['data'].add(time.time() - t)
 
@@ -323,12 +334,14 @@ def train_pose(args):
                 meters_train['loss_total'].add(loss.item())
 
                 t = time.time()
-                loss.backward()
+                scaler.scale(loss).backward()
+                scaler.unscale_(optimizer)
                 total_grad_norm = torch.nn.utils.clip_grad_norm_(
                     model.parameters(), max_norm=args.clip_grad_norm, norm_type=2)
                 meters_train['grad_norm'].add(torch.as_tensor(total_grad_norm).item())
 
-                optimizer.step()
+                scaler.step(optimizer)
+                scaler.update()
                 meters_time['backward'].add(time.time() - t)
                 meters_time['memory'].add(torch.cuda.max_memory_allocated() / 1024. ** 2)
 
@@ -342,6 +355,7 @@ def train_pose(args):
         def validation():
             model.eval()
             for sample in tqdm(ds_iter_val, ncols=80):
+                sample = ds_val.augment_batch(sample, device=device)
                 loss = h(data=sample, meters=meters_val)
                 meters_val['loss_total'].add(loss.item())
 
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+import torch
+
+pytest.importorskip('pybullet')
+from cosypose.rendering import bullet_batch_renderer  # noqa: E402
+
+
+class IdRenderer:
+    """ Renders object <n> as an image and depth filled with n. """
+    def render_single_objects(self, obj_infos, cam_infos, render_depth=False,
+                              out_images=None, out_depths=None):
+        for n, obj_info in enumerate(obj_infos):
+            out_images[n] = int(obj_info['name'])
+            out_depths[n] = int(obj_info['name'])
+
+
+@pytest.fixture
+def make_renderer(monkeypatch):
+    monkeypatch.setattr(bullet_batch_renderer, 'init_renderer', lambda *args, **kwargs: IdRenderer())
+    renderers = []
+
+    def make_renderer(**kwargs):
+        renderer = bullet_batch_renderer.BulletBatchRenderer(
+            object_set=None, n_workers=0, gpu_renderer=False, shm_resolution=(4, 6), **kwargs)
+        renderers.append(renderer)
+        return renderer
+    yield make_renderer
+    for renderer in renderers:
+        renderer.stop()
+
+
+def render(renderer, names):
+    bsz = len(names)
+    TCO = torch.eye(4).repeat(bsz, 1, 1)
+    K = torch.eye(3).repeat(bsz, 1, 1)
+    return renderer.render([dict(name=str(name)) for name in names], TCO, K,
+                           resolution=(4, 6), render_depth=True)
+
+
+@pytest.mark.parametrize('use_shared_memory', [False, True])
+def test_render_more_than_ring_slots(make_renderer, use_shared_memory):
+    renderer = make_renderer(use_shared_memory=use_shared_memory, n_shm_slots=4)
+    names = np.arange(1, 11)
+    images, depths = render(renderer, names)
+    assert images.shape == (10, 3, 4, 6)
+    assert np.array_equal(depths[:, 0, 0].numpy(), names)
+    assert np.allclose(images[:, 0, 0, 0].numpy() * 255, names)
+
+
+@pytest.mark.parametrize('use_shared_memory', [False, True])
+def test_renders_are_not_overwritten(make_renderer, use_shared_memory):
+    renderer = make_renderer(use_shared_memory=use_shared_memory, n_shm_slots=4)
+    _, depths = render(renderer, [1, 2, 3])
+    render(renderer, [50, 50])
+    assert np.array_equal(depths[:, 0, 0].numpy(), [1, 2, 3])
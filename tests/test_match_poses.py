@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from cosypose.evaluation.meters.utils import match_poses, match_poses_iterrows
+
+
+def make_cand_infos(seed, n_groups=4, n_preds=30, n_gts=20):
+    rng = np.random.RandomState(seed)
+    pred_groups = rng.randint(n_groups, size=n_preds)
+    gt_groups = rng.randint(n_groups, size=n_gts)
+    # The reference sorts scores with an unstable sort, keep them distinct.
+    scores = rng.permutation(n_preds) / n_preds
+    rows = []
+    for pred_id, (pred_group, score) in enumerate(zip(pred_groups, scores)):
+        # Rounded errors produce ties.
+        for gt_id in np.where(gt_groups == pred_group)[0]:
+            error = np.round(rng.rand(), 1) if rng.rand() > 0.2 else np.inf
+            rows.append(dict(scene_id=0, view_id=int(pred_group // 2),
+                             label=f'obj_{pred_group % 2}',
+                             pred_id=pred_id, gt_id=gt_id, score=score, error=error))
+    cand_infos = pd.DataFrame(rows)
+    # Candidates with a missing group key.
+    cand_infos.loc[rng.rand(len(cand_infos)) < 0.2, 'view_id'] = np.nan
+    return cand_infos
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_match_poses_matches_iterrows(seed):
+    cand_infos = make_cand_infos(seed)
+    assert cand_infos['view_id'].isna().any()
+    keys = ['pred_id', 'gt_id']
+    matches = match_poses(cand_infos.copy())
+    matches_ref = match_poses_iterrows(cand_infos.copy())
+    matches = matches[keys].astype(int).sort_values(keys).reset_index(drop=True)
+    matches_ref = matches_ref[keys].astype(int).sort_values(keys).reset_index(drop=True)
+    assert len(matches) > 0
+    pd.testing.assert_frame_equal(matches, matches_ref)